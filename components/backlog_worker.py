@@ -0,0 +1,186 @@
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from utils.config import (
+    BACKLOG_BATCH_SIZE, BACKLOG_LEASE_SECONDS, BACKLOG_IDLE_SECONDS, BACKLOG_SCORING_PROCESSES
+)
+from components.chat_analysis import ChatAnalyzer, ResultWriter
+
+# ChatAnalyzer แบบให้คะแนนอย่างเดียวของ process ลูก (สร้างครั้งเดียวตอนเริ่ม process)
+_scoring_analyzer: Optional[ChatAnalyzer] = None
+
+def _init_scoring_process():
+    global _scoring_analyzer
+    _scoring_analyzer = ChatAnalyzer.scoring_only()
+
+def _score_chunk(messages: List[str]) -> List[Tuple[str, float]]:
+    """ให้คะแนน sentiment ของข้อความส่วนหนึ่ง คืนค่า (sentiment, sentiment_score) ตามลำดับ"""
+    analyzer = _scoring_analyzer or ChatAnalyzer.scoring_only()
+    scored = analyzer.score_messages(messages)
+    return list(zip(scored['sentiment'].tolist(), scored['sentiment_score'].tolist()))
+
+class BacklogWorker:
+    """
+    ประมวลผลข้อความลูกค้าที่ค้างอยู่ (processed_at IS NULL) นอก Streamlit
+
+    แต่ละรอบ:
+    1. จองข้อความ (lease) ด้วย token ของรอบนี้ - worker อื่นจะข้ามข้อความที่จองไว้จนกว่าจะหมดเวลา
+    2. อ่านการตั้งค่าครั้งเดียว
+    3. ให้คะแนน sentiment ใน process pool พร้อมกับสร้าง embedding (get_embeddings ใช้ thread/async)
+    4. เขียนผลกลับแบบ bulk เฉพาะข้อความที่ยังถูกจองโดย token นี้ แล้วยกเลิกการจองที่เหลือ
+
+    รันหลายตัวบนหลายเครื่องพร้อมกันได้โดยไม่ประมวลผลซ้ำ ถ้า worker หยุดกลางทาง
+    ข้อความที่จองไว้จะถูกจองใหม่ได้เมื่อหมดเวลา แต่ละรอบจึงต้องเสร็จภายใน lease_seconds
+    embedding ใหม่ไม่ถูกเพิ่มเข้า vector index ของ worker (แอปดึงจากฐานข้อมูลตาม processed_at เอง)
+    """
+
+    def __init__(self, db_manager, analyzer: ChatAnalyzer, batch_size: int = BACKLOG_BATCH_SIZE,
+                 lease_seconds: int = BACKLOG_LEASE_SECONDS, processes: int = BACKLOG_SCORING_PROCESSES,
+                 worker_id: Optional[str] = None):
+        self.db_manager = db_manager
+        self.analyzer = analyzer
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.processes = processes
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._pool = (
+            ProcessPoolExecutor(max_workers=processes, initializer=_init_scoring_process)
+            if processes > 0 else None
+        )
+
+        self.batches = 0
+        self.claimed = 0
+        self.written = 0
+        self.embedded = 0
+        self.sketches_compacted = 0
+        # เวลารวมของแต่ละขั้นตอน (score = เวลาที่ยังต้องรอคะแนนหลังได้ embedding แล้ว)
+        self.stage_seconds = {'claim': 0.0, 'score': 0.0, 'embed': 0.0, 'write': 0.0}
+
+    def close(self):
+        """ปิด process pool"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _submit_scoring(self, messages: List[str]) -> List[Future]:
+        """แบ่งข้อความให้แต่ละ process ให้คะแนน (ไม่มี pool = ให้คะแนนทันทีใน process นี้)"""
+        if self._pool is None:
+            future: Future = Future()
+            future.set_result(_score_chunk(messages))
+            return [future]
+
+        chunk_size = -(-len(messages) // self.processes)
+        return [
+            self._pool.submit(_score_chunk, messages[start:start + chunk_size])
+            for start in range(0, len(messages), chunk_size)
+        ]
+
+    def process_batch(self) -> Dict[str, Any]:
+        """
+        จองและประมวลผลข้อความหนึ่งรอบ
+        คืนค่า dict: claimed (จำนวนที่จองได้ 0 = ไม่มีข้อความค้าง), written, embedded, seconds
+        """
+        started = time.perf_counter()
+        claim_token = f"{self.worker_id[:60]}:{uuid.uuid4().hex}"
+
+        try:
+            rows = self.db_manager.claim_unprocessed_messages(claim_token, self.batch_size, self.lease_seconds)
+            claimed_at = time.perf_counter()
+            self.stage_seconds['claim'] += claimed_at - started
+            if not rows:
+                return {'claimed': 0, 'written': 0, 'embedded': 0, 'seconds': claimed_at - started}
+
+            ids = [row['id'] for row in rows]
+            messages = [row['message'] or '' for row in rows]
+            settings = self.db_manager.get_settings()
+
+            # ให้คะแนนใน process pool ระหว่างรอ model server
+            score_futures = self._submit_scoring(messages)
+
+            embed_started = time.perf_counter()
+            if settings.get('embedding_enabled', True):
+                embeddings = self.analyzer.get_embeddings(messages)
+            else:
+                embeddings = [None] * len(messages)
+            embed_finished = time.perf_counter()
+            self.stage_seconds['embed'] += embed_finished - embed_started
+
+            scores = [score for future in score_futures for score in future.result()]
+            scored_at = time.perf_counter()
+            self.stage_seconds['score'] += scored_at - embed_finished
+
+            embedded = 0
+            with ResultWriter(self.db_manager, claim_token=claim_token) as writer:
+                for conversation_id, (sentiment, score), embedding in zip(ids, scores, embeddings):
+                    writer.add_sentiment(conversation_id, sentiment, score)
+                    if embedding:
+                        writer.add_embedding(conversation_id, embedding)
+                        embedded += 1
+            finished = time.perf_counter()
+            self.stage_seconds['write'] += finished - scored_at
+
+            self.batches += 1
+            self.claimed += len(rows)
+            self.written += writer.written_count
+            self.embedded += embedded
+            return {
+                'claimed': len(rows),
+                'written': writer.written_count,
+                'embedded': embedded,
+                'seconds': finished - started,
+            }
+        finally:
+            # ข้อความที่ยังไม่ได้เขียน (ล้มเหลว) ให้ worker อื่นจองได้ทันทีไม่ต้องรอหมดเวลา
+            self.db_manager.release_message_claims(claim_token)
+
+    def run(self, once: bool = False, idle_seconds: float = BACKLOG_IDLE_SECONDS,
+            max_batches: Optional[int] = None) -> int:
+        """
+        ประมวลผลไปเรื่อย ๆ (once=True: หยุดเมื่อไม่มีข้อความค้าง) คืนค่าจำนวนข้อความที่เขียนผลแล้ว
+        """
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            # merge user/conversation ที่เพิ่ง insert เข้า sketch ของ dashboard (ไม่ทำตอน insert)
+            self.sketches_compacted += self.db_manager.compact_daily_sketches()
+
+            try:
+                result = self.process_batch()
+            except Exception as e:
+                print(f"Error processing backlog batch: {str(e)}")
+                result = {'claimed': 0}
+
+            if result['claimed']:
+                batches += 1
+                print(f"✅ [{self.worker_id}] ประมวลผล {result['written']}/{result['claimed']} ข้อความ "
+                      f"(embedding {result['embedded']}) ใน {result['seconds']:.1f}s")
+                continue
+
+            if once:
+                break
+            time.sleep(idle_seconds)
+
+        return self.written
+
+    def stats(self) -> Dict[str, Any]:
+        """จำนวนข้อความที่ประมวลผลและเวลารวมของแต่ละขั้นตอน"""
+        busy_seconds = sum(self.stage_seconds.values())
+        return {
+            'worker_id': self.worker_id,
+            'batches': self.batches,
+            'claimed': self.claimed,
+            'written': self.written,
+            'embedded': self.embedded,
+            'sketches_compacted': self.sketches_compacted,
+            'stage_seconds': dict(self.stage_seconds),
+            'messages_per_second': self.written / busy_seconds if busy_seconds else 0.0,
+        }
@@ -1,13 +1,395 @@
 import pandas as pd
 import numpy as np
-import requests
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Sequence, Union
+from collections import Counter, deque
+import queue
 import re
+import threading
+import time
+import uuid
 from sqlalchemy import text
-from utils.config import EMBEDDING_API_URL, EMBEDDING_MODEL, CHAT_API_URL, CHAT_MODEL
+from utils.config import (
+    EMBEDDING_API_URL, EMBEDDING_BATCH_API_URL, EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MODEL, CHAT_API_URL, CHAT_MODEL, RESULT_WRITE_BATCH_SIZE, SCORING_CHUNK_SIZE,
+    SIMILARITY_THRESHOLD, VECTOR_SYNC_BATCH_SIZE, VECTOR_SYNC_OVERLAP_SECONDS, VECTOR_SYNC_MIN_INTERVAL_SECONDS,
+    VECTOR_INDEX_TYPE, VECTOR_INDEX_DIR, BACKLOG_LEASE_SECONDS, PIPELINE_QUEUE_SIZE, PIPELINE_SCORE_BATCH_SIZE,
+    PIPELINE_EMBED_BATCH_SIZE, PIPELINE_FLUSH_SECONDS, PIPELINE_LATENCY_SAMPLES, PIPELINE_SKIPPABLE_STAGES
+)
+from utils.vector_codec import decode_vector
+from utils.embedding_cache import EmbeddingCache, make_cache_key, normalize_text
+from utils.model_client import get_model_client, get_async_model_client
+from utils.circuit_breaker import CircuitOpenError
+from utils.keyword_matcher import KeywordMatcher
+from utils.thai_tokenizer import tokenize
+from components.vector_index import VectorMatrixIndex, IVFIndex
+from components.database import DATE_RANGE_FILTER, DAY_RANGE_FILTER, LOCAL_TZ, date_range_params, day_range_params
+
+class ResultWriter:
+    """
+    สะสมผล sentiment/embedding ของแต่ละข้อความ แล้วเขียนกลับฐานข้อมูลทีละ batch
+    ใช้แทนการเรียก update_conversation_sentiment/update_conversation_embedding ทีละแถว
+    """
+    
+    def __init__(self, db_manager, batch_size: int = RESULT_WRITE_BATCH_SIZE,
+                 claim_token: Optional[str] = None):
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.claim_token = claim_token  # เขียนเฉพาะข้อความที่ยังถูกจองโดย token นี้ (ดู claim_unprocessed_messages)
+        self.pending: Dict[int, Dict[str, Any]] = {}
+        self.written_count = 0
+    
+    def add_sentiment(self, conversation_id: int, sentiment: str, sentiment_score: float):
+        """เพิ่มผล sentiment ของข้อความ"""
+        record = self.pending.setdefault(conversation_id, {'id': conversation_id})
+        record['sentiment'] = sentiment
+        record['sentiment_score'] = sentiment_score
+        self._flush_if_full()
+    
+    def add_embedding(self, conversation_id: int, embedding: List[float]):
+        """เพิ่ม embedding ของข้อความ"""
+        record = self.pending.setdefault(conversation_id, {'id': conversation_id})
+        record['embedding'] = embedding
+        self._flush_if_full()
+    
+    def _flush_if_full(self):
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+    
+    def flush(self) -> int:
+        """เขียนผลที่ค้างอยู่ทั้งหมดกลับฐานข้อมูล คืนค่าจำนวนข้อความที่เขียน"""
+        if not self.pending:
+            return 0
+        
+        results = list(self.pending.values())
+        self.pending = {}
+        written = self.db_manager.update_conversation_results_bulk(results, claim_token=self.claim_token)
+        self.written_count += written
+        return written
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+# จุดสิ้นสุดของคิวใน MessagePipeline (ขั้นตอนที่ส่งเข้าคิวส่งค่านี้เมื่อไม่มีรายการเหลือ)
+_END_OF_STREAM = object()
+
+class PipelineStageStats:
+    """ตัวนับของหนึ่งขั้นตอนใน MessagePipeline (thread-safe)"""
+    
+    def __init__(self, name: str, latency_samples: int = PIPELINE_LATENCY_SAMPLES):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_seconds = 0.0  # เวลาที่ทำงานจริง (ไม่รวมเวลารอคิว)
+        self.blocked_seconds = 0.0  # เวลาที่รอเพราะคิวของขั้นตอนถัดไปเต็ม (backpressure)
+        # เวลาตั้งแต่อ่านข้อความจนขั้นตอนนี้ทำเสร็จ (ms) ของรายการล่าสุด
+        self._latencies: deque = deque(maxlen=latency_samples)
+        self._lock = threading.Lock()
+    
+    def record(self, read_times: Sequence[float], busy_seconds: float, errors: int = 0):
+        """บันทึกผลของ batch หนึ่ง (read_times = เวลาที่อ่านแต่ละรายการที่สำเร็จ จาก time.perf_counter)"""
+        now = time.perf_counter()
+        with self._lock:
+            self.items += len(read_times)
+            self.batches += 1
+            self.errors += errors
+            self.busy_seconds += busy_seconds
+            self._latencies.extend((now - read_at) * 1000 for read_at in read_times)
+    
+    def add_blocked(self, seconds: float):
+        with self._lock:
+            self.blocked_seconds += seconds
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """จำนวนรายการ, throughput (รายการ/วินาทีของเวลาทำงาน) และ latency ตั้งแต่อ่านข้อความ"""
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                'items': self.items,
+                'batches': self.batches,
+                'errors': self.errors,
+                'busy_seconds': self.busy_seconds,
+                'blocked_seconds': self.blocked_seconds,
+                'items_per_second': self.items / self.busy_seconds if self.busy_seconds else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+                'latency_p95_ms': float(np.percentile(latencies, 95)) if latencies else 0.0,
+            }
+
+class MessagePipeline:
+    """
+    ประมวลผลข้อความแบบ stream: read -> normalize -> score -> embed -> write
+    
+    - แต่ละขั้นตอนเป็น thread หนึ่งตัว เชื่อมกันด้วยคิวที่จำกัดขนาด
+    - backpressure: มีข้อความที่อ่านแล้วแต่ยังไม่จบทุกขั้นตอนได้ไม่เกิน queue_size ข้อความ
+      เมื่อเต็ม read ต้องรอ (ไม่ใช่ score) ข้อความที่อ่านแล้วจึงได้ sentiment ทันทีแม้ embed จะช้า
+    - score ส่งผล sentiment ไป write โดยตรงและส่งข้อความต่อให้ embed พร้อมกัน
+      write ส่ง batch ที่ยังไม่เต็มเมื่อครบ flush_seconds embedding ที่ช้าจึงไม่ถ่วงการอัปเดต sentiment
+    - score, embed และ write ทำงานเป็น batch (score_messages, get_embeddings และ ResultWriter)
+    - ข้ามขั้นตอนได้ด้วย setting pipeline_skip_stages (normalize/score/embed)
+      embed ถูกข้ามเมื่อปิด embedding_enabled ด้วย
+    - stats() คืนจำนวนรายการ, throughput และ latency ของแต่ละขั้นตอน
+    """
+    
+    STAGES = ('read', 'normalize', 'score', 'embed', 'write')
+    
+    def __init__(self, analyzer: 'ChatAnalyzer', settings: Optional[Dict[str, Any]] = None,
+                 claim_token: Optional[str] = None, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 score_batch_size: int = PIPELINE_SCORE_BATCH_SIZE,
+                 embed_batch_size: int = PIPELINE_EMBED_BATCH_SIZE,
+                 write_batch_size: int = RESULT_WRITE_BATCH_SIZE,
+                 flush_seconds: float = PIPELINE_FLUSH_SECONDS):
+        self.analyzer = analyzer
+        self.claim_token = claim_token  # เขียนเฉพาะข้อความที่ยังถูกจองโดย token นี้ (ดู ResultWriter)
+        self.queue_size = queue_size
+        self.score_batch_size = score_batch_size
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.flush_seconds = flush_seconds
+        
+        if settings is None:
+            settings = analyzer.db_manager.get_settings()
+        self.skipped_stages = self.stages_to_skip(settings)
+        self.stage_stats = {
+            name: PipelineStageStats(name) for name in self.STAGES if name not in self.skipped_stages
+        }
+        self.written = 0
+        self.elapsed_seconds = 0.0
+    
+    @staticmethod
+    def stages_to_skip(settings: Dict[str, Any]) -> set:
+        """ขั้นตอนที่ข้ามตามการตั้งค่า (pipeline_skip_stages และ embedding_enabled)"""
+        skip = settings.get('pipeline_skip_stages') or []
+        if isinstance(skip, str):
+            try:
+                skip = json.loads(skip)
+            except ValueError:
+                skip = [name.strip() for name in skip.split(',')]
+        
+        skipped = {name for name in skip if name in PIPELINE_SKIPPABLE_STAGES}
+        if not settings.get('embedding_enabled', True):
+            skipped.add('embed')
+        return skipped
+    
+    def run(self, rows: Iterable) -> Dict[str, Any]:
+        """
+        ประมวลผลข้อความทั้งหมดจาก rows จนจบ แล้วคืนค่า stats()
+        rows: (id, message) หรือ dict ที่มี 'id' และ 'message' (เช่นผลของ claim_unprocessed_messages)
+        อ่านทีละรายการ จึงส่ง generator ที่ดึงข้อความจากฐานข้อมูลทีละส่วนได้
+        """
+        started = time.perf_counter()
+        queues = {
+            name: queue.Queue(maxsize=self.queue_size)
+            for name in ('normalize', 'score', 'embed', 'write') if name in self.stage_stats
+        }
+        
+        def first_queue(*names: str) -> Optional[queue.Queue]:
+            return next((queues[name] for name in names if name in queues), None)
+        
+        # ขั้นตอนสุดท้ายก่อน write ของแต่ละข้อความเป็นผู้คืนที่ว่างให้ read
+        self._last_stage = next(
+            (name for name in ('embed', 'score', 'normalize') if name in self.stage_stats), 'read'
+        )
+        self._in_flight = threading.Semaphore(self.queue_size)
+        
+        stages = [(self._read_stage, (rows, first_queue('normalize', 'score', 'embed')))]
+        if 'normalize' in queues:
+            stages.append((self._normalize_stage, (queues['normalize'], first_queue('score', 'embed'))))
+        if 'score' in queues:
+            stages.append((self._score_stage, (queues['score'], queues['write'], queues.get('embed'))))
+        if 'embed' in queues:
+            stages.append((self._embed_stage, (queues['embed'], queues['write'])))
+        # write จบเมื่อได้รับจุดสิ้นสุดจากทุกขั้นตอนที่ส่งผลมา (score และ/หรือ embed)
+        stages.append((self._write_stage, (queues['write'], ('score' in queues) + ('embed' in queues))))
+        
+        threads = [
+            threading.Thread(target=target, args=args, name=f"pipeline-{target.__name__[1:-6]}", daemon=True)
+            for target, args in stages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.elapsed_seconds += time.perf_counter() - started
+        return self.stats()
+    
+    def _batches(self, inbox: queue.Queue, size: int, wait: float = 0.0,
+                 producers: int = 1) -> Iterator[List[Dict[str, Any]]]:
+        """
+        อ่านคิวเป็น batch: รอรายการแรก แล้วรวบรวมต่ออีกไม่เกิน wait วินาทีหรือจนครบ size
+        (wait=0 = เอาเฉพาะรายการที่รออยู่ในคิวแล้ว) จบเมื่อได้รับจุดสิ้นสุดจากทุก producer
+        """
+        while producers:
+            batch: List[Dict[str, Any]] = []
+            deadline = None
+            while len(batch) < size and producers:
+                if deadline is None:
+                    item = inbox.get()
+                else:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = inbox.get(timeout=remaining) if remaining > 0 else inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                
+                if item is _END_OF_STREAM:
+                    producers -= 1
+                    continue
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + wait
+            
+            if batch:
+                yield batch
+    
+    @staticmethod
+    def _send(stats: PipelineStageStats, outbox: queue.Queue, items: Iterable[Dict[str, Any]]):
+        """ส่งรายการเข้าคิวของขั้นตอนถัดไป (รอเมื่อคิวเต็ม) และนับเวลาที่ต้องรอ"""
+        started = time.perf_counter()
+        for item in items:
+            outbox.put(item)
+        stats.add_blocked(time.perf_counter() - started)
+    
+    def _finish(self, stage: str, count: int):
+        """คืนที่ว่างให้ read เมื่อข้อความผ่านขั้นตอนสุดท้ายของมันแล้ว"""
+        if stage == self._last_stage:
+            for _ in range(count):
+                self._in_flight.release()
+    
+    def _read_stage(self, rows: Iterable, outbox: Optional[queue.Queue]):
+        stats = self.stage_stats['read']
+        try:
+            iterator = iter(rows)
+            while True:
+                # รอที่ว่าง (backpressure) ก่อนดึงข้อความถัดไปจาก rows
+                waited = time.perf_counter()
+                self._in_flight.acquire()
+                started = time.perf_counter()
+                stats.add_blocked(started - waited)
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    self._in_flight.release()
+                    break
+                
+                conversation_id, message = (row['id'], row['message']) if isinstance(row, dict) else row
+                read_at = time.perf_counter()
+                stats.record([read_at], read_at - started)
+                self._finish('read', 1)
+                if outbox is not None:
+                    self._send(stats, outbox, [{'id': conversation_id, 'message': message or '', 'read_at': read_at}])
+        except Exception as e:
+            print(f"Error reading messages in pipeline: {str(e)}")
+        finally:
+            if outbox is not None:
+                outbox.put(_END_OF_STREAM)
+    
+    def _normalize_stage(self, inbox: queue.Queue, outbox: Optional[queue.Queue]):
+        stats = self.stage_stats['normalize']
+        try:
+            for batch in self._batches(inbox, self.score_batch_size):
+                started = time.perf_counter()
+                for item in batch:
+                    item['message'] = normalize_text(item['message'])
+                stats.record([item['read_at'] for item in batch], time.perf_counter() - started)
+                self._finish('normalize', len(batch))
+                if outbox is not None:
+                    self._send(stats, outbox, batch)
+        finally:
+            if outbox is not None:
+                outbox.put(_END_OF_STREAM)
+    
+    def _score_stage(self, inbox: queue.Queue, write_queue: queue.Queue, embed_queue: Optional[queue.Queue]):
+        stats = self.stage_stats['score']
+        try:
+            for batch in self._batches(inbox, self.score_batch_size):
+                started = time.perf_counter()
+                try:
+                    scored = self.analyzer.score_messages([item['message'] for item in batch])
+                    records = [
+                        {'id': item['id'], 'sentiment': sentiment, 'sentiment_score': score,
+                         'read_at': item['read_at']}
+                        for item, sentiment, score in zip(
+                            batch, scored['sentiment'].tolist(), scored['sentiment_score'].tolist()
+                        )
+                    ]
+                    stats.record([item['read_at'] for item in batch], time.perf_counter() - started)
+                except Exception as e:
+                    print(f"Error scoring messages in pipeline: {str(e)}")
+                    stats.record([], time.perf_counter() - started, errors=len(batch))
+                    records = []
+                
+                # ส่ง sentiment ไปเขียนก่อน แล้วจึงส่งต่อให้ embed
+                self._send(stats, write_queue, records)
+                self._finish('score', len(batch))
+                if embed_queue is not None:
+                    self._send(stats, embed_queue, batch)
+        finally:
+            write_queue.put(_END_OF_STREAM)
+            if embed_queue is not None:
+                embed_queue.put(_END_OF_STREAM)
+    
+    def _embed_stage(self, inbox: queue.Queue, write_queue: queue.Queue):
+        stats = self.stage_stats['embed']
+        try:
+            for batch in self._batches(inbox, self.embed_batch_size, wait=self.flush_seconds):
+                started = time.perf_counter()
+                try:
+                    embeddings = self.analyzer.get_embeddings([item['message'] for item in batch])
+                except Exception as e:
+                    print(f"Error creating embeddings in pipeline: {str(e)}")
+                    embeddings = [None] * len(batch)
+                
+                records = [
+                    {'id': item['id'], 'embedding': embedding, 'read_at': item['read_at']}
+                    for item, embedding in zip(batch, embeddings) if embedding
+                ]
+                stats.record([record['read_at'] for record in records], time.perf_counter() - started,
+                             errors=len(batch) - len(records))
+                self._finish('embed', len(batch))
+                self._send(stats, write_queue, records)
+        finally:
+            write_queue.put(_END_OF_STREAM)
+    
+    def _write_stage(self, inbox: queue.Queue, producers: int):
+        stats = self.stage_stats['write']
+        writer = ResultWriter(self.analyzer.db_manager, batch_size=self.write_batch_size,
+                              claim_token=self.claim_token)
+        for batch in self._batches(inbox, self.write_batch_size, wait=self.flush_seconds, producers=producers):
+            started = time.perf_counter()
+            try:
+                embedded = []
+                for record in batch:
+                    if 'embedding' in record:
+                        writer.add_embedding(record['id'], record['embedding'])
+                        embedded.append(record)
+                    else:
+                        writer.add_sentiment(record['id'], record['sentiment'], record['sentiment_score'])
+                writer.flush()
+                
+                self.analyzer.index_embeddings([record['id'] for record in embedded],
+                                               [record['embedding'] for record in embedded])
+                stats.record([record['read_at'] for record in batch], time.perf_counter() - started)
+            except Exception as e:
+                print(f"Error writing results in pipeline: {str(e)}")
+                writer.pending = {}
+                stats.record([], time.perf_counter() - started, errors=len(batch))
+        self.written += writer.written_count
+    
+    def stats(self) -> Dict[str, Any]:
+        """ขั้นตอนที่ข้าม, จำนวนข้อความที่เขียนผล และตัวนับของแต่ละขั้นตอน"""
+        return {
+            'skipped_stages': sorted(self.skipped_stages),
+            'written': self.written,
+            'elapsed_seconds': self.elapsed_seconds,
+            'stages': {name: stats.snapshot() for name, stats in self.stage_stats.items()},
+        }
 
 class ChatAnalyzer:
     """คลาสสำหรับวิเคราะห์การสนทนา"""
@@ -15,6 +397,34 @@ class ChatAnalyzer:
     def __init__(self, db_manager):
         self.db_manager = db_manager
         
+        # แคช embedding (LRU ในหน่วยความจำ + ตาราง embedding_cache)
+        self.embedding_cache = EmbeddingCache(db_manager)
+        
+        # client ของ model server (connection pool ใช้ร่วมกับ ChatBot)
+        self.model_client = get_model_client()
+        self.async_model_client = get_async_model_client()
+        self._batch_embedding_supported = True
+        
+        # ดัชนี embedding (เปิดจากไฟล์บนดิสก์ถ้ามี แล้ว sync จากฐานข้อมูลแบบ incremental)
+        self.vector_index = self._open_vector_index()
+        self._vector_sync_lock = threading.Lock()
+        self._vector_watermark = self._load_vector_watermark()  # (processed_at, id) ล่าสุดที่ sync แล้ว
+        self._last_vector_sync = 0.0  # time.monotonic() ของการ sync ครั้งล่าสุดจาก find_similar_conversations
+        
+        self._init_keywords()
+    
+    @classmethod
+    def scoring_only(cls) -> 'ChatAnalyzer':
+        """
+        ChatAnalyzer ที่มีเฉพาะคำสำคัญ ไม่เชื่อมต่อฐานข้อมูล/model server และไม่เปิด vector index
+        ใช้ได้เฉพาะ keyword_counts, analyze_sentiment_simple, classify_topic และ score_messages
+        (เช่น ใน worker process ที่ให้คะแนนอย่างเดียว)
+        """
+        analyzer = cls.__new__(cls)
+        analyzer._init_keywords()
+        return analyzer
+    
+    def _init_keywords(self):
         # คำสำคัญสำหรับการวิเคราะห์ sentiment
         self.positive_keywords = [
             'ดี', 'เยี่ยม', 'สุดยอด', 'ชอบ', 'พอใจ', 'ประทับใจ', 'ขอบคุณ', 'สวย', 'เก่ง',
@@ -39,6 +449,18 @@ class ChatAnalyzer:
             'โปรโมชั่น': ['โปร', 'ลด', 'promotion', 'discount', 'sale', 'แถม'],
             'การร้องเรียน': ['ร้องเรียน', 'complaint', 'แจ้ง', 'ปัญหา', 'เรื่อง']
         }
+        
+        # คำสำคัญทุกชุดคอมไพล์รวมกัน ตัดคำและสแกนข้อความครั้งเดียวได้ทั้ง sentiment และหัวข้อ
+        # เทียบทั้งคำ ('ดี' ไม่ถูกนับใน 'สวัสดี') (ถ้าแก้ list คำสำคัญด้านบนหลังสร้าง object ให้สร้าง matcher ใหม่)
+        self.keyword_matcher = KeywordMatcher({
+            'positive': self.positive_keywords,
+            'negative': self.negative_keywords,
+            **self.topic_keywords
+        }, tokenizer=tokenize)
+    
+    def keyword_counts(self, text: str) -> Dict[str, int]:
+        """จำนวนคำสำคัญที่พบในข้อความ แยกตามชุด ('positive', 'negative' และชื่อหัวข้อ)"""
+        return self.keyword_matcher.count(text.lower())
     
     def get_embedding(self, text: str) -> Optional[List[float]]:
         """
@@ -48,16 +470,87 @@ class ChatAnalyzer:
         2. จัดกลุ่มหัวข้อการสนทนา
         3. แนะนำคำตอบที่เหมาะสม
         4. วิเคราะห์ความคล้ายคลึงของปัญหา
+        ข้อความที่เคยคำนวณแล้ว (model เดียวกัน) จะได้ผลจากแคชโดยไม่เรียก API
         """
         try:
-            response = requests.post(
-                EMBEDDING_API_URL,
-                json={
-                    "model": EMBEDDING_MODEL,
-                    "prompt": text
-                },
-                timeout=30
-            )
+            cache_key = make_cache_key(EMBEDDING_MODEL, text)
+            cached = self.embedding_cache.get(cache_key)
+            if cached is not None:
+                return cached.tolist()
+            
+            embedding = self._request_embedding(text)
+            if embedding:
+                self.embedding_cache.put(cache_key, EMBEDDING_MODEL, embedding)
+            return embedding
+                
+        except Exception as e:
+            print(f"Error in get_embedding: {str(e)}")
+            return None
+    
+    def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        ได้ embedding ของหลายข้อความ เรียงตามลำดับที่ส่งมา (ข้อความที่ล้มเหลวได้ None)
+        - ข้อความที่อยู่ในแคชไม่เรียก API และข้อความซ้ำกันเรียกครั้งเดียว
+        - ส่งหลายข้อความต่อ request ผ่าน /api/embed ถ้า server รองรับ
+          ไม่เช่นนั้นเรียกทีละข้อความพร้อมกันไม่เกิน EMBEDDING_CONCURRENCY request
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if not texts:
+            return results
+        
+        try:
+            keys = [make_cache_key(EMBEDDING_MODEL, text) for text in texts]
+            cached = self.embedding_cache.get_many(keys)
+            
+            pending: Dict[str, List[int]] = {}
+            for position, key in enumerate(keys):
+                if key in cached:
+                    results[position] = cached[key].tolist()
+                else:
+                    pending.setdefault(key, []).append(position)
+            
+            if not pending:
+                return results
+            
+            pending_keys = list(pending)
+            embeddings = self._request_embeddings([texts[pending[key][0]] for key in pending_keys])
+            
+            new_entries = {}
+            for key, embedding in zip(pending_keys, embeddings):
+                if embedding:
+                    new_entries[key] = embedding
+                    for position in pending[key]:
+                        results[position] = embedding
+            self.embedding_cache.put_many(new_entries, EMBEDDING_MODEL)
+            
+        except Exception as e:
+            print(f"Error in get_embeddings: {str(e)}")
+        
+        return results
+    
+    async def aembed(self, text: str) -> Optional[List[float]]:
+        """get_embedding แบบ async (ไม่ block event loop)"""
+        return await self.async_model_client.run(EMBEDDING_MODEL, self.get_embedding, text)
+    
+    async def aembed_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """get_embeddings แบบ async"""
+        return await self.async_model_client.run(EMBEDDING_MODEL, self.get_embeddings, texts)
+    
+    def _request_embedding(self, text: str) -> Optional[List[float]]:
+        """เรียก embedding API สำหรับข้อความเดียว คืนค่า None ถ้าล้มเหลวหรือ circuit breaker เปิดอยู่"""
+        if not self.model_client.available('embedding'):
+            return None
+        
+        try:
+            with self.model_client.slot(EMBEDDING_MODEL):
+                response = self.model_client.post_shared(
+                    'embedding',
+                    EMBEDDING_API_URL,
+                    {
+                        "model": EMBEDDING_MODEL,
+                        "prompt": text
+                    }
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -66,16 +559,89 @@ class ChatAnalyzer:
                 print(f"Error getting embedding: {response.status_code}")
                 return None
                 
+        except CircuitOpenError:
+            return None
         except Exception as e:
             print(f"Error in get_embedding: {str(e)}")
             return None
     
-    def analyze_sentiment_simple(self, text: str) -> Dict[str, Any]:
-        """วิเคราะห์ความรู้สึกแบบง่าย (rule-based)"""
-        text_lower = text.lower()
+    def _request_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        เรียก embedding API สำหรับหลายข้อความ แบ่งเป็นช่วงละ EMBEDDING_BATCH_SIZE
+        ถ้า circuit breaker เปิดระหว่างทาง ช่วงที่เหลือได้ None ทันที (ข้ามการสร้าง embedding)
+        """
+        results: List[Optional[List[float]]] = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            chunk = texts[start:start + EMBEDDING_BATCH_SIZE]
+            if not self.model_client.available('embedding'):
+                results.extend([None] * len(chunk))
+                continue
+            
+            embeddings = self._request_embedding_batch(chunk) if self._batch_embedding_supported else None
+            if embeddings is None:
+                embeddings = self._request_embeddings_concurrently(chunk)
+            results.extend(embeddings)
+        
+        return results
+    
+    def _request_embedding_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """
+        เรียก /api/embed ครั้งเดียวสำหรับหลายข้อความ
+        คืนค่า None ถ้าล้มเหลว (ถ้า server ไม่มี endpoint นี้จะไม่ลองอีก)
+        """
+        try:
+            with self.model_client.slot(EMBEDDING_MODEL):
+                response = self.model_client.post(
+                    'embedding_batch',
+                    EMBEDDING_BATCH_API_URL,
+                    {
+                        "model": EMBEDDING_MODEL,
+                        "input": texts
+                    }
+                )
+            
+            if response.status_code in (404, 405):
+                print("Embedding batch API ไม่รองรับ - เปลี่ยนไปเรียกทีละข้อความ")
+                self._batch_embedding_supported = False
+                return None
+            if response.status_code != 200:
+                print(f"Error getting batch embeddings: {response.status_code}")
+                return None
+            
+            embeddings = response.json().get('embeddings')
+            if not isinstance(embeddings, list) or len(embeddings) != len(texts):
+                print("Error getting batch embeddings: จำนวนผลลัพธ์ไม่ตรงกับข้อความ")
+                return None
+            return embeddings
+            
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            print(f"Error in batch embedding: {str(e)}")
+            return None
+    
+    def _request_embeddings_concurrently(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        เรียก embedding API ทีละข้อความพร้อมกันหลาย request (ผลเรียงตามลำดับเดิม)
+        ใช้ pool และ slot ของ embedding model ร่วมกันทั้ง process รวมถึงงานจาก aembed_many
+        request จริงจึงไม่เกิน EMBEDDING_CONCURRENCY แม้มีผู้เรียกพร้อมกันหลายราย
+        """
+        if len(texts) == 1:
+            return [self._request_embedding(texts[0])]
+        
+        return self.model_client.fan_out(EMBEDDING_MODEL, self._request_embedding, texts)
+    
+    def analyze_sentiment_simple(self, text: str,
+                                 keyword_counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """
+        วิเคราะห์ความรู้สึกแบบง่าย (rule-based)
+        ส่ง keyword_counts (จาก keyword_counts()) มาเพื่อใช้ผลสแกนเดียวกับ classify_topic
+        """
+        if keyword_counts is None:
+            keyword_counts = self.keyword_counts(text)
         
-        positive_count = sum(1 for word in self.positive_keywords if word in text_lower)
-        negative_count = sum(1 for word in self.negative_keywords if word in text_lower)
+        positive_count = keyword_counts.get('positive', 0)
+        negative_count = keyword_counts.get('negative', 0)
         
         if positive_count > negative_count:
             sentiment = 'positive'
@@ -93,13 +659,15 @@ class ChatAnalyzer:
             'confidence': abs(score)
         }
     
-    def classify_topic(self, text: str) -> List[Dict[str, Any]]:
-        """จำแนกหัวข้อของข้อความ"""
-        text_lower = text.lower()
+    def classify_topic(self, text: str,
+                       keyword_counts: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """จำแนกหัวข้อของข้อความ (รับ keyword_counts ที่สแกนไว้แล้วได้เหมือน analyze_sentiment_simple)"""
+        if keyword_counts is None:
+            keyword_counts = self.keyword_counts(text)
         topics_found = []
         
         for topic, keywords in self.topic_keywords.items():
-            keyword_count = sum(1 for keyword in keywords if keyword in text_lower)
+            keyword_count = keyword_counts.get(topic, 0)
             
             if keyword_count > 0:
                 confidence = min(1.0, keyword_count / len(keywords) * 2)
@@ -113,6 +681,61 @@ class ChatAnalyzer:
         topics_found.sort(key=lambda x: x['confidence'], reverse=True)
         return topics_found[:3]  # คืนค่าแค่ 3 หัวข้อแรก
     
+    def score_messages(self, messages: Union[pd.Series, Sequence[str], Any],
+                       chunk_size: int = SCORING_CHUNK_SIZE) -> pd.DataFrame:
+        """
+        ให้คะแนน sentiment และหัวข้อของข้อความจำนวนมากพร้อมกัน
+        ผลเท่ากับ analyze_sentiment_simple และ classify_topic ทีละข้อความ แต่คำนวณทั้ง batch ด้วย numpy
+        (นับคำสำคัญด้วย KeywordMatcher.count_matrix) ใช้ให้คะแนนข้อความค้างหรือคำนวณประวัติใหม่หลังแก้คำสำคัญ
+        รับ pandas Series, list ของข้อความ หรือ Arrow array (pyarrow.Array/ChunkedArray)
+        คืนค่า DataFrame (index เดียวกับ messages) คอลัมน์:
+        sentiment, sentiment_score, topic_1, topic_2, topic_3 (None ถ้าพบหัวข้อไม่ถึง 3 หัวข้อ)
+        """
+        if not isinstance(messages, pd.Series):
+            if hasattr(messages, 'to_pylist'):  # Arrow array
+                messages = messages.to_pylist()
+            messages = pd.Series(list(messages), dtype=object)
+        
+        names = list(self.keyword_matcher.categories)
+        positive = names.index('positive')
+        negative = names.index('negative')
+        topic_names = np.array(list(self.topic_keywords), dtype=object)
+        topic_columns = [names.index(topic) for topic in topic_names]
+        topic_sizes = np.array([len(keywords) for keywords in self.topic_keywords.values()], dtype=float)
+        
+        frames = []
+        for start in range(0, len(messages), chunk_size):
+            chunk = messages.iloc[start:start + chunk_size]
+            counts = self.keyword_matcher.count_matrix(
+                [text.lower() if isinstance(text, str) else '' for text in chunk]
+            )
+            
+            # sentiment (สูตรเดียวกับ analyze_sentiment_simple)
+            difference = counts[:, positive] - counts[:, negative]
+            sentiment = np.select([difference > 0, difference < 0], ['positive', 'negative'], 'neutral')
+            score = np.where(
+                difference > 0, np.minimum(0.8, 0.5 + difference * 0.1),
+                np.where(difference < 0, np.maximum(-0.8, -0.5 - (-difference) * 0.1), 0.0)
+            )
+            
+            # หัวข้อ 3 อันดับแรก (สูตรและการเรียงแบบ stable เดียวกับ classify_topic)
+            confidence = np.minimum(1.0, counts[:, topic_columns] / topic_sizes * 2)
+            order = np.argsort(-confidence, axis=1, kind='stable')[:, :3]
+            found = np.take_along_axis(confidence, order, axis=1) > 0
+            top_topics = np.where(found, topic_names[order], None)
+            
+            frames.append(pd.DataFrame({
+                'sentiment': sentiment,
+                'sentiment_score': score,
+                'topic_1': pd.Series(top_topics[:, 0], index=chunk.index, dtype=object),
+                'topic_2': pd.Series(top_topics[:, 1], index=chunk.index, dtype=object),
+                'topic_3': pd.Series(top_topics[:, 2], index=chunk.index, dtype=object),
+            }, index=chunk.index))
+        
+        if not frames:
+            return pd.DataFrame(columns=['sentiment', 'sentiment_score', 'topic_1', 'topic_2', 'topic_3'])
+        return pd.concat(frames)
+    
     def analyze_sentiment(self, start_date: Optional[datetime] = None, 
                          end_date: Optional[datetime] = None) -> pd.DataFrame:
         """วิเคราะห์ความรู้สึกของการสนทนา"""
@@ -133,8 +756,8 @@ class ChatAnalyzer:
             params = {}
             
             if start_date and end_date:
-                query += " AND DATE(timestamp) BETWEEN :start_date AND :end_date"
-                params.update({"start_date": start_date, "end_date": end_date})
+                query += f" AND {DATE_RANGE_FILTER}"
+                params.update(date_range_params(start_date, end_date))
             
             query += " GROUP BY sentiment"
             
@@ -152,23 +775,23 @@ class ChatAnalyzer:
             return pd.DataFrame()
     
     def get_sentiment_trend(self, days: int = 30) -> pd.DataFrame:
-        """ดึงแนวโน้มความรู้สึกตามเวลา"""
+        """ดึงแนวโน้มความรู้สึกตามเวลา (จาก rollup daily_metrics)"""
         try:
-            end_date = datetime.now()
+            end_date = datetime.now(LOCAL_TZ)
             start_date = end_date - timedelta(days=days)
             
             with self.db_manager.engine.connect() as conn:
-                df = pd.read_sql(text("""
+                df = pd.read_sql(text(f"""
                     SELECT 
-                        DATE(timestamp) as date,
-                        AVG(sentiment_score) as sentiment_score,
-                        COUNT(*) as message_count
-                    FROM conversations 
-                    WHERE sentiment_score IS NOT NULL
-                    AND DATE(timestamp) BETWEEN :start_date AND :end_date
-                    GROUP BY DATE(timestamp)
+                        metric_date as date,
+                        SUM(sentiment_score_sum) / SUM(sentiment_count) as sentiment_score,
+                        SUM(sentiment_count) as message_count
+                    FROM daily_metrics 
+                    WHERE {DAY_RANGE_FILTER}
+                    GROUP BY metric_date
+                    HAVING SUM(sentiment_count) > 0
                     ORDER BY date
-                """), conn, params={"start_date": start_date, "end_date": end_date})
+                """), conn, params=day_range_params(start_date, end_date))
             
             return df
             
@@ -311,12 +934,18 @@ class ChatAnalyzer:
             print(f"Error analyzing satisfaction: {str(e)}")
             return {'overall_score': 3.0, 'trends': pd.DataFrame(), 'factors': []}
     
-    def process_new_message(self, conversation_id: int, message: str) -> Dict[str, Any]:
+    def process_new_message(self, conversation_id: int, message: str,
+                            writer: Optional[ResultWriter] = None,
+                            embedding: Optional[List[float]] = None,
+                            settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         ประมวลผลข้อความใหม่
         - วิเคราะห์ sentiment
         - จำแนกหัวข้อ
         - สร้าง embedding (ถ้าเปิดใช้งาน)
+        ถ้าส่ง writer มา ผลจะถูกสะสมไว้เขียนกลับเป็น batch แทนการ UPDATE ทันที
+        ถ้าส่ง embedding ที่คำนวณไว้แล้ว (จาก get_embeddings) จะไม่เรียก API ซ้ำ
+        ถ้าส่ง settings มา (อ่านครั้งเดียวต่อ batch) จะไม่อ่านการตั้งค่าจากฐานข้อมูลซ้ำ
         """
         try:
             result = {
@@ -324,27 +953,43 @@ class ChatAnalyzer:
                 'processed_at': datetime.now()
             }
             
+            # สแกนคำสำคัญครั้งเดียว ใช้ทั้ง sentiment และหัวข้อ
+            keyword_counts = self.keyword_counts(message)
+            
             # วิเคราะห์ sentiment
-            sentiment_result = self.analyze_sentiment_simple(message)
+            sentiment_result = self.analyze_sentiment_simple(message, keyword_counts)
             result['sentiment'] = sentiment_result
             
             # อัปเดต sentiment ในฐานข้อมูล
-            self.db_manager.update_conversation_sentiment(
-                conversation_id,
-                sentiment_result['sentiment'],
-                sentiment_result['score']
-            )
+            if writer:
+                writer.add_sentiment(
+                    conversation_id,
+                    sentiment_result['sentiment'],
+                    sentiment_result['score']
+                )
+            else:
+                self.db_manager.update_conversation_sentiment(
+                    conversation_id,
+                    sentiment_result['sentiment'],
+                    sentiment_result['score']
+                )
             
             # จำแนกหัวข้อ
-            topics = self.classify_topic(message)
+            topics = self.classify_topic(message, keyword_counts)
             result['topics'] = topics
             
             # สร้าง embedding (ถ้าเปิดใช้งาน)
-            settings = self.db_manager.get_settings()
+            if settings is None:
+                settings = self.db_manager.get_settings()
             if settings.get('embedding_enabled', True):
-                embedding = self.get_embedding(message)
+                if embedding is None:
+                    embedding = self.get_embedding(message)
                 if embedding:
-                    self.db_manager.update_conversation_embedding(conversation_id, embedding)
+                    if writer:
+                        writer.add_embedding(conversation_id, embedding)
+                    else:
+                        self.db_manager.update_conversation_embedding(conversation_id, embedding)
+                    self.index_embeddings([conversation_id], [embedding])
                     result['embedding_created'] = True
                 else:
                     result['embedding_created'] = False
@@ -355,6 +1000,89 @@ class ChatAnalyzer:
             print(f"Error processing new message: {str(e)}")
             return {'error': str(e)}
     
+    def _open_vector_index(self):
+        """เปิด vector index ที่บันทึกไว้ใน VECTOR_INDEX_DIR หรือสร้างใหม่ถ้ายังไม่มี"""
+        index_class = IVFIndex if VECTOR_INDEX_TYPE == 'ivf' else VectorMatrixIndex
+        if not VECTOR_INDEX_DIR:
+            return index_class()
+        
+        try:
+            index = index_class.open(VECTOR_INDEX_DIR)
+            if index is not None:
+                return index
+            
+            index = index_class()
+            index.attach_storage(VECTOR_INDEX_DIR)
+            return index
+        except OSError as e:
+            print(f"Error opening vector index: {str(e)}")
+            return index_class()
+    
+    def index_embeddings(self, ids: List[int], embeddings: List[List[float]]) -> int:
+        """เพิ่ม embedding ที่เพิ่งบันทึกเข้า vector index ทันที ไม่ต้องรอ sync รอบถัดไป คืนค่าจำนวนที่เพิ่มใหม่"""
+        return self.vector_index.add(ids, embeddings)
+    
+    def _load_vector_watermark(self):
+        """อ่าน watermark ของการ sync จาก header ของ index ที่บันทึกไว้"""
+        metadata = self.vector_index.metadata
+        if not metadata.get('watermark_processed_at'):
+            return (None, 0)
+        return (datetime.fromisoformat(metadata['watermark_processed_at']), metadata.get('watermark_id', 0))
+    
+    def sync_vector_index(self) -> int:
+        """
+        ดึง embedding ที่ประมวลผลใหม่จากฐานข้อมูลเข้า vector index
+        อ่านตาม watermark (processed_at, id) และย้อนซ้ำช่วงท้ายทุกครั้ง (index แทนที่ id เดิมให้)
+        เพราะ processed_at ถูกกำหนดตอน UPDATE ไม่ใช่ตอน commit งานเขียนแบบ batch ของ backlog worker
+        จึงอาจ commit หลังจาก watermark เลยเวลานั้นไปแล้ว
+        คืนค่าจำนวน vector ที่เพิ่มใหม่
+        """
+        with self._vector_sync_lock:
+            since, since_id = self._vector_watermark
+            if since is not None:
+                since = since - timedelta(seconds=VECTOR_SYNC_OVERLAP_SECONDS)
+                since_id = 0
+            
+            added = 0
+            while True:
+                rows = self.db_manager.get_embeddings_since(since, since_id, VECTOR_SYNC_BATCH_SIZE)
+                if not rows:
+                    break
+                
+                ids = []
+                vectors = []
+                for row in rows:
+                    try:
+                        vector = decode_vector(row.embedding_blob)
+                    except ValueError:
+                        continue
+                    if vector is not None and (self.vector_index.dim in (None, 0, len(vector))):
+                        ids.append(row.id)
+                        vectors.append(vector)
+                
+                if ids:
+                    added += self.vector_index.add(ids, np.stack(vectors))
+                
+                since, since_id = rows[-1].processed_at, rows[-1].id
+                if since is not None and (self._vector_watermark[0] is None or since >= self._vector_watermark[0]):
+                    self._vector_watermark = (since, since_id)
+                
+                if len(rows) < VECTOR_SYNC_BATCH_SIZE:
+                    break
+            
+            # บันทึก index พร้อม watermark ลงดิสก์ เพื่อให้ process ถัดไปเริ่ม sync ต่อจากจุดนี้
+            watermark, watermark_id = self._vector_watermark
+            if watermark is not None and watermark.isoformat() != self.vector_index.metadata.get('watermark_processed_at'):
+                self.vector_index.flush({
+                    'watermark_processed_at': watermark.isoformat(),
+                    'watermark_id': watermark_id,
+                    'last_synced_id': self.vector_index.max_id,
+                })
+            elif added:
+                self.vector_index.flush()
+            
+            return added
+    
     def find_similar_conversations(self, message: str, limit: int = 5) -> List[Dict[str, Any]]:
         """
         ค้นหาการสนทนาที่คล้ายกัน โดยใช้ embedding
@@ -362,6 +1090,7 @@ class ChatAnalyzer:
         1. แนะนำคำตอบที่เคยใช้
         2. ค้นหาปัญหาที่คล้ายกัน
         3. สร้าง knowledge base
+        ค้นหาจาก embedding ของข้อความลูกค้าทั้งหมดใน vector index
         """
         try:
             # สร้าง embedding สำหรับข้อความที่ต้องการค้นหา
@@ -369,45 +1098,30 @@ class ChatAnalyzer:
             if not query_embedding:
                 return []
             
-            # ค้นหาการสนทนาที่มี embedding
-            with self.db_manager.engine.connect() as conn:
-                result = conn.execute(text("""
-                    SELECT 
-                        id,
-                        conversation_id,
-                        message,
-                        embedding_vector,
-                        timestamp,
-                        sender_type
-                    FROM conversations 
-                    WHERE embedding_vector IS NOT NULL
-                    AND sender_type = 'customer'
-                    ORDER BY timestamp DESC
-                    LIMIT 100
-                """))
-                
-                conversations = []
-                for row in result:
-                    try:
-                        stored_embedding = json.loads(row.embedding_vector)
-                        
-                        # คำนวณ cosine similarity
-                        similarity = self.cosine_similarity(query_embedding, stored_embedding)
-                        
-                        if similarity > 0.7:  # เฉพาะที่คล้ายกันมาก
-                            conversations.append({
-                                'id': row.id,
-                                'conversation_id': row.conversation_id,
-                                'message': row.message,
-                                'similarity': similarity,
-                                'timestamp': row.timestamp
-                            })
-                    except (json.JSONDecodeError, TypeError):
-                        continue
-                
-                # เรียงตาม similarity
-                conversations.sort(key=lambda x: x['similarity'], reverse=True)
-                return conversations[:limit]
+            # ดึง embedding ที่ประมวลผลใหม่เข้า index ก่อนค้นหา (ไม่เกินหนึ่งครั้งต่อ VECTOR_SYNC_MIN_INTERVAL_SECONDS)
+            if time.monotonic() - self._last_vector_sync >= VECTOR_SYNC_MIN_INTERVAL_SECONDS:
+                self.sync_vector_index()
+                self._last_vector_sync = time.monotonic()
+            
+            hits = self.vector_index.search(query_embedding, k=limit, min_score=SIMILARITY_THRESHOLD)
+            if not hits:
+                return []
+            
+            rows = self.db_manager.get_conversations_by_ids([conv_id for conv_id, _ in hits])
+            
+            conversations = []
+            for conv_id, similarity in hits:
+                row = rows.get(conv_id)
+                if row:
+                    conversations.append({
+                        'id': conv_id,
+                        'conversation_id': row['conversation_id'],
+                        'message': row['message'],
+                        'similarity': similarity,
+                        'timestamp': row['timestamp']
+                    })
+            
+            return conversations
                 
         except Exception as e:
             print(f"Error finding similar conversations: {str(e)}")
@@ -542,33 +1256,32 @@ class ChatAnalyzer:
             return []
     
     def batch_process_unprocessed_messages(self, limit: int = 100):
-        """ประมวลผลข้อความที่ยังไม่ได้ประมวลผล"""
+        """
+        ประมวลผลข้อความที่ยังไม่ได้ประมวลผลด้วย MessagePipeline
+        จองข้อความก่อนประมวลผล (ดู claim_unprocessed_messages) จึงทำงานพร้อมกับ backlog worker ได้โดยไม่ซ้ำกัน
+        """
+        claim_token = f"app:{uuid.uuid4().hex}"
         try:
-            with self.db_manager.engine.connect() as conn:
-                # ดึงข้อความที่ยังไม่ได้ประมวลผล
-                result = conn.execute(text("""
-                    SELECT id, message 
-                    FROM conversations 
-                    WHERE processed_at IS NULL
-                    AND sender_type = 'customer'
-                    ORDER BY timestamp DESC
-                    LIMIT :limit
-                """), {"limit": limit})
-                
-                messages_to_process = [(row.id, row.message) for row in result]
-                
-                processed_count = 0
-                for msg_id, message in messages_to_process:
-                    try:
-                        self.process_new_message(msg_id, message)
-                        processed_count += 1
-                    except Exception as e:
-                        print(f"Error processing message {msg_id}: {str(e)}")
-                        continue
-                
-                print(f"✅ ประมวลผลข้อความสำเร็จ {processed_count}/{len(messages_to_process)} ข้อความ")
-                return processed_count
-                
+            rows = self.db_manager.claim_unprocessed_messages(claim_token, limit, BACKLOG_LEASE_SECONDS)
+            
+            # อ่านการตั้งค่าครั้งเดียวต่อ batch
+            pipeline = MessagePipeline(self, settings=self.db_manager.get_settings(), claim_token=claim_token)
+            stats = pipeline.run(rows)
+            
+            # ข้อความที่ได้ sentiment แล้ว (ถ้าข้าม score = ข้อความที่อ่าน)
+            processed_count = stats['stages'].get('score', stats['stages']['read'])['items']
+            print(f"✅ ประมวลผลข้อความสำเร็จ {processed_count}/{len(rows)} ข้อความ "
+                  f"(เขียนผล {stats['written']} รายการ ใน {stats['elapsed_seconds']:.1f}s)")
+            for name, stage in stats['stages'].items():
+                print(f"   {name}: {stage['items']} รายการ, {stage['items_per_second']:,.0f} รายการ/วินาที, "
+                      f"p95 {stage['latency_p95_ms']:,.0f} ms, รอคิว {stage['blocked_seconds']:.1f}s")
+            
+            # merge user/conversation ที่เพิ่ง insert เข้า sketch ของ dashboard (ไม่ทำตอน insert)
+            self.db_manager.compact_daily_sketches()
+            return processed_count
+            
         except Exception as e:
             print(f"Error in batch processing: {str(e)}")
             return 0
+        finally:
+            self.db_manager.release_message_claims(claim_token)
@@ -0,0 +1,279 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+import numpy as np
+from utils.config import (
+    CHAT_CONTEXT_TOKEN_BUDGET, CHAT_CONTEXT_SIMILAR_LIMIT, CHAT_CONTEXT_RECENT_LIMIT,
+    CHAT_CONTEXT_MESSAGE_CHARS, CHAT_CONTEXT_REFRESH_SECONDS, CHAT_FACTS_TTL
+)
+from components.database import LOCAL_TZ
+
+# intent (จาก ChatBot.analyze_question_intent) ที่ตอบได้จากสถิติรวมโดยไม่ต้องส่งข้อความดิบให้ model
+FACT_INTENTS = ('analytics', 'sentiment', 'topics', 'performance')
+
+def estimate_tokens(text: str) -> int:
+    """
+    ประมาณจำนวน token ของข้อความ (ประมาณ 4 bytes ต่อ token ของ UTF-8)
+    ภาษาอังกฤษได้ ~4 ตัวอักษรต่อ token และภาษาไทย (3 bytes ต่อตัวอักษร) ได้ ~1.3 ตัวอักษรต่อ token
+    """
+    return math.ceil(len(text.encode('utf-8')) / 4)
+
+class AnalyticsFactProvider:
+    """
+    สร้าง fact sheet สั้น ๆ จากสถิติที่ dashboard คำนวณไว้แล้ว แยกตาม intent ของคำถาม
+    - analytics: จำนวนการสนทนา/ข้อความ/ลูกค้า วันนี้ 7 วัน และ 30 วัน เทียบช่วงก่อนหน้า (daily_metrics)
+    - sentiment: สัดส่วนความรู้สึกวันนี้ 7 วัน และ 30 วัน (analyze_sentiment)
+    - topics: หัวข้อยอดนิยมพร้อมตัวอย่างข้อความ (extract_topics)
+    - performance: เวลาตอบกลับเฉลี่ย การกระจาย และช่วงเวลาที่ตอบช้า (analyze_response_time)
+    ผลลัพธ์ของแต่ละ intent แคชไว้ CHAT_FACTS_TTL วินาที
+    """
+
+    def __init__(self, db_manager, chat_analyzer, ttl: int = CHAT_FACTS_TTL):
+        self.db_manager = db_manager
+        self.chat_analyzer = chat_analyzer
+        self.ttl = ttl
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def facts(self, intent: str) -> List[str]:
+        """ข้อเท็จจริงของ intent (list ว่างถ้าไม่ใช่ intent ใน FACT_INTENTS หรือดึงข้อมูลไม่ได้)"""
+        if intent not in FACT_INTENTS:
+            return []
+
+        with self._lock:
+            cached = self._cache.get(intent)
+            if cached is not None and time.monotonic() < cached[0]:
+                return cached[1]
+
+        try:
+            lines = getattr(self, f"_{intent}_facts")()
+        except Exception as e:
+            print(f"Error building {intent} facts: {str(e)}")
+            return []
+
+        with self._lock:
+            self._cache[intent] = (time.monotonic() + self.ttl, lines)
+        return lines
+
+    def overview(self) -> List[str]:
+        """สรุปสถิติรวมสำหรับคำถามทั่วไป (วันนี้ ความรู้สึก 7 วัน หัวข้อยอดนิยม)"""
+        lines = []
+        today = datetime.now(LOCAL_TZ)
+
+        analytics = self.db_manager.get_analytics_data(today, today)
+        if analytics:
+            lines.append(
+                f"วันนี้: การสนทนา {analytics.get('total_conversations', 0):,} ครั้ง, "
+                f"ข้อความ {analytics.get('total_messages', 0):,} ข้อความ, "
+                f"ลูกค้า {analytics.get('unique_customers', 0):,} คน, "
+                f"เวลาตอบกลับเฉลี่ย {analytics.get('avg_response_time', 0):.1f} นาที"
+            )
+
+        mix = self._sentiment_mix(today - timedelta(days=6), today)
+        if mix:
+            lines.append(f"ความรู้สึกลูกค้า 7 วันล่าสุด: {mix}")
+
+        topics = self.chat_analyzer.extract_topics()
+        if topics:
+            top = ", ".join(f"{topic['topic']} ({topic['frequency']:.1f})" for topic in topics[:5])
+            lines.append(f"หัวข้อยอดนิยมจากข้อความล่าสุด: {top}")
+
+        return lines
+
+    def _periods(self):
+        today = datetime.now(LOCAL_TZ)
+        return [
+            ("วันนี้", today, today),
+            ("7 วันล่าสุด", today - timedelta(days=6), today),
+            ("30 วันล่าสุด", today - timedelta(days=29), today),
+        ]
+
+    def _analytics_facts(self) -> List[str]:
+        lines = []
+        for label, start_date, end_date in self._periods():
+            analytics = self.db_manager.get_analytics_data(start_date, end_date)
+            if not analytics:
+                continue
+            lines.append(
+                f"{label}: การสนทนา {analytics['total_conversations']:,} ครั้ง ({analytics['conversation_change']:+,}), "
+                f"ข้อความ {analytics['total_messages']:,} ({analytics['message_change']:+,}), "
+                f"ลูกค้า {analytics['unique_customers']:,} คน ({analytics['customer_change']:+,})"
+            )
+        if lines:
+            lines.append("ตัวเลขในวงเล็บคือผลต่างจากช่วงก่อนหน้าที่ยาวเท่ากัน")
+        return lines
+
+    def _sentiment_mix(self, start_date: datetime, end_date: datetime) -> str:
+        sentiment_df = self.chat_analyzer.analyze_sentiment(start_date, end_date)
+        if sentiment_df.empty:
+            return ""
+        total = sentiment_df['count'].sum()
+        mix = ", ".join(
+            f"{row['sentiment']} {row['count'] / total:.0%}"
+            for _, row in sentiment_df.sort_values('count', ascending=False).iterrows()
+        )
+        return f"{mix} (จาก {int(total):,} ข้อความ)"
+
+    def _sentiment_facts(self) -> List[str]:
+        lines = []
+        for label, start_date, end_date in self._periods():
+            mix = self._sentiment_mix(start_date, end_date)
+            if mix:
+                lines.append(f"ความรู้สึกลูกค้า {label}: {mix}")
+        return lines
+
+    def _topics_facts(self) -> List[str]:
+        lines = []
+        for topic in self.chat_analyzer.extract_topics()[:5]:
+            example = topic['examples'][0][:80] if topic.get('examples') else ''
+            lines.append(f"หัวข้อ {topic['topic']}: ความถี่ {topic['frequency']:.1f} เช่น \"{example}\"")
+        if lines:
+            lines.append("ความถี่คิดจากข้อความลูกค้า 100 ข้อความล่าสุด")
+        return lines
+
+    def _performance_facts(self) -> List[str]:
+        lines = []
+        for label, start_date, end_date in self._periods()[:2]:
+            analytics = self.db_manager.get_analytics_data(start_date, end_date)
+            if analytics:
+                lines.append(
+                    f"เวลาตอบกลับเฉลี่ย {label}: {analytics['avg_response_time']:.1f} นาที "
+                    f"({analytics['response_time_change']:+.1f} จากช่วงก่อนหน้า)"
+                )
+
+        response_data = self.chat_analyzer.analyze_response_time()
+        distribution = response_data['distribution']
+        if not distribution.empty:
+            minutes = distribution['response_time'].to_numpy(dtype=float)
+            lines.append(
+                f"การกระจายเวลาตอบกลับ (ไม่เกิน 1 ชั่วโมง): มัธยฐาน {np.median(minutes):.1f} นาที, "
+                f"90% ตอบภายใน {np.percentile(minutes, 90):.1f} นาที, "
+                f"ตอบภายใน 5 นาที {np.mean(minutes <= 5):.0%}"
+            )
+
+        hourly = response_data['hourly']
+        if not hourly.empty:
+            slowest = hourly.sort_values('avg_response_time', ascending=False).head(3)
+            busiest = hourly.sort_values('message_count', ascending=False).head(3)
+            lines.append("ช่วงเวลาที่ตอบช้าที่สุด: " + ", ".join(
+                f"{int(row['hour']):02d}:00 ({row['avg_response_time']:.1f} นาที)" for _, row in slowest.iterrows()
+            ))
+            lines.append("ช่วงเวลาที่มีข้อความมากที่สุด: " + ", ".join(
+                f"{int(row['hour']):02d}:00 ({int(row['message_count']):,} ข้อความ)" for _, row in busiest.iterrows()
+            ))
+        return lines
+
+class ChatContextRetriever:
+    """
+    เลือก context สำหรับ AI Chatbot ตามคำถาม แทนการส่งข้อความล่าสุดทั้งหมด
+    1. สถิติรวม (จาก rollup) - จำนวนการสนทนาวันนี้ สัดส่วนความรู้สึก หัวข้อยอดนิยม
+    2. ข้อความลูกค้าที่คล้ายกับคำถาม (จาก vector index)
+    3. ข้อความล่าสุด - เติมในพื้นที่ที่เหลือ
+    จัดเรียงตามลำดับนี้และหยุดเมื่อเกิน token budget
+    คำถามที่ตอบได้จากสถิติ (FACT_INTENTS) ใช้ fact sheet จาก AnalyticsFactProvider แทนทั้งหมด
+    """
+
+    def __init__(self, db_manager, chat_analyzer, token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET):
+        self.db_manager = db_manager
+        self.chat_analyzer = chat_analyzer
+        self.token_budget = token_budget
+        self.fact_provider = AnalyticsFactProvider(db_manager, chat_analyzer)
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._snapshot_expires = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        สถิติรวมและข้อความล่าสุด (ใช้ซ้ำได้ CHAT_CONTEXT_REFRESH_SECONDS วินาที)
+        'version' เปลี่ยนเมื่อข้อมูลเปลี่ยน ใช้เป็น fingerprint ของแคชคำตอบ
+        """
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() < self._snapshot_expires:
+                return self._snapshot
+
+        aggregate_lines = self.fact_provider.overview()
+        recent = self.db_manager.get_conversation_context(limit=CHAT_CONTEXT_RECENT_LIMIT)
+
+        version = hashlib.sha256()
+        for line in aggregate_lines:
+            version.update(line.encode('utf-8'))
+        for row in recent:
+            version.update(f"{row.get('timestamp')}|{row.get('message')}|{row.get('sentiment')}".encode('utf-8'))
+
+        snapshot = {
+            'aggregates': aggregate_lines,
+            'recent': recent,
+            'version': version.hexdigest(),
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._snapshot_expires = time.monotonic() + CHAT_CONTEXT_REFRESH_SECONDS
+        return snapshot
+
+    def fact_sheet(self, intent: str) -> List[str]:
+        """ข้อเท็จจริงจากสถิติสำหรับ intent (คืนค่า list ว่างถ้า intent นี้ต้องใช้ข้อความจริงประกอบ)"""
+        return self.fact_provider.facts(intent)
+
+    def build_context(self, question: str, snapshot: Optional[Dict[str, Any]] = None,
+                      facts: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        สร้าง context สำหรับคำถาม คืนค่า dict ที่มี
+        - text: context ที่จัดแล้ว
+        - tokens: จำนวน token โดยประมาณ
+        - sections: จำนวนรายการที่ใส่ได้ในแต่ละส่วน
+        ถ้าส่ง facts (จาก fact_sheet) มา context จะมีเฉพาะข้อเท็จจริงเหล่านั้น ไม่ค้นหาข้อความที่คล้ายกัน
+        """
+        if facts:
+            return self._pack([('facts', "ข้อเท็จจริงจากสถิติของระบบ (ใช้ตัวเลขเหล่านี้ในการตอบ):", facts)])
+
+        snapshot = snapshot or self.snapshot()
+        chars = CHAT_CONTEXT_MESSAGE_CHARS
+
+        similar_lines = []
+        for conv in self.chat_analyzer.find_similar_conversations(question, limit=CHAT_CONTEXT_SIMILAR_LIMIT):
+            timestamp = conv.get('timestamp')
+            day = timestamp.strftime('%Y-%m-%d') if hasattr(timestamp, 'strftime') else str(timestamp)
+            similar_lines.append(f"- [{day}] {conv['message'][:chars]} (ความคล้าย {conv['similarity']:.2f})")
+
+        recent_lines = []
+        for conv in snapshot['recent']:
+            recent_lines.append(
+                f"- [{conv.get('timestamp')}] {conv.get('sender_type')}: "
+                f"{(conv.get('message') or '')[:chars]} [ความรู้สึก: {conv.get('sentiment') or '-'}]"
+            )
+
+        return self._pack([
+            ('aggregates', "สถิติรวม:", snapshot['aggregates']),
+            ('similar', "ข้อความลูกค้าที่เกี่ยวข้องกับคำถาม:", similar_lines),
+            ('recent', "ข้อความล่าสุด:", recent_lines),
+        ])
+
+    def _pack(self, candidates: List[tuple]) -> Dict[str, Any]:
+        """ใส่ (ชื่อ, หัวข้อ, บรรทัด) ของแต่ละส่วนตามลำดับจนเต็ม token budget"""
+        sections = []
+        counts = {}
+        used = 0
+        for name, title, lines in candidates:
+            packed = []
+            cost = estimate_tokens(title) + 1
+            for line in lines:
+                line_tokens = estimate_tokens(line) + 1
+                if used + cost + line_tokens > self.token_budget:
+                    break
+                packed.append(line)
+                cost += line_tokens
+
+            counts[name] = len(packed)
+            if packed:
+                sections.append("\n".join([title] + packed))
+                used += cost
+
+        text = "\n\n".join(sections)
+        return {
+            'text': text,
+            'tokens': estimate_tokens(text),
+            'sections': counts,
+        }
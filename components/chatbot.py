@@ -1,9 +1,51 @@
 import requests
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator, AsyncIterator, Callable, Tuple
 import re
-from utils.config import CHAT_API_URL, CHAT_MODEL
+import threading
+import time
+from collections import deque
+from itertools import chain
+from utils.config import CHAT_API_URL, CHAT_MODEL, MODEL_LATENCY_SAMPLES
+from utils.model_client import get_model_client, get_async_model_client
+from utils.single_flight import request_key
+from utils.circuit_breaker import CircuitOpenError
+from utils.keyword_matcher import KeywordMatcher
+from utils.thai_tokenizer import tokenize
+from utils.response_cache import SemanticResponseCache, context_fingerprint
+from components.chat_context import ChatContextRetriever, estimate_tokens
+
+# การปรับแต่งคำตอบ (ใช้ทั้งแบบคำตอบเต็มและแบบ stream)
+ANSWER_LABELS = ('คำตอบ:', 'ตอบ:')
+POLITE_OPENINGS = ('สวัสดี', 'ขอบคุณ', 'ตาม')
+POLITE_PREFIX = "ตามข้อมูลที่มี "
+MAX_RESPONSE_LENGTH = 2000
+TRUNCATED_LENGTH = 1950
+TRUNCATION_NOTE = "...\n\n(คำตอบถูกตัดทอนเนื่องจากยาวเกินไป)"
+# คำสำคัญของเจตนาคำถาม Admin
+QUESTION_INTENTS = {
+    'analytics': ['สถิติ', 'วิเคราะห์', 'จำนวน', 'กราฟ', 'ข้อมูล', 'รายงาน'],
+    'sentiment': ['ความรู้สึก', 'พอใจ', 'ไม่พอใจ', 'โกรธ', 'ดีใจ', 'sentiment'],
+    'topics': ['หัวข้อ', 'เรื่อง', 'ปัญหา', 'topic', 'ร้องเรียน'],
+    'performance': ['ประสิทธิภาพ', 'เร็ว', 'ช้า', 'ตอบกลับ', 'response time'],
+    'suggestions': ['แนะนำ', 'ปรับปรุง', 'พัฒนา', 'ช่วย', 'ควร']
+}
+
+# คำสำคัญของประเภทข้อความลูกค้าสำหรับคำตอบแนะนำ (ตรวจตามลำดับ ใช้ประเภทแรกที่พบ)
+SUGGESTION_KEYWORDS = {
+    'greeting': ['สวัสดี', 'ว', 'hello', 'hi'],
+    'price_inquiry': ['ราคา', 'เท่าไหร่', 'price', 'cost'],
+    'shipping': ['จัดส่ง', 'ส่ง', 'delivery', 'ship'],
+    'complaint': ['ร้องเรียน', 'ปัญหา', 'เสีย', 'แย่', 'ไม่ดี'],
+    'thanks': ['ขอบคุณ', 'thank', 'thanks', 'ขอบใจ']
+}
+
+# เทียบทั้งคำหลังตัดคำ ('ว' ในรายการทักทายจึงไม่ตรงกับทุกข้อความที่มีตัว ว)
+INTENT_MATCHER = KeywordMatcher(QUESTION_INTENTS, tokenizer=tokenize)
+SUGGESTION_MATCHER = KeywordMatcher(SUGGESTION_KEYWORDS, tokenizer=tokenize)
+
+UNAVAILABLE_MESSAGE = "AI ไม่พร้อมใช้งานชั่วคราว (ระบบตอบช้าหรือเชื่อมต่อไม่ได้) กรุณาลองใหม่อีกครั้งในภายหลัง"
 
 class ChatBot:
     """
@@ -16,9 +58,20 @@ class ChatBot:
     4. ช่วยตอบลูกค้าอัตโนมัติ (ในอนาคต)
     """
     
-    def __init__(self):
+    def __init__(self, embed: Optional[Callable[[str], Optional[List[float]]]] = None,
+                 retriever: Optional[ChatContextRetriever] = None):
+        """
+        embed คือฟังก์ชันสร้าง embedding (เช่น ChatAnalyzer.get_embedding) ใช้จับคู่คำถามที่คล้ายกันในแคชคำตอบ
+        retriever ใช้เลือก context ตามคำถาม (ถ้าไม่ระบุ ใช้ context ที่ผู้เรียกส่งมา)
+        """
         self.model_url = CHAT_API_URL
         self.model_name = CHAT_MODEL
+        self.model_client = get_model_client()
+        self.async_model_client = get_async_model_client()
+        self.response_cache = SemanticResponseCache(embed)
+        self.retriever = retriever
+        self._prompt_metrics: deque = deque(maxlen=MODEL_LATENCY_SAMPLES)
+        self._metrics_lock = threading.Lock()
         self.system_prompt = """คุณคือ AI Assistant สำหรับระบบวิเคราะห์การสนทนา LINE OA 
 
 คุณมีความสามารถในการ:
@@ -30,37 +83,114 @@ class ChatBot:
 กรุณาตอบเป็นภาษาไทยที่เป็นมิตร สุภาพ และให้ข้อมูลที่เป็นประโยชน์
 หากไม่มีข้อมูลเพียงพอ ให้แจ้งชัดเจน และแนะนำทางเลือกอื่น"""
     
-    def get_response(self, user_message: str, context: Optional[List[Dict]] = None) -> str:
-        """ได้คำตอบจาก AI"""
-        try:
-            # เตรียม context จากข้อมูลการสนทนา
-            context_text = self._prepare_context(context) if context else ""
-            
-            # สร้าง prompt
-            full_prompt = f"""{self.system_prompt}
+    def _build_prompt(self, user_message: str, context_text: str) -> str:
+        """สร้าง prompt สำหรับคำถามของ Admin"""
+        return f"""{self.system_prompt}
 
-Context ข้อมูลการสนทนา (10 รายการล่าสุด):
+Context ข้อมูลการสนทนา:
 {context_text}
 
 คำถามจาก Admin: {user_message}
 
 คำตอบ:"""
+    
+    def _context_fingerprint(self, context_version: str) -> str:
+        """fingerprint ของทุกอย่างใน prompt ยกเว้นคำถาม (เปลี่ยนเมื่อมีการสนทนาใหม่เข้ามาใน context)"""
+        return context_fingerprint(self.model_name, self.system_prompt, context_version)
+    
+    def _context_source(self, user_message: str,
+                        context: Optional[List[Dict]]) -> Tuple[str, str, Callable[[], str]]:
+        """
+        เลือกแหล่ง context คืนค่า (mode, version ของข้อมูล, ฟังก์ชันสร้าง context)
+        - 'facts': คำถามเชิงสถิติ (ตาม analyze_question_intent) ใช้ fact sheet ที่คำนวณไว้แล้ว
+        - 'retrieval': เลือกตามคำถามด้วย retriever (version มาจาก snapshot ของสถิติและข้อความล่าสุด)
+        - 'recent': ใช้ context ที่ส่งมาทั้งหมด (version คือข้อความ context เอง)
+        ตรวจแคชคำตอบด้วย version ได้ก่อนเสียเวลาค้นหา context
+        """
+        if context is None and self.retriever is not None:
+            intent = self.analyze_question_intent(user_message)['primary_intent']
+            facts = self.retriever.fact_sheet(intent)
+            if facts:
+                return 'facts', "\n".join([intent] + facts), lambda: self.retriever.build_context(user_message, facts=facts)['text']
+            
+            snapshot = self.retriever.snapshot()
+            return 'retrieval', snapshot['version'], lambda: self.retriever.build_context(user_message, snapshot)['text']
+        
+        context_text = self._prepare_context(context) if context else ""
+        return 'recent', context_text, lambda: context_text
+    
+    def _record_prompt(self, mode: str, prompt: str, context_text: str,
+                       retrieval_seconds: float, generation_seconds: float):
+        """เก็บขนาด prompt และเวลาที่ใช้ของการเรียก model แต่ละครั้ง"""
+        with self._metrics_lock:
+            self._prompt_metrics.append({
+                'mode': mode,
+                'prompt_tokens': estimate_tokens(prompt),
+                'context_tokens': estimate_tokens(context_text),
+                'retrieval_ms': retrieval_seconds * 1000,
+                'generation_ms': generation_seconds * 1000,
+            })
+    
+    def prompt_stats(self) -> Dict[str, Dict[str, float]]:
+        """ค่าเฉลี่ยขนาด prompt (token โดยประมาณ) และเวลาของแต่ละ mode จากการเรียกล่าสุด"""
+        with self._metrics_lock:
+            samples = list(self._prompt_metrics)
+        
+        stats = {}
+        for sample in samples:
+            mode_stats = stats.setdefault(sample['mode'], {
+                'requests': 0, 'prompt_tokens': 0.0, 'context_tokens': 0.0,
+                'retrieval_ms': 0.0, 'generation_ms': 0.0
+            })
+            mode_stats['requests'] += 1
+            for key in ('prompt_tokens', 'context_tokens', 'retrieval_ms', 'generation_ms'):
+                mode_stats[key] += sample[key]
+        
+        for mode_stats in stats.values():
+            for key in ('prompt_tokens', 'context_tokens', 'retrieval_ms', 'generation_ms'):
+                mode_stats[key] /= mode_stats['requests']
+        return stats
+    
+    def _generation_payload(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "temperature": 0.7,
+                "top_p": 0.9,
+                "max_tokens": 1000
+            }
+        }
+    
+    def get_response(self, user_message: str, context: Optional[List[Dict]] = None) -> str:
+        """ได้คำตอบจาก AI (คำถามที่คล้ายกันบน context เดิมได้คำตอบจากแคช)"""
+        try:
+            # เตรียม context จากข้อมูลการสนทนา
+            mode, context_version, build_context = self._context_source(user_message, context)
+            fingerprint = self._context_fingerprint(context_version)
+            
+            cached_response, question_vector = self.response_cache.lookup(user_message, fingerprint)
+            if cached_response is not None:
+                return cached_response
+            
+            if not self.model_client.available('chat'):
+                return self._unavailable_response(mode, build_context)
+            
+            started = time.perf_counter()
+            context_text = build_context()
+            retrieval_seconds = time.perf_counter() - started
+            full_prompt = self._build_prompt(user_message, context_text)
 
             # เรียก AI API
-            response = requests.post(
-                self.model_url,
-                json={
-                    "model": self.model_name,
-                    "prompt": full_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "max_tokens": 1000
-                    }
-                },
-                timeout=60
-            )
+            started = time.perf_counter()
+            with self.model_client.slot(self.model_name):
+                response = self.model_client.post_shared(
+                    'chat',
+                    self.model_url,
+                    self._generation_payload(full_prompt)
+                )
+            self._record_prompt(mode, full_prompt, context_text, retrieval_seconds, time.perf_counter() - started)
             
             if response.status_code == 200:
                 result = response.json()
@@ -68,13 +198,17 @@ Context ข้อมูลการสนทนา (10 รายการล่
                 
                 # ตรวจสอบและปรับปรุงคำตอบ
                 if ai_response:
-                    return self._post_process_response(ai_response, user_message)
+                    final_response = self._post_process_response(ai_response, user_message)
+                    self.response_cache.store(user_message, fingerprint, final_response, question_vector)
+                    return final_response
                 else:
                     return "ขออภัย ไม่สามารถสร้างคำตอบได้ในขณะนี้"
             
             else:
                 return f"เกิดข้อผิดพลาดในการเชื่อมต่อ AI (Status: {response.status_code})"
                 
+        except CircuitOpenError:
+            return UNAVAILABLE_MESSAGE
         except requests.exceptions.Timeout:
             return "การเชื่อมต่อ AI หมดเวลา กรุณาลองใหม่อีกครั้ง"
         except requests.exceptions.ConnectionError:
@@ -82,6 +216,100 @@ Context ข้อมูลการสนทนา (10 รายการล่
         except Exception as e:
             return f"เกิดข้อผิดพลาดไม่คาดคิด: {str(e)}"
     
+    def stream_response(self, user_message: str, context: Optional[List[Dict]] = None) -> Iterator[str]:
+        """
+        ได้คำตอบจาก AI แบบ stream (yield ทีละส่วนทันทีที่ model สร้าง)
+        ผลรวมของทุกส่วนเท่ากับคำตอบของ get_response ข้อผิดพลาดจะถูก yield เป็นข้อความ
+        """
+        try:
+            mode, context_version, build_context = self._context_source(user_message, context)
+            fingerprint = self._context_fingerprint(context_version)
+            
+            cached_response, question_vector = self.response_cache.lookup(user_message, fingerprint)
+            if cached_response is not None:
+                yield cached_response
+                return
+            
+            if not self.model_client.available('chat'):
+                yield self._unavailable_response(mode, build_context)
+                return
+            
+            started = time.perf_counter()
+            context_text = build_context()
+            retrieval_seconds = time.perf_counter() - started
+            full_prompt = self._build_prompt(user_message, context_text)
+            
+            # คำถามเดียวกันที่กำลังสร้างคำตอบอยู่ (prompt เดียวกัน) ได้ stream เดียวกันแทนการเรียก model ซ้ำ
+            started = time.perf_counter()
+            payload = self._generation_payload(full_prompt, stream=True)
+            pieces = []
+            for piece in self.model_client.single_flight.stream(
+                request_key('chat_stream', self.model_url, payload),
+                self._stream_answer,
+                payload
+            ):
+                pieces.append(piece)
+                yield piece
+            self._record_prompt(mode, full_prompt, context_text, retrieval_seconds, time.perf_counter() - started)
+            
+            if pieces:
+                self.response_cache.store(user_message, fingerprint, ''.join(pieces), question_vector)
+            else:
+                yield "ขออภัย ไม่สามารถสร้างคำตอบได้ในขณะนี้"
+                
+        except requests.exceptions.HTTPError as e:
+            yield f"เกิดข้อผิดพลาดในการเชื่อมต่อ AI (Status: {e.response.status_code})"
+        except CircuitOpenError:
+            yield UNAVAILABLE_MESSAGE
+        except requests.exceptions.Timeout:
+            yield "การเชื่อมต่อ AI หมดเวลา กรุณาลองใหม่อีกครั้ง"
+        except requests.exceptions.ConnectionError:
+            yield "ไม่สามารถเชื่อมต่อกับ AI ได้ กรุณาตรวจสอบการตั้งค่า"
+        except Exception as e:
+            yield f"เกิดข้อผิดพลาดไม่คาดคิด: {str(e)}"
+    
+    def _unavailable_response(self, mode: str, build_context: Callable[[], str]) -> str:
+        """คำตอบเมื่อ chat model ไม่พร้อมใช้งาน คำถามเชิงสถิติยังได้ fact sheet ที่คำนวณไว้"""
+        if mode == 'facts':
+            return f"{UNAVAILABLE_MESSAGE}\n\n{build_context()}"
+        return UNAVAILABLE_MESSAGE
+    
+    async def agenerate(self, user_message: str, context: Optional[List[Dict]] = None) -> str:
+        """get_response แบบ async (ไม่ block event loop)"""
+        return await self.async_model_client.run(self.model_name, self.get_response, user_message, context)
+    
+    async def astream(self, user_message: str, context: Optional[List[Dict]] = None) -> AsyncIterator[str]:
+        """stream_response แบบ async"""
+        async for piece in self.async_model_client.iterate(self.model_name, self.stream_response, user_message, context):
+            yield piece
+    
+    def _stream_answer(self, payload: Dict[str, Any]) -> Iterator[str]:
+        """
+        เรียก model แบบ stream แล้ว yield คำตอบที่ปรับแต่งแล้ว (raise HTTPError ถ้า server ตอบไม่สำเร็จ)
+        ถือ slot ของ chat model ตลอดอายุของ stream เพราะ model ยังสร้างคำตอบอยู่จนกว่าจะอ่านจบหรือปิด
+        """
+        with self.model_client.slot(self.model_name):
+            response = self.model_client.post('chat_stream', self.model_url, payload, stream=True)
+            with response:
+                if response.status_code != 200:
+                    raise requests.exceptions.HTTPError(response=response)
+                yield from self._post_process_stream(self._iter_stream_tokens(response))
+    
+    def _iter_stream_tokens(self, response: requests.Response) -> Iterator[str]:
+        """อ่าน NDJSON stream ของ Ollama ทีละบรรทัด แล้ว yield ข้อความของแต่ละ token"""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise RuntimeError(chunk['error'])
+            
+            if chunk.get('response'):
+                yield chunk['response']
+            if chunk.get('done'):
+                break
+    
     def _prepare_context(self, context: List[Dict]) -> str:
         """เตรียม context สำหรับ AI"""
         if not context:
@@ -108,30 +336,115 @@ Context ข้อมูลการสนทนา (10 รายการล่
         response = re.sub(r'^\s*ตอบ:\s*', '', response, flags=re.MULTILINE)
         
         # เพิ่มความสุภาพ
-        if not response.startswith(('สวัสดี', 'ขอบคุณ', 'ตาม')):
-            response = f"ตามข้อมูลที่มี {response}"
+        if not response.startswith(POLITE_OPENINGS):
+            response = f"{POLITE_PREFIX}{response}"
         
         # จำกัดความยาว
-        if len(response) > 2000:
-            response = response[:1950] + "...\n\n(คำตอบถูกตัดทอนเนื่องจากยาวเกินไป)"
+        if len(response) > MAX_RESPONSE_LENGTH:
+            response = response[:TRUNCATED_LENGTH] + TRUNCATION_NOTE
         
         return response.strip()
     
+    def _strip_answer_label(self, chunks: Iterable[str], label: str) -> Iterator[str]:
+        """
+        ลบ label ที่ต้นบรรทัดออกจาก stream ให้ได้ผลเหมือน re.sub(r'^\s*<label>\s*', '', flags=re.MULTILINE)
+        พักข้อความช่วงต้นบรรทัดไว้จนรู้ว่าเป็น label หรือไม่
+        """
+        pending = ''
+        at_line_start = True
+        
+        for chunk in chunks:
+            pending += chunk
+            while pending:
+                if at_line_start:
+                    rest = pending.lstrip()
+                    if not rest:
+                        break
+                    if rest.startswith(label):
+                        after = rest[len(label):]
+                        remaining = after.lstrip()
+                        if not remaining:
+                            break
+                        # ต้นบรรทัดใหม่ถ้าช่องว่างที่ถูกลบจบด้วยการขึ้นบรรทัด
+                        at_line_start = after[:len(after) - len(remaining)].endswith('\n')
+                        pending = remaining
+                        continue
+                    if label.startswith(rest):
+                        break
+                    at_line_start = False
+                
+                newline = pending.find('\n')
+                if newline == -1:
+                    yield pending
+                    pending = ''
+                else:
+                    yield pending[:newline + 1]
+                    pending = pending[newline + 1:]
+                    at_line_start = True
+        
+        if pending and not (at_line_start and pending.lstrip().startswith(label)):
+            yield pending
+    
+    def _post_process_stream(self, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        ปรับปรุงคำตอบแบบ stream ให้ได้ผลเหมือน _post_process_response
+        รอเฉพาะช่วงต้นที่ต้องใช้ตัดสินคำขึ้นต้น และพักช่องว่างท้ายไว้จนมีข้อความต่อ
+        """
+        received = False
+        
+        def strip_leading(chunks):
+            nonlocal received
+            for chunk in chunks:
+                if not received:
+                    chunk = chunk.lstrip()
+                    if not chunk:
+                        continue
+                    received = True
+                yield chunk
+        
+        pieces = strip_leading(chunks)
+        for label in ANSWER_LABELS:
+            pieces = self._strip_answer_label(pieces, label)
+        
+        opening_length = max(len(opening) for opening in POLITE_OPENINGS)
+        head = ''
+        for piece in pieces:
+            head += piece
+            if len(head) >= opening_length:
+                break
+        
+        prefix = '' if head.startswith(POLITE_OPENINGS) else POLITE_PREFIX
+        if not head:
+            # ทั้งคำตอบเป็น label - ได้ผลเหมือน _post_process_response
+            if received:
+                yield prefix.strip()
+            return
+        
+        sent = 0
+        held = ''
+        for piece in chain([prefix + head], pieces):
+            held += piece
+            if sent + len(held) > MAX_RESPONSE_LENGTH:
+                yield held[:TRUNCATED_LENGTH - sent] + TRUNCATION_NOTE
+                return
+            
+            ready = held.rstrip()[:TRUNCATED_LENGTH - sent]
+            if ready:
+                yield ready
+                sent += len(ready)
+                held = held[len(ready):]
+        
+        tail = held.rstrip()
+        if tail:
+            yield tail
+    
     def analyze_question_intent(self, question: str) -> Dict[str, Any]:
         """วิเคราะห์เจตนาของคำถาม"""
-        question_lower = question.lower()
-        
-        intents = {
-            'analytics': ['สถิติ', 'วิเคราะห์', 'จำนวน', 'กราฟ', 'ข้อมูล', 'รายงาน'],
-            'sentiment': ['ความรู้สึก', 'พอใจ', 'ไม่พอใจ', 'โกรธ', 'ดีใจ', 'sentiment'],
-            'topics': ['หัวข้อ', 'เรื่อง', 'ปัญหา', 'topic', 'ร้องเรียน'],
-            'performance': ['ประสิทธิภาพ', 'เร็ว', 'ช้า', 'ตอบกลับ', 'response time'],
-            'suggestions': ['แนะนำ', 'ปรับปรุง', 'พัฒนา', 'ช่วย', 'ควร']
-        }
+        keyword_counts = INTENT_MATCHER.count(question.lower())
         
         detected_intents = []
-        for intent, keywords in intents.items():
-            score = sum(1 for keyword in keywords if keyword in question_lower)
+        for intent, keywords in QUESTION_INTENTS.items():
+            score = keyword_counts.get(intent, 0)
             if score > 0:
                 detected_intents.append({
                     'intent': intent,
@@ -156,12 +469,13 @@ Context ข้อมูลการสนทนา (10 รายการล่
         """
         try:
             # วิเคราะห์ประเภทของคำถามลูกค้า
-            message_lower = customer_message.lower()
+            keyword_counts = SUGGESTION_MATCHER.count(customer_message.lower())
+            message_type = next((name for name in SUGGESTION_KEYWORDS if keyword_counts.get(name)), 'general')
             
             suggested_responses = []
             
             # คำตอบสำหรับการทักทาย
-            if any(greeting in message_lower for greeting in ['สวัสดี', 'ว', 'hello', 'hi']):
+            if message_type == 'greeting':
                 suggested_responses.append({
                     'type': 'greeting',
                     'response': 'สวัสดีค่ะ ยินดีให้บริการ 🙏 มีอะไรให้ช่วยเหลือไหมคะ?',
@@ -169,7 +483,7 @@ Context ข้อมูลการสนทนา (10 รายการล่
                 })
             
             # คำตอบสำหรับการสอบถามราคา
-            elif any(price in message_lower for price in ['ราคา', 'เท่าไหร่', 'price', 'cost']):
+            elif message_type == 'price_inquiry':
                 suggested_responses.extend([
                     {
                         'type': 'price_inquiry',
@@ -184,7 +498,7 @@ Context ข้อมูลการสนทนา (10 รายการล่
                 ])
             
             # คำตอบสำหรับการสอบถามการจัดส่ง
-            elif any(shipping in message_lower for shipping in ['จัดส่ง', 'ส่ง', 'delivery', 'ship']):
+            elif message_type == 'shipping':
                 suggested_responses.extend([
                     {
                         'type': 'shipping',
@@ -199,7 +513,7 @@ Context ข้อมูลการสนทนา (10 รายการล่
                 ])
             
             # คำตอบสำหรับการร้องเรียน
-            elif any(complaint in message_lower for complaint in ['ร้องเรียน', 'ปัญหา', 'เสีย', 'แย่', 'ไม่ดี']):
+            elif message_type == 'complaint':
                 suggested_responses.extend([
                     {
                         'type': 'complaint',
@@ -214,7 +528,7 @@ Context ข้อมูลการสนทนา (10 รายการล่
                 ])
             
             # คำตอบสำหรับการขอบคุณ
-            elif any(thanks in message_lower for thanks in ['ขอบคุณ', 'thank', 'ขอบใจ']):
+            elif message_type == 'thanks':
                 suggested_responses.extend([
                     {
                         'type': 'thanks',
@@ -280,7 +594,10 @@ Context ข้อมูลการสนทนา (10 รายการล่
     def _enhance_response_with_context(self, base_response: str, 
                                      customer_message: str,
                                      context: Optional[List[Dict]]) -> str:
-        """ปรับปรุงคำตอบด้วย AI โดยใช้ context"""
+        """ปรับปรุงคำตอบด้วย AI โดยใช้ context (ใช้คำตอบเริ่มต้นเมื่อ chat model ไม่พร้อมใช้งาน)"""
+        if not self.model_client.available('chat'):
+            return base_response
+        
         try:
             context_text = self._prepare_context(context) if context else ""
             
@@ -300,19 +617,21 @@ Context การสนทนา:
 
 คำตอบที่ปรับปรุงแล้ว:"""
             
-            response = requests.post(
-                self.model_url,
-                json={
-                    "model": self.model_name,
-                    "prompt": enhance_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.5,
-                        "max_tokens": 200
-                    }
-                },
-                timeout=30
-            )
+            with self.model_client.slot(self.model_name):
+                response = self.model_client.post(
+                    'chat',
+                    self.model_url,
+                    {
+                        "model": self.model_name,
+                        "prompt": enhance_prompt,
+                        "stream": False,
+                        "options": {
+                            "temperature": 0.5,
+                            "max_tokens": 200
+                        }
+                    },
+                    timeout=30
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -330,6 +649,8 @@ Context การสนทนา:
         try:
             if not conversation_data:
                 return "ไม่มีข้อมูลการสนทนาให้วิเคราะห์"
+            if not self.model_client.available('chat'):
+                return UNAVAILABLE_MESSAGE
             
             # เตรียมข้อมูลสำหรับ AI
             convo_summary = self._summarize_conversation_for_ai(conversation_data)
@@ -346,19 +667,21 @@ Context การสนทนา:
 
 การวิเคราะห์:"""
             
-            response = requests.post(
-                self.model_url,
-                json={
-                    "model": self.model_name,
-                    "prompt": insights_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "max_tokens": 500
-                    }
-                },
-                timeout=45
-            )
+            with self.model_client.slot(self.model_name):
+                response = self.model_client.post_shared(
+                    'chat',
+                    self.model_url,
+                    {
+                        "model": self.model_name,
+                        "prompt": insights_prompt,
+                        "stream": False,
+                        "options": {
+                            "temperature": 0.7,
+                            "max_tokens": 500
+                        }
+                    },
+                    timeout=45
+                )
             
             if response.status_code == 200:
                 result = response.json()
@@ -388,9 +711,10 @@ Context การสนทนา:
     def check_service_availability(self) -> Dict[str, Any]:
         """ตรวจสอบความพร้อมของ AI service"""
         try:
-            test_response = requests.post(
+            test_response = self.model_client.post(
+                'chat',
                 self.model_url,
-                json={
+                {
                     "model": self.model_name,
                     "prompt": "สวัสดี",
                     "stream": False,
@@ -413,6 +737,12 @@ Context การสนทนา:
                     'error_code': test_response.status_code
                 }
                 
+        except CircuitOpenError as e:
+            return {
+                'available': False,
+                'status': 'circuit_open',
+                'error': str(e)
+            }
         except requests.exceptions.Timeout:
             return {
                 'available': False,
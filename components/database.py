@@ -1,12 +1,127 @@
 import pandas as pd
 import pymysql
-from sqlalchemy import create_engine, text
-from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text, bindparam
+from datetime import datetime, timedelta, date, time
 import json
+import uuid
 import hashlib
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Iterable
+from itertools import islice
+import threading
+from types import SimpleNamespace
+import pytz
 import streamlit as st
-from utils.config import TIDB_URL
+from utils.config import (
+    TIDB_URL, TIMEZONE, BULK_INSERT_BATCH_SIZE, SKETCH_COMPACTION_BATCH_SIZE, DAILY_METRICS_LOCK_TIMEOUT
+)
+from utils.hyperloglog import HyperLogLog
+from utils.vector_codec import encode_vector, json_to_blob
+
+# เวอร์ชันของ schema - เพิ่มค่านี้เมื่อมีการเปลี่ยนแปลงตารางหรือ index
+SCHEMA_VERSION = 12
+
+# Migration สำหรับฐานข้อมูลที่สร้างไว้ก่อนหน้า (ทุกคำสั่งต้องรันซ้ำได้)
+SCHEMA_MIGRATIONS = {
+    2: [
+        # composite index สำหรับ query ช่วงเวลาของ dashboard
+        "CREATE INDEX IF NOT EXISTS idx_timestamp_sender ON conversations (timestamp, sender_type)",
+        "CREATE INDEX IF NOT EXISTS idx_timestamp_message_type ON conversations (timestamp, message_type)",
+        "CREATE INDEX IF NOT EXISTS idx_timestamp_conversation ON conversations (timestamp, conversation_id, user_id)",
+    ],
+    4: [
+        # embedding แบบ binary (ดู utils/vector_codec.py) แทน JSON
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS embedding_blob MEDIUMBLOB DEFAULT NULL",
+        "ALTER TABLE topics ADD COLUMN IF NOT EXISTS embedding_blob MEDIUMBLOB DEFAULT NULL",
+    ],
+    5: [
+        # ใช้ sync vector index ตามลำดับเวลาที่ประมวลผล
+        "CREATE INDEX IF NOT EXISTS idx_processed_at ON conversations (processed_at, id)",
+    ],
+    7: [
+        # lease ของ backlog worker (ดู claim_unprocessed_messages)
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(100) DEFAULT NULL",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP NULL DEFAULT NULL",
+    ],
+    8: [
+        # ขั้นตอนที่ข้ามใน MessagePipeline (ดู components/chat_analysis.py)
+        "INSERT IGNORE INTO settings (setting_key, setting_value, setting_type, description) "
+        "VALUES ('pipeline_skip_stages', '[]', 'json', 'Message pipeline stages to skip')",
+    ],
+    9: [
+        # user/conversation ที่รอ merge เข้า sketch ของ daily_metrics (ดู compact_daily_sketches)
+        """
+        CREATE TABLE IF NOT EXISTS daily_sketch_queue (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            metric_date DATE NOT NULL,
+            message_type VARCHAR(20) NOT NULL,
+            sender_type VARCHAR(20) NOT NULL,
+            user_id VARCHAR(100) NOT NULL,
+            conversation_id VARCHAR(100) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+    ],
+    10: [
+        # ใช้อ่าน id กลับใน insert_conversations_bulk (AUTO_INCREMENT ของ TiDB ไม่รับประกันว่าเรียงต่อกัน)
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS insert_batch VARCHAR(48) DEFAULT NULL",
+    ],
+    11: [
+        # rebuild_daily_metrics ล้างรายการของแต่ละวัน และ dashboard อ่านรายการที่รอ compact ตามช่วงวันที่
+        "CREATE INDEX IF NOT EXISTS idx_metric_date ON daily_sketch_queue (metric_date)",
+    ],
+    12: [
+        # insert_batch ถูกล้างใน transaction ที่ insert และอ่านกลับด้วยช่วง id จึงไม่ต้องมี index
+        "ALTER TABLE conversations DROP INDEX IF EXISTS idx_insert_batch",
+    ],
+}
+
+# ชื่อ lock (GET_LOCK) ที่ rebuild_daily_metrics และ compact_daily_sketches ใช้ร่วมกัน
+DAILY_METRICS_LOCK = 'daily_metrics_rebuild'
+
+LOCAL_TZ = pytz.timezone(TIMEZONE)
+
+# เงื่อนไขช่วงเวลาแบบครึ่งเปิด ใช้ index บนคอลัมน์ timestamp ได้ (ห้ามครอบด้วย DATE())
+DATE_RANGE_FILTER = "timestamp >= :start_ts AND timestamp < :end_ts"
+
+# เงื่อนไขช่วงวันที่สำหรับตาราง rollup daily_metrics (metric_date เป็นวันที่ท้องถิ่นอยู่แล้ว)
+DAY_RANGE_FILTER = "metric_date BETWEEN :start_day AND :end_day"
+
+# engine และสถานะ schema ใช้ร่วมกันทั้ง process (ทุก session / ทุก DatabaseManager)
+_engines: Dict[str, Any] = {}
+_engine_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready_version = 0
+
+def local_utc_offset() -> str:
+    """offset ของ TIMEZONE ในรูปแบบ '+07:00' สำหรับตั้งค่า time_zone ของ session"""
+    offset = datetime.now(LOCAL_TZ).strftime('%z')
+    return f"{offset[:3]}:{offset[3:]}"
+
+def to_local_date(value: Any) -> date:
+    """แปลง date/datetime (มีหรือไม่มี timezone) เป็นวันที่ตามเวลาท้องถิ่น"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(LOCAL_TZ)
+        return value.date()
+    return value
+
+def date_range_params(start_date: Any, end_date: Any) -> Dict[str, datetime]:
+    """
+    แปลงช่วงวันที่แบบรวมวันสุดท้าย เป็นพารามิเตอร์ของ DATE_RANGE_FILTER
+    คือ [00:00 ของวันเริ่มต้น, 00:00 ของวันถัดจากวันสิ้นสุด) ตามเวลาท้องถิ่น
+    """
+    start_day = to_local_date(start_date)
+    end_day = to_local_date(end_date)
+    return {
+        "start_ts": datetime.combine(start_day, time.min),
+        "end_ts": datetime.combine(end_day + timedelta(days=1), time.min)
+    }
+
+def day_range_params(start_date: Any, end_date: Any) -> Dict[str, date]:
+    """แปลงช่วงวันที่เป็นพารามิเตอร์ของ DAY_RANGE_FILTER"""
+    return {
+        "start_day": to_local_date(start_date),
+        "end_day": to_local_date(end_date)
+    }
 
 class DatabaseManager:
     """จัดการการเชื่อมต่อและดำเนินการกับฐานข้อมูล TiDB"""
@@ -17,26 +132,98 @@ class DatabaseManager:
         self.init_tables()
     
     def connect(self):
-        """สร้างการเชื่อมต่อกับ TiDB"""
+        """สร้างการเชื่อมต่อกับ TiDB (ใช้ engine ร่วมกันถ้าเคยสร้างแล้วใน process นี้)"""
+        with _engine_lock:
+            if TIDB_URL in _engines:
+                self.engine = _engines[TIDB_URL]
+                return
+            
+            try:
+                self.engine = create_engine(
+                    TIDB_URL,
+                    pool_size=10,
+                    max_overflow=20,
+                    pool_timeout=30,
+                    pool_recycle=3600,
+                    pool_pre_ping=True,
+                    echo=False,
+                    # ให้ DATE()/CURDATE() และการเทียบ timestamp เป็นเวลาท้องถิ่น
+                    connect_args={"init_command": f"SET time_zone = '{local_utc_offset()}'"}
+                )
+                # Test connection
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                _engines[TIDB_URL] = self.engine
+                print("✅ เชื่อมต่อ TiDB สำเร็จ")
+            except Exception as e:
+                print(f"❌ ไม่สามารถเชื่อมต่อ TiDB: {str(e)}")
+                raise
+    
+    def init_tables(self):
+        """
+        สร้างตารางที่จำเป็น
+        ทำครั้งเดียวต่อ process และข้ามไปเลยถ้าฐานข้อมูลมี schema version ล่าสุดแล้ว
+        """
+        global _schema_ready_version
+        
+        with _schema_lock:
+            if _schema_ready_version >= SCHEMA_VERSION:
+                return
+            
+            db_version = self.get_schema_version()
+            if db_version >= SCHEMA_VERSION:
+                _schema_ready_version = SCHEMA_VERSION
+                print(f"✅ Schema เป็นเวอร์ชันล่าสุดแล้ว (v{SCHEMA_VERSION})")
+                return
+            
+            self._create_tables()
+            self._run_migrations(db_version)
+            
+            if 0 < db_version < 3:
+                print("⚠️ ตาราง daily_metrics ถูกสร้างใหม่ กรุณารัน: python manage.py backfill-metrics")
+            if 0 < db_version < 4:
+                print("⚠️ embedding เปลี่ยนเป็นแบบ binary กรุณารัน: python manage.py migrate-embeddings")
+            _schema_ready_version = SCHEMA_VERSION
+    
+    def get_schema_version(self) -> int:
+        """ดึง schema version ที่บันทึกไว้ในฐานข้อมูล (0 ถ้ายังไม่เคยสร้าง)"""
         try:
-            self.engine = create_engine(
-                TIDB_URL,
-                pool_size=10,
-                max_overflow=20,
-                pool_timeout=30,
-                pool_recycle=3600,
-                echo=False
-            )
-            # Test connection
             with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            print("✅ เชื่อมต่อ TiDB สำเร็จ")
+                result = conn.execute(text("""
+                    SELECT setting_value 
+                    FROM settings 
+                    WHERE setting_key = 'schema_version'
+                """)).scalar()
+                return int(float(result)) if result else 0
+        except Exception:
+            # ตาราง settings ยังไม่มี
+            return 0
+    
+    def _run_migrations(self, from_version: int):
+        """รัน migration ที่ใหม่กว่า from_version แล้วบันทึก schema version"""
+        try:
+            with self.engine.connect() as conn:
+                for version in sorted(SCHEMA_MIGRATIONS):
+                    if version <= from_version:
+                        continue
+                    for statement in SCHEMA_MIGRATIONS[version]:
+                        conn.execute(text(statement))
+                    print(f"✅ Migrate schema เป็น v{version} สำเร็จ")
+                
+                # บันทึก schema version เพื่อให้ process ถัดไปข้ามการสร้างตาราง
+                conn.execute(text("""
+                    INSERT INTO settings (setting_key, setting_value, setting_type, description)
+                    VALUES ('schema_version', :version, 'number', 'Database schema version')
+                    ON DUPLICATE KEY UPDATE setting_value = :version
+                """), {"version": str(SCHEMA_VERSION)})
+                conn.commit()
+                
         except Exception as e:
-            print(f"❌ ไม่สามารถเชื่อมต่อ TiDB: {str(e)}")
+            print(f"❌ เกิดข้อผิดพลาดในการ migrate schema: {str(e)}")
             raise
     
-    def init_tables(self):
-        """สร้างตารางที่จำเป็น"""
+    def _create_tables(self):
+        """สร้างตารางและข้อมูลเริ่มต้นทั้งหมด"""
         try:
             with self.engine.connect() as conn:
                 # ตาราง conversations - เก็บข้อมูลการสนทนา
@@ -52,14 +239,22 @@ class DatabaseManager:
                         response_time INT DEFAULT NULL COMMENT 'เวลาตอบกลับในวินาที',
                         sentiment ENUM('positive', 'negative', 'neutral') DEFAULT NULL,
                         sentiment_score DECIMAL(3,2) DEFAULT NULL COMMENT 'คะแนนความรู้สึก -1 ถึง 1',
-                        embedding_vector JSON DEFAULT NULL COMMENT 'Vector embedding สำหรับการค้นหา',
+                        embedding_vector JSON DEFAULT NULL COMMENT 'Vector embedding แบบเดิม (JSON)',
+                        embedding_blob MEDIUMBLOB DEFAULT NULL COMMENT 'Vector embedding แบบ binary สำหรับการค้นหา',
                         processed_at TIMESTAMP NULL COMMENT 'เวลาที่ประมวลผล AI',
+                        claimed_by VARCHAR(100) DEFAULT NULL COMMENT 'worker ที่จองข้อความไว้ประมวลผล',
+                        claimed_until TIMESTAMP NULL DEFAULT NULL COMMENT 'เวลาหมดอายุของการจอง',
                         metadata JSON DEFAULT NULL COMMENT 'ข้อมูลเพิ่มเติม เช่น location, file_info',
+                        insert_batch VARCHAR(48) DEFAULT NULL COMMENT 'ใช้ชั่วคราวใน insert_conversations_bulk (NULL หลัง commit)',
                         INDEX idx_conversation_id (conversation_id),
                         INDEX idx_user_id (user_id),
                         INDEX idx_timestamp (timestamp),
                         INDEX idx_sender_type (sender_type),
-                        INDEX idx_sentiment (sentiment)
+                        INDEX idx_sentiment (sentiment),
+                        INDEX idx_timestamp_sender (timestamp, sender_type),
+                        INDEX idx_timestamp_message_type (timestamp, message_type),
+                        INDEX idx_timestamp_conversation (timestamp, conversation_id, user_id),
+                        INDEX idx_processed_at (processed_at, id)
                     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
                 """))
                 
@@ -96,6 +291,7 @@ class DatabaseManager:
                         topic_keywords JSON NOT NULL COMMENT 'คำสำคัญของหัวข้อ',
                         frequency INT DEFAULT 1,
                         embedding_vector JSON DEFAULT NULL,
+                        embedding_blob MEDIUMBLOB DEFAULT NULL,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                         UNIQUE KEY unique_topic (topic_name)
@@ -127,6 +323,49 @@ class DatabaseManager:
                     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
                 """))
                 
+                # ตาราง embedding_cache - แคช embedding ตาม hash ของ model และข้อความ
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS embedding_cache (
+                        cache_key CHAR(64) NOT NULL PRIMARY KEY COMMENT 'SHA-256 ของ model และข้อความ',
+                        model VARCHAR(100) NOT NULL,
+                        embedding_blob MEDIUMBLOB NOT NULL,
+                        expires_at TIMESTAMP NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        INDEX idx_expires (expires_at)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """))
+                
+                # ตาราง daily_metrics - rollup รายวันสำหรับ dashboard (อัปเดตทุกครั้งที่เพิ่ม/ประมวลผลข้อความ)
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS daily_metrics (
+                        metric_date DATE NOT NULL COMMENT 'วันที่ตามเวลาท้องถิ่น',
+                        message_type VARCHAR(20) NOT NULL,
+                        sender_type VARCHAR(20) NOT NULL,
+                        message_count INT NOT NULL DEFAULT 0,
+                        response_time_sum BIGINT NOT NULL DEFAULT 0 COMMENT 'ผลรวมเวลาตอบกลับ (วินาที)',
+                        response_time_count INT NOT NULL DEFAULT 0,
+                        sentiment_score_sum DECIMAL(16,2) NOT NULL DEFAULT 0,
+                        sentiment_count INT NOT NULL DEFAULT 0,
+                        user_sketch BLOB DEFAULT NULL COMMENT 'HyperLogLog ของ user_id',
+                        conversation_sketch BLOB DEFAULT NULL COMMENT 'HyperLogLog ของ conversation_id',
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                        PRIMARY KEY (metric_date, message_type, sender_type)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """))
+                
+                # ตาราง daily_sketch_queue - user/conversation ที่รอ merge เข้า sketch ของ daily_metrics
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS daily_sketch_queue (
+                        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                        metric_date DATE NOT NULL,
+                        message_type VARCHAR(20) NOT NULL,
+                        sender_type VARCHAR(20) NOT NULL,
+                        user_id VARCHAR(100) NOT NULL,
+                        conversation_id VARCHAR(100) NOT NULL,
+                        INDEX idx_metric_date (metric_date)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """))
+                
                 # ตาราง admin_users - ผู้ใช้ที่มีสิทธิ์เข้าถึงระบบ
                 conn.execute(text("""
                     CREATE TABLE IF NOT EXISTS admin_users (
@@ -161,6 +400,7 @@ class DatabaseManager:
                     ('max_response_time', '300', 'number', 'Maximum response time in seconds'),
                     ('business_hours_start', '09:00', 'string', 'Business hours start time'),
                     ('business_hours_end', '18:00', 'string', 'Business hours end time'),
+                    ('pipeline_skip_stages', '[]', 'json', 'Message pipeline stages to skip'),
                 ]
                 
                 for setting in default_settings:
@@ -191,6 +431,46 @@ class DatabaseManager:
             print(f"Connection check failed: {str(e)}")
             return False
     
+    def explain_query(self, query: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """ดู execution plan ของ query (EXPLAIN)"""
+        with self.engine.connect() as conn:
+            return pd.read_sql(text(f"EXPLAIN {query}"), conn, params=params or {})
+    
+    def explain_date_filters(self, start_date: Any, end_date: Any) -> Dict[str, Any]:
+        """
+        เปรียบเทียบ plan ของเงื่อนไขแบบเดิม DATE(timestamp) BETWEEN ...
+        กับแบบช่วงครึ่งเปิด เพื่อตรวจว่า query ใหม่ใช้ index ไม่ใช่ full scan
+        """
+        before_query = """
+            SELECT COUNT(*) FROM conversations
+            WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
+        """
+        after_query = f"SELECT COUNT(*) FROM conversations WHERE {DATE_RANGE_FILTER}"
+        
+        before_plan = self.explain_query(
+            before_query,
+            {"start_date": to_local_date(start_date), "end_date": to_local_date(end_date)}
+        )
+        after_plan = self.explain_query(after_query, date_range_params(start_date, end_date))
+        
+        return {
+            'before': before_plan,
+            'after': after_plan,
+            'before_full_scan': self._plan_has_full_scan(before_plan),
+            'after_full_scan': self._plan_has_full_scan(after_plan)
+        }
+    
+    @staticmethod
+    def _plan_has_full_scan(plan: pd.DataFrame) -> bool:
+        """ตรวจว่า plan มีการ scan ทั้งตาราง (TiDB: TableFullScan, MySQL: type = ALL)"""
+        for _, row in plan.iterrows():
+            values = [str(v) for v in row.values]
+            if any('TableFullScan' in v for v in values):
+                return True
+            if str(row.get('type', '')).upper() == 'ALL':
+                return True
+        return False
+    
     def insert_conversation(self, conversation_data: Dict[str, Any]) -> int:
         """เพิ่มข้อมูลการสนทนาใหม่"""
         try:
@@ -208,12 +488,87 @@ class DatabaseManager:
                     "response_time": conversation_data.get('response_time'),
                     "metadata": json.dumps(conversation_data.get('metadata', {}))
                 })
+                self._apply_insert_rollup(conn, [result.lastrowid])
                 conn.commit()
                 return result.lastrowid
         except Exception as e:
             print(f"Error inserting conversation: {str(e)}")
             raise
     
+    def insert_conversations_bulk(self, conversations: Iterable[Dict[str, Any]],
+                                  batch_size: int = BULK_INSERT_BATCH_SIZE) -> List[int]:
+        """
+        เพิ่มข้อมูลการสนทนาหลายรายการ
+        ใช้ INSERT หลายแถวต่อคำสั่ง และหนึ่ง transaction ต่อ batch (รวมการอัปเดต daily_metrics)
+        คืนค่า id ตามลำดับของข้อมูลที่ส่งเข้ามา
+        """
+        columns = ['conversation_id', 'user_id', 'message', 'message_type',
+                   'sender_type', 'response_time', 'metadata', 'insert_batch']
+        inserted_ids = []
+        iterator = iter(conversations)
+        
+        try:
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    break
+                
+                batch_token = uuid.uuid4().hex
+                params = {}
+                value_rows = []
+                for i, conversation_data in enumerate(batch):
+                    params.update({
+                        f"conversation_id_{i}": conversation_data.get('conversation_id'),
+                        f"user_id_{i}": conversation_data.get('user_id'),
+                        f"message_{i}": conversation_data.get('message'),
+                        f"message_type_{i}": conversation_data.get('message_type', 'text'),
+                        f"sender_type_{i}": conversation_data.get('sender_type'),
+                        f"response_time_{i}": conversation_data.get('response_time'),
+                        f"metadata_{i}": json.dumps(conversation_data.get('metadata', {})),
+                        f"insert_batch_{i}": f"{batch_token}:{i}"
+                    })
+                    value_rows.append("(" + ", ".join(f":{column}_{i}" for column in columns) + ")")
+                
+                with self.engine.connect() as conn:
+                    result = conn.execute(text(f"""
+                        INSERT INTO conversations 
+                        ({", ".join(columns)})
+                        VALUES {", ".join(value_rows)}
+                    """), params)
+                    
+                    # อ่าน id กลับด้วยช่วง primary key ตั้งแต่ LAST_INSERT_ID() (id แรกของคำสั่ง)
+                    # AUTO_INCREMENT ของ TiDB อาจไม่เรียงต่อกันและอาจสลับกับ insert อื่น จึงกรองด้วย insert_batch
+                    # แล้วหยุดเมื่อครบจำนวนแถว ไม่ต้องมี index บน insert_batch
+                    id_by_row = {
+                        int(row.insert_batch.rsplit(':', 1)[1]): row.id
+                        for row in conn.execute(text("""
+                            SELECT id, insert_batch FROM conversations 
+                            WHERE id >= :first_id AND insert_batch LIKE :prefix
+                            ORDER BY id
+                            LIMIT :limit
+                        """), {"first_id": result.lastrowid, "prefix": f"{batch_token}:%", "limit": len(batch)})
+                    }
+                    if len(id_by_row) != len(batch):
+                        raise RuntimeError(
+                            f"อ่าน id กลับได้ {len(id_by_row)} จาก {len(batch)} แถว (insert_batch {batch_token})"
+                        )
+                    batch_ids = [id_by_row[i] for i in range(len(batch))]
+                    
+                    # ล้าง insert_batch ก่อน commit ผู้อื่นจึงไม่เคยเห็นค่านี้
+                    conn.execute(text("""
+                        UPDATE conversations SET insert_batch = NULL WHERE id IN :ids
+                    """).bindparams(bindparam("ids", expanding=True)), {"ids": batch_ids})
+                    
+                    self._apply_insert_rollup(conn, batch_ids)
+                    conn.commit()
+                
+                inserted_ids.extend(batch_ids)
+            
+            return inserted_ids
+        except Exception as e:
+            print(f"Error bulk inserting conversations: {str(e)}")
+            raise
+    
     def get_total_conversations(self) -> int:
         """ดึงจำนวนการสนทนาทั้งหมด"""
         try:
@@ -230,95 +585,148 @@ class DatabaseManager:
     def get_today_conversations(self) -> int:
         """ดึงจำนวนการสนทนาวันนี้"""
         try:
+            today = datetime.now(LOCAL_TZ)
             with self.engine.connect() as conn:
-                result = conn.execute(text("""
+                result = conn.execute(text(f"""
                     SELECT COUNT(DISTINCT conversation_id) as total 
                     FROM conversations 
-                    WHERE DATE(timestamp) = CURDATE()
-                """))
+                    WHERE {DATE_RANGE_FILTER}
+                """), date_range_params(today, today))
                 return result.scalar() or 0
         except Exception as e:
             print(f"Error getting today conversations: {str(e)}")
             return 0
     
     def get_analytics_data(self, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
-        """ดึงข้อมูลสำหรับ analytics dashboard"""
+        """
+        ดึงข้อมูลสำหรับ analytics dashboard จาก rollup daily_metrics (รวมรายการที่รอ compact)
+        อ่านช่วงที่เลือกและช่วงก่อนหน้าที่ยาวเท่ากันใน query เดียว
+        """
         try:
+            params = day_range_params(start_date, end_date)
+            num_days = (params["end_day"] - params["start_day"]).days + 1
+            params["prev_start_day"] = params["start_day"] - timedelta(days=num_days)
+            
             with self.engine.connect() as conn:
-                # Total conversations
-                total_conv = conn.execute(text("""
-                    SELECT COUNT(DISTINCT conversation_id) as total
-                    FROM conversations 
-                    WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
-                """), {"start_date": start_date, "end_date": end_date}).scalar() or 0
-                
-                # Total messages
-                total_msg = conn.execute(text("""
-                    SELECT COUNT(*) as total
-                    FROM conversations 
-                    WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
-                """), {"start_date": start_date, "end_date": end_date}).scalar() or 0
-                
-                # Unique customers
-                unique_customers = conn.execute(text("""
-                    SELECT COUNT(DISTINCT user_id) as total
-                    FROM conversations 
-                    WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
-                """), {"start_date": start_date, "end_date": end_date}).scalar() or 0
-                
-                # Average response time
-                avg_response = conn.execute(text("""
-                    SELECT AVG(response_time)/60 as avg_minutes
-                    FROM conversations 
-                    WHERE response_time IS NOT NULL 
-                    AND DATE(timestamp) BETWEEN :start_date AND :end_date
-                """), {"start_date": start_date, "end_date": end_date}).scalar() or 0
-                
-                return {
-                    'total_conversations': total_conv,
-                    'total_messages': total_msg,
-                    'unique_customers': unique_customers,
-                    'avg_response_time': avg_response,
-                    'conversation_change': 0,  # TODO: Calculate change from previous period
-                    'message_change': 0,
-                    'customer_change': 0
-                }
+                rows = conn.execute(text("""
+                    SELECT 
+                        metric_date,
+                        message_count,
+                        response_time_sum,
+                        response_time_count,
+                        user_sketch,
+                        conversation_sketch
+                    FROM daily_metrics 
+                    WHERE metric_date BETWEEN :prev_start_day AND :end_day
+                """), params).fetchall()
+                rows += self._queued_sketch_rows(conn, params["prev_start_day"], params["end_day"])
+            
+            current = self._summarize_metrics([r for r in rows if r.metric_date >= params["start_day"]])
+            previous = self._summarize_metrics([r for r in rows if r.metric_date < params["start_day"]])
+            
+            return {
+                'total_conversations': current['conversations'],
+                'total_messages': current['messages'],
+                'unique_customers': current['customers'],
+                'avg_response_time': current['avg_response_time'],
+                # เทียบกับช่วงก่อนหน้าที่ยาวเท่ากัน
+                'conversation_change': current['conversations'] - previous['conversations'],
+                'message_change': current['messages'] - previous['messages'],
+                'customer_change': current['customers'] - previous['customers'],
+                'response_time_change': current['avg_response_time'] - previous['avg_response_time']
+            }
         except Exception as e:
             print(f"Error getting analytics data: {str(e)}")
             return {}
     
+    def _queued_sketch_rows(self, conn, start_day: date, end_day: date) -> List[Any]:
+        """
+        user/conversation ใน daily_sketch_queue ที่ยังไม่ถูก compact ในช่วงวันที่ ในรูปแถวของ daily_metrics
+        (ตัวนับเป็น 0 เพราะนับไปแล้วตอน insert) ใช้รวมกับ sketch ตอนอ่าน KPI จึงเห็นข้อความใหม่ทันที
+        แม้ไม่มี process ใดเรียก compact_daily_sketches
+        """
+        sketches = {}
+        rows = conn.execute(text("""
+            SELECT DISTINCT metric_date, user_id, conversation_id
+            FROM daily_sketch_queue 
+            WHERE metric_date BETWEEN :start_day AND :end_day
+        """), {"start_day": start_day, "end_day": end_day})
+        for row in rows:
+            user_sketch, conversation_sketch = sketches.setdefault(row.metric_date, (HyperLogLog(), HyperLogLog()))
+            user_sketch.add(row.user_id)
+            conversation_sketch.add(row.conversation_id)
+        
+        return [
+            SimpleNamespace(
+                metric_date=metric_date,
+                message_count=0,
+                response_time_sum=0,
+                response_time_count=0,
+                user_sketch=user_sketch.to_bytes(),
+                conversation_sketch=conversation_sketch.to_bytes()
+            )
+            for metric_date, (user_sketch, conversation_sketch) in sketches.items()
+        ]
+    
+    @staticmethod
+    def _summarize_metrics(rows: List[Any]) -> Dict[str, Any]:
+        """รวมแถวของ daily_metrics เป็น KPI (จำนวนไม่ซ้ำได้จากการ merge sketch)"""
+        response_time_sum = sum(int(r.response_time_sum) for r in rows)
+        response_time_count = sum(int(r.response_time_count) for r in rows)
+        
+        return {
+            'conversations': HyperLogLog.union_count(r.conversation_sketch for r in rows),
+            'messages': sum(int(r.message_count) for r in rows),
+            'customers': HyperLogLog.union_count(r.user_sketch for r in rows),
+            'avg_response_time': (response_time_sum / response_time_count / 60) if response_time_count else 0.0
+        }
+    
     def get_daily_conversation_data(self, start_date: datetime, end_date: datetime) -> pd.DataFrame:
-        """ดึงข้อมูลการสนทนารายวัน"""
+        """ดึงข้อมูลการสนทนารายวัน (จาก rollup daily_metrics รวมรายการที่รอ compact)"""
         try:
+            params = day_range_params(start_date, end_date)
             with self.engine.connect() as conn:
-                df = pd.read_sql(text("""
+                rows = conn.execute(text(f"""
                     SELECT 
-                        DATE(timestamp) as date,
-                        COUNT(DISTINCT conversation_id) as conversations,
-                        COUNT(*) as messages
-                    FROM conversations 
-                    WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
-                    GROUP BY DATE(timestamp)
-                    ORDER BY date
-                """), conn, params={"start_date": start_date, "end_date": end_date})
-                return df
+                        metric_date,
+                        message_count,
+                        conversation_sketch
+                    FROM daily_metrics 
+                    WHERE {DAY_RANGE_FILTER}
+                    ORDER BY metric_date
+                """), params).fetchall()
+                rows += self._queued_sketch_rows(conn, params["start_day"], params["end_day"])
+            
+            rows_by_day = {}
+            for row in sorted(rows, key=lambda r: r.metric_date):
+                rows_by_day.setdefault(row.metric_date, []).append(row)
+            
+            return pd.DataFrame([
+                {
+                    'date': day,
+                    'conversations': HyperLogLog.union_count(r.conversation_sketch for r in day_rows),
+                    'messages': sum(int(r.message_count) for r in day_rows)
+                }
+                for day, day_rows in rows_by_day.items()
+            ])
         except Exception as e:
             print(f"Error getting daily conversation data: {str(e)}")
             return pd.DataFrame()
     
     def get_message_type_distribution(self, start_date: datetime, end_date: datetime) -> pd.DataFrame:
-        """ดึงข้อมูลการกระจายประเภทข้อความ"""
+        """ดึงข้อมูลการกระจายประเภทข้อความ (จาก rollup daily_metrics)"""
         try:
             with self.engine.connect() as conn:
-                df = pd.read_sql(text("""
+                df = pd.read_sql(text(f"""
                     SELECT 
                         message_type,
-                        COUNT(*) as count
-                    FROM conversations 
-                    WHERE DATE(timestamp) BETWEEN :start_date AND :end_date
+                        SUM(message_count) as count
+                    FROM daily_metrics 
+                    WHERE {DAY_RANGE_FILTER}
                     GROUP BY message_type
+                    HAVING SUM(message_count) > 0
                     ORDER BY count DESC
-                """), conn, params={"start_date": start_date, "end_date": end_date})
+                """), conn, params=day_range_params(start_date, end_date))
                 return df
         except Exception as e:
             print(f"Error getting message type distribution: {str(e)}")
@@ -368,8 +776,8 @@ class DatabaseManager:
                 params["customer_id"] = customer_id
             
             if date:
-                query += " AND DATE(timestamp) = :date"
-                params["date"] = date.date()
+                query += f" AND {DATE_RANGE_FILTER}"
+                params.update(date_range_params(date, date))
             
             query += " ORDER BY timestamp DESC LIMIT :limit"
             params["limit"] = limit
@@ -403,6 +811,57 @@ class DatabaseManager:
             print(f"Error getting conversation context: {str(e)}")
             return []
     
+    def get_embeddings_since(self, since: Optional[datetime], since_id: int = 0,
+                             limit: int = 5000) -> List[Any]:
+        """
+        ดึง embedding ของข้อความลูกค้าที่ประมวลผลหลังตำแหน่ง (since, since_id)
+        เรียงตาม (processed_at, id) เพื่อให้อ่านต่อเป็นช่วง ๆ ได้ (keyset pagination)
+        """
+        try:
+            with self.engine.connect() as conn:
+                return conn.execute(text("""
+                    SELECT id, embedding_blob, processed_at
+                    FROM conversations 
+                    WHERE embedding_blob IS NOT NULL
+                    AND sender_type = 'customer'
+                    AND (processed_at > :since OR (processed_at = :since AND id > :since_id))
+                    ORDER BY processed_at, id
+                    LIMIT :limit
+                """), {
+                    # TIMESTAMP ของ MySQL/TiDB เริ่มที่ปี 1970
+                    "since": since or datetime(1970, 1, 2),
+                    "since_id": since_id,
+                    "limit": limit
+                }).fetchall()
+        except Exception as e:
+            print(f"Error getting embeddings: {str(e)}")
+            return []
+    
+    def get_conversations_by_ids(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """ดึงข้อความตาม id คืนค่าเป็น dict {id: ข้อมูลข้อความ}"""
+        if not ids:
+            return {}
+        
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execute(text("""
+                    SELECT 
+                        id,
+                        conversation_id,
+                        user_id,
+                        message,
+                        sender_type,
+                        timestamp,
+                        sentiment
+                    FROM conversations 
+                    WHERE id IN :ids
+                """).bindparams(bindparam("ids", expanding=True)), {"ids": list(ids)})
+                
+                return {row.id: dict(row._mapping) for row in result}
+        except Exception as e:
+            print(f"Error getting conversations by ids: {str(e)}")
+            return {}
+    
     def get_settings(self) -> Dict[str, Any]:
         """ดึงการตั้งค่าระบบ"""
         try:
@@ -463,9 +922,20 @@ class DatabaseManager:
     def update_conversation_sentiment(self, conversation_id: int, 
                                    sentiment: str, 
                                    sentiment_score: float) -> bool:
-        """อัปเดตความรู้สึกของการสนทนา"""
+        """อัปเดตความรู้สึกของการสนทนา (และผลรวม sentiment ใน daily_metrics)"""
         try:
             with self.engine.connect() as conn:
+                previous = conn.execute(text("""
+                    SELECT 
+                        DATE(timestamp) as metric_date,
+                        message_type,
+                        sender_type,
+                        sentiment_score
+                    FROM conversations 
+                    WHERE id = :conversation_id
+                    FOR UPDATE
+                """), {"conversation_id": conversation_id}).fetchone()
+                
                 conn.execute(text("""
                     UPDATE conversations 
                     SET sentiment = :sentiment,
@@ -477,6 +947,9 @@ class DatabaseManager:
                     "sentiment": sentiment,
                     "sentiment_score": sentiment_score
                 })
+                
+                if previous:
+                    self._apply_sentiment_rollup(conn, [(previous, sentiment_score)])
                 conn.commit()
                 return True
         except Exception as e:
@@ -485,17 +958,18 @@ class DatabaseManager:
     
     def update_conversation_embedding(self, conversation_id: int, 
                                     embedding_vector: List[float]) -> bool:
-        """อัปเดต embedding vector ของการสนทนา"""
+        """อัปเดต embedding vector ของการสนทนา (เก็บแบบ binary)"""
         try:
             with self.engine.connect() as conn:
                 conn.execute(text("""
                     UPDATE conversations 
-                    SET embedding_vector = :embedding_vector,
+                    SET embedding_blob = :embedding_blob,
+                        embedding_vector = NULL,
                         processed_at = CURRENT_TIMESTAMP
                     WHERE id = :conversation_id
                 """), {
                     "conversation_id": conversation_id,
-                    "embedding_vector": json.dumps(embedding_vector)
+                    "embedding_blob": encode_vector(embedding_vector)
                 })
                 conn.commit()
                 return True
@@ -503,6 +977,503 @@ class DatabaseManager:
             print(f"Error updating embedding: {str(e)}")
             return False
     
+    def claim_unprocessed_messages(self, claim_token: str, limit: int,
+                                   lease_seconds: int) -> List[Dict[str, Any]]:
+        """
+        จองข้อความลูกค้าที่ยังไม่ได้ประมวลผลให้ claim_token เป็นเวลา lease_seconds วินาที (ข้อความใหม่ก่อน)
+        ข้อความที่ผู้อื่นจองไว้และยังไม่หมดเวลาจะถูกข้าม worker หลายตัวบนหลายเครื่องจึงไม่ได้ข้อความซ้ำกัน
+        ถ้า worker หยุดกลางทาง ข้อความจะถูกจองใหม่ได้เมื่อหมดเวลา
+        คืนค่ารายการ dict ที่มี id และ message
+        """
+        try:
+            with self.engine.connect() as conn:
+                # UPDATE อ่านค่าล่าสุดของแถวที่ถูก lock จึงไม่ทับการจองที่เพิ่ง commit โดย worker อื่น
+                conn.execute(text("""
+                    UPDATE conversations
+                    SET claimed_by = :claim_token,
+                        claimed_until = CURRENT_TIMESTAMP + INTERVAL :lease_seconds SECOND
+                    WHERE processed_at IS NULL
+                    AND sender_type = 'customer'
+                    AND (claimed_until IS NULL OR claimed_until < CURRENT_TIMESTAMP)
+                    ORDER BY id DESC
+                    LIMIT :limit
+                """), {"claim_token": claim_token, "lease_seconds": int(lease_seconds), "limit": limit})
+                conn.commit()
+                
+                result = conn.execute(text("""
+                    SELECT id, message
+                    FROM conversations
+                    WHERE claimed_by = :claim_token
+                    AND processed_at IS NULL
+                    ORDER BY id DESC
+                """), {"claim_token": claim_token})
+                return [dict(row._mapping) for row in result]
+        except Exception as e:
+            print(f"Error claiming unprocessed messages: {str(e)}")
+            return []
+    
+    def release_message_claims(self, claim_token: str) -> int:
+        """ยกเลิกการจองทั้งหมดของ claim_token (ข้อความที่ยังไม่ได้ประมวลผลจะถูกจองใหม่ได้ทันที)"""
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execute(text("""
+                    UPDATE conversations
+                    SET claimed_by = NULL, claimed_until = NULL
+                    WHERE claimed_by = :claim_token
+                """), {"claim_token": claim_token})
+                conn.commit()
+                return result.rowcount
+        except Exception as e:
+            print(f"Error releasing message claims: {str(e)}")
+            return 0
+    
+    def update_conversation_results_bulk(self, results: List[Dict[str, Any]],
+                                         claim_token: Optional[str] = None) -> int:
+        """
+        เขียนผลการประมวลผลหลายข้อความกลับในหนึ่ง transaction
+        results: รายการ dict ที่มี 'id' และอาจมี 'sentiment' + 'sentiment_score' และ/หรือ 'embedding'
+        ใช้ UPDATE ... CASE id หนึ่งคำสั่งต่อคอลัมน์ แทนการ UPDATE ทีละแถว
+        ถ้าส่ง claim_token มา จะเขียนเฉพาะข้อความที่ยังถูกจองโดย token นี้
+        (การจองที่หมดเวลาและถูก worker อื่นจองไปแล้วจะไม่ถูกเขียนทับ)
+        คืนค่าจำนวนข้อความที่อัปเดต
+        """
+        if not results:
+            return 0
+        
+        try:
+            with self.engine.connect() as conn:
+                if claim_token is not None:
+                    owned_ids = set(conn.execute(text("""
+                        SELECT id FROM conversations
+                        WHERE id IN :ids AND claimed_by = :claim_token
+                        FOR UPDATE
+                    """).bindparams(bindparam("ids", expanding=True)),
+                        {"ids": [r['id'] for r in results], "claim_token": claim_token}).scalars())
+                    results = [r for r in results if r['id'] in owned_ids]
+                
+                sentiment_results = [r for r in results if r.get('sentiment') is not None]
+                embedding_results = [r for r in results if r.get('embedding')]
+                
+                if sentiment_results:
+                    ids = [r['id'] for r in sentiment_results]
+                    previous_rows = conn.execute(text("""
+                        SELECT 
+                            id,
+                            DATE(timestamp) as metric_date,
+                            message_type,
+                            sender_type,
+                            sentiment_score
+                        FROM conversations 
+                        WHERE id IN :ids
+                        FOR UPDATE
+                    """).bindparams(bindparam("ids", expanding=True)), {"ids": ids}).fetchall()
+                    
+                    params = {}
+                    sentiment_cases = []
+                    score_cases = []
+                    for i, r in enumerate(sentiment_results):
+                        params.update({
+                            f"id_{i}": r['id'],
+                            f"sentiment_{i}": r['sentiment'],
+                            f"sentiment_score_{i}": r['sentiment_score']
+                        })
+                        sentiment_cases.append(f"WHEN :id_{i} THEN :sentiment_{i}")
+                        score_cases.append(f"WHEN :id_{i} THEN :sentiment_score_{i}")
+                    
+                    conn.execute(text(f"""
+                        UPDATE conversations 
+                        SET sentiment = CASE id {" ".join(sentiment_cases)} ELSE sentiment END,
+                            sentiment_score = CASE id {" ".join(score_cases)} ELSE sentiment_score END,
+                            processed_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({", ".join(f":id_{i}" for i in range(len(sentiment_results)))})
+                    """), params)
+                    
+                    new_scores = {r['id']: r['sentiment_score'] for r in sentiment_results}
+                    self._apply_sentiment_rollup(
+                        conn, [(row, new_scores[row.id]) for row in previous_rows]
+                    )
+                
+                if embedding_results:
+                    params = {}
+                    embedding_cases = []
+                    for i, r in enumerate(embedding_results):
+                        params.update({
+                            f"id_{i}": r['id'],
+                            f"embedding_{i}": encode_vector(r['embedding'])
+                        })
+                        embedding_cases.append(f"WHEN :id_{i} THEN :embedding_{i}")
+                    
+                    conn.execute(text(f"""
+                        UPDATE conversations 
+                        SET embedding_blob = CASE id {" ".join(embedding_cases)} ELSE embedding_blob END,
+                            embedding_vector = NULL,
+                            processed_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({", ".join(f":id_{i}" for i in range(len(embedding_results)))})
+                    """), params)
+                
+                conn.commit()
+                return len({r['id'] for r in sentiment_results + embedding_results})
+        except Exception as e:
+            print(f"Error bulk updating conversation results: {str(e)}")
+            return 0
+    
+    def migrate_json_embeddings(self, batch_size: int = 500) -> Dict[str, Dict[str, int]]:
+        """
+        แปลง embedding ที่เก็บเป็น JSON แบบเดิมใน conversations และ topics เป็น embedding_blob
+        แล้วล้างคอลัมน์ JSON เพื่อคืนพื้นที่ รันซ้ำได้ (แปลงเฉพาะแถวที่ยังไม่มี blob)
+        แถวที่แปลงไม่ได้จะไม่ถูกแก้ไข (JSON เดิมยังอยู่) และนับแยกเป็น failed
+        คืนค่า {table: {'migrated': จำนวนที่แปลง, 'failed': จำนวนที่แปลงไม่ได้}}
+        """
+        migrated = {}
+        
+        for table in ('conversations', 'topics'):
+            migrated[table] = {'migrated': 0, 'failed': 0}
+            last_id = 0
+            while True:
+                with self.engine.connect() as conn:
+                    # ไล่ตาม id เพราะแถวที่แปลงไม่ได้ยังตรงเงื่อนไขเดิม
+                    rows = conn.execute(text(f"""
+                        SELECT id, embedding_vector
+                        FROM {table}
+                        WHERE embedding_vector IS NOT NULL
+                        AND embedding_blob IS NULL
+                        AND id > :last_id
+                        ORDER BY id
+                        LIMIT :limit
+                    """), {"last_id": last_id, "limit": batch_size}).fetchall()
+                    
+                    if not rows:
+                        break
+                    last_id = rows[-1].id
+                    
+                    params = {}
+                    blob_cases = []
+                    failed_ids = []
+                    for row in rows:
+                        try:
+                            blob = json_to_blob(row.embedding_vector)
+                        except (json.JSONDecodeError, TypeError, ValueError):
+                            blob = None
+                        if blob is None:
+                            failed_ids.append(row.id)
+                            continue
+                        i = len(blob_cases)
+                        params.update({f"id_{i}": row.id, f"blob_{i}": blob})
+                        blob_cases.append(f"WHEN :id_{i} THEN :blob_{i}")
+                    
+                    if blob_cases:
+                        conn.execute(text(f"""
+                            UPDATE {table}
+                            SET embedding_blob = CASE id {" ".join(blob_cases)} END,
+                                embedding_vector = NULL
+                            WHERE id IN ({", ".join(f":id_{i}" for i in range(len(blob_cases)))})
+                        """), params)
+                        conn.commit()
+                
+                migrated[table]['migrated'] += len(blob_cases)
+                migrated[table]['failed'] += len(failed_ids)
+                if failed_ids:
+                    print(f"⚠️ แปลง embedding ใน {table} ไม่ได้ {len(failed_ids)} แถว (เก็บ JSON เดิมไว้) "
+                          f"เช่น id {failed_ids[0]}")
+                print(f"⏳ แปลง embedding ใน {table} แล้ว {migrated[table]['migrated']} แถว")
+        
+        return migrated
+    
+    def _apply_insert_rollup(self, conn, message_ids: List[int]):
+        """
+        เพิ่มข้อความที่เพิ่ง insert เข้า daily_metrics (ภายใน transaction เดียวกับการ insert)
+        ตัวนับบวกเพิ่มด้วย upsert คำสั่งเดียว ไม่อ่านแถวก่อน (ไม่ล็อกแถวข้ามการทำงานฝั่ง Python)
+        user/conversation ถูกเพิ่มเข้า daily_sketch_queue แล้ว merge เข้า sketch ภายหลังด้วย compact_daily_sketches
+        """
+        if not message_ids:
+            return
+        
+        params = {"ids": list(message_ids)}
+        conn.execute(text("""
+            INSERT INTO daily_metrics 
+            (metric_date, message_type, sender_type, message_count, response_time_sum, response_time_count)
+            SELECT 
+                DATE(timestamp),
+                message_type,
+                sender_type,
+                COUNT(*),
+                COALESCE(SUM(response_time), 0),
+                COUNT(response_time)
+            FROM conversations 
+            WHERE id IN :ids
+            GROUP BY DATE(timestamp), message_type, sender_type
+            ON DUPLICATE KEY UPDATE
+                message_count = message_count + VALUES(message_count),
+                response_time_sum = response_time_sum + VALUES(response_time_sum),
+                response_time_count = response_time_count + VALUES(response_time_count)
+        """).bindparams(bindparam("ids", expanding=True)), params)
+        
+        conn.execute(text("""
+            INSERT INTO daily_sketch_queue (metric_date, message_type, sender_type, user_id, conversation_id)
+            SELECT DISTINCT DATE(timestamp), message_type, sender_type, user_id, conversation_id
+            FROM conversations 
+            WHERE id IN :ids
+        """).bindparams(bindparam("ids", expanding=True)), params)
+    
+    def _acquire_metrics_lock(self, conn, timeout: float) -> bool:
+        """
+        ขอ lock ของ daily_metrics (GET_LOCK ระดับ session) แล้ว commit ทันที
+        transaction ถัดไปของ connection นี้จึงเริ่มหลังได้ lock และเห็นผลของผู้ถือ lock ก่อนหน้าทั้งหมด
+        """
+        acquired = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                {"name": DAILY_METRICS_LOCK, "timeout": timeout}).scalar()
+        conn.commit()
+        return bool(acquired)
+    
+    def _release_metrics_lock(self, conn):
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": DAILY_METRICS_LOCK})
+        conn.commit()
+    
+    def compact_daily_sketches(self, batch_size: int = SKETCH_COMPACTION_BATCH_SIZE) -> int:
+        """
+        merge รายการใน daily_sketch_queue เข้า user_sketch/conversation_sketch ของ daily_metrics
+        แล้วลบรายการที่ merge แล้ว (หนึ่ง transaction ต่อ batch) คืนค่าจำนวนรายการที่ merge
+        ข้ามรอบนี้ (คืนค่า 0) ถ้า rebuild_daily_metrics กำลังทำงาน
+        การ merge ซ้ำให้ผลเท่าเดิม (HyperLogLog) รายการที่ค้างจาก batch ที่ล้มเหลวจึงลองใหม่ได้
+        """
+        compacted = 0
+        try:
+            with self.engine.connect() as conn:
+                if not self._acquire_metrics_lock(conn, 0):
+                    return 0
+                
+                try:
+                    while True:
+                        rows = conn.execute(text("""
+                            SELECT id, metric_date, message_type, sender_type, user_id, conversation_id
+                            FROM daily_sketch_queue 
+                            ORDER BY id
+                            LIMIT :limit
+                        """), {"limit": batch_size}).fetchall()
+                        
+                        if not rows:
+                            conn.commit()
+                            break
+                        
+                        groups = {}
+                        for row in rows:
+                            users, conversations = groups.setdefault(
+                                (row.metric_date, row.message_type, row.sender_type), (set(), set())
+                            )
+                            users.add(row.user_id)
+                            conversations.add(row.conversation_id)
+                        
+                        # ล็อกแถวตามลำดับ key เดียวกันทุกครั้ง
+                        for (metric_date, message_type, sender_type), (users, conversations) in sorted(groups.items()):
+                            key_params = {
+                                "metric_date": metric_date,
+                                "message_type": message_type,
+                                "sender_type": sender_type
+                            }
+                            
+                            conn.execute(text("""
+                                INSERT IGNORE INTO daily_metrics (metric_date, message_type, sender_type)
+                                VALUES (:metric_date, :message_type, :sender_type)
+                            """), key_params)
+                            
+                            existing = conn.execute(text("""
+                                SELECT user_sketch, conversation_sketch
+                                FROM daily_metrics 
+                                WHERE metric_date = :metric_date 
+                                AND message_type = :message_type 
+                                AND sender_type = :sender_type
+                                FOR UPDATE
+                            """), key_params).fetchone()
+                            
+                            user_sketch = HyperLogLog.from_bytes(existing.user_sketch)
+                            user_sketch.update(users)
+                            conversation_sketch = HyperLogLog.from_bytes(existing.conversation_sketch)
+                            conversation_sketch.update(conversations)
+                            
+                            conn.execute(text("""
+                                UPDATE daily_metrics 
+                                SET user_sketch = :user_sketch,
+                                    conversation_sketch = :conversation_sketch
+                                WHERE metric_date = :metric_date 
+                                AND message_type = :message_type 
+                                AND sender_type = :sender_type
+                            """), {
+                                **key_params,
+                                "user_sketch": user_sketch.to_bytes(),
+                                "conversation_sketch": conversation_sketch.to_bytes()
+                            })
+                        
+                        conn.execute(text("""
+                            DELETE FROM daily_sketch_queue WHERE id IN :ids
+                        """).bindparams(bindparam("ids", expanding=True)), {"ids": [row.id for row in rows]})
+                        conn.commit()
+                        
+                        compacted += len(rows)
+                        if len(rows) < batch_size:
+                            break
+                finally:
+                    self._release_metrics_lock(conn)
+            
+            return compacted
+        except Exception as e:
+            print(f"Error compacting daily sketches: {str(e)}")
+            return compacted
+    
+    def _apply_sentiment_rollup(self, conn, changes: List[Any]):
+        """
+        ปรับผลรวม sentiment ใน daily_metrics
+        changes: รายการ (แถวเดิมที่มี metric_date/message_type/sender_type/sentiment_score, คะแนนใหม่)
+        """
+        deltas = {}
+        for previous, new_score in changes:
+            key = (previous.metric_date, previous.message_type, previous.sender_type)
+            delta = deltas.setdefault(key, {'score_delta': 0.0, 'count_delta': 0})
+            
+            # sentiment_score ในตาราง conversations เก็บทศนิยม 2 ตำแหน่ง
+            delta['score_delta'] += round(float(new_score), 2) - float(previous.sentiment_score or 0)
+            if previous.sentiment_score is None:
+                delta['count_delta'] += 1
+        
+        for (metric_date, message_type, sender_type), delta in deltas.items():
+            conn.execute(text("""
+                UPDATE daily_metrics 
+                SET sentiment_score_sum = sentiment_score_sum + :score_delta,
+                    sentiment_count = sentiment_count + :count_delta
+                WHERE metric_date = :metric_date 
+                AND message_type = :message_type 
+                AND sender_type = :sender_type
+            """), {
+                "metric_date": metric_date,
+                "message_type": message_type,
+                "sender_type": sender_type,
+                "score_delta": round(delta['score_delta'], 2),
+                "count_delta": delta['count_delta']
+            })
+    
+    def rebuild_daily_metrics(self, start_date: Optional[Any] = None,
+                              end_date: Optional[Any] = None) -> int:
+        """
+        สร้าง daily_metrics ใหม่จากประวัติใน conversations ทีละวัน (backfill)
+        ถ้าไม่ระบุช่วงวันที่ จะใช้ตั้งแต่ข้อความแรกถึงข้อความล่าสุด
+        คืนค่าจำนวนวันที่สร้างใหม่
+        
+        ทำงานพร้อมกับการ insert ได้:
+        - ถือ lock เดียวกับ compact_daily_sketches ตลอดการ rebuild (sketch ไม่ถูก merge ระหว่างนั้น)
+        - แต่ละวันล็อกแถวของวันนั้นก่อน (insert ของวันนั้นรอจน commit) แล้วคำนวณตัวนับใหม่
+          ด้วย INSERT ... SELECT คำสั่งเดียว ข้อความที่ commit ก่อนถูกนับใน rebuild
+          ข้อความที่ยังไม่ commit บวกเพิ่มเองหลัง rebuild จึงไม่ถูกนับซ้ำหรือหายไป
+        - รายการของวันนั้นใน daily_sketch_queue ถูกลบใน transaction เดียวกัน เพราะ sketch สร้างใหม่จาก
+          conversations แล้ว (รายการของข้อความที่ถูกลบไปจะไม่ถูก merge กลับ) ข้อความที่ insert
+          หลังล็อกแถวของวันนั้นเพิ่มรายการใหม่เข้าคิวหลัง rebuild commit
+        """
+        if start_date is None or end_date is None:
+            with self.engine.connect() as conn:
+                bounds = conn.execute(text("""
+                    SELECT MIN(timestamp) as first_ts, MAX(timestamp) as last_ts
+                    FROM conversations
+                """)).fetchone()
+            
+            if not bounds or bounds.first_ts is None:
+                return 0
+            start_date = start_date or bounds.first_ts
+            end_date = end_date or bounds.last_ts
+        
+        day = to_local_date(start_date)
+        last_day = to_local_date(end_date)
+        rebuilt_days = 0
+        
+        with self.engine.connect() as conn:
+            if not self._acquire_metrics_lock(conn, DAILY_METRICS_LOCK_TIMEOUT):
+                raise RuntimeError("daily_metrics กำลังถูก rebuild หรือ compact โดย process อื่น")
+            
+            try:
+                while day <= last_day:
+                    params = {**date_range_params(day, day), "metric_date": day}
+                    
+                    conn.execute(text("""
+                        SELECT metric_date FROM daily_metrics 
+                        WHERE metric_date = :metric_date
+                        FOR UPDATE
+                    """), params)
+                    conn.execute(text("""
+                        DELETE FROM daily_sketch_queue WHERE metric_date = :metric_date
+                    """), params)
+                    conn.execute(text("""
+                        UPDATE daily_metrics 
+                        SET message_count = 0,
+                            response_time_sum = 0,
+                            response_time_count = 0,
+                            sentiment_score_sum = 0,
+                            sentiment_count = 0,
+                            user_sketch = NULL,
+                            conversation_sketch = NULL
+                        WHERE metric_date = :metric_date
+                    """), params)
+                    
+                    # ตัวนับรวมคำนวณฝั่งฐานข้อมูล
+                    conn.execute(text(f"""
+                        INSERT INTO daily_metrics 
+                        (metric_date, message_type, sender_type, message_count,
+                         response_time_sum, response_time_count, sentiment_score_sum, sentiment_count)
+                        SELECT 
+                            :metric_date,
+                            message_type,
+                            sender_type,
+                            COUNT(*),
+                            COALESCE(SUM(response_time), 0),
+                            COUNT(response_time),
+                            COALESCE(SUM(sentiment_score), 0),
+                            COUNT(sentiment_score)
+                        FROM conversations 
+                        WHERE {DATE_RANGE_FILTER}
+                        GROUP BY message_type, sender_type
+                        ON DUPLICATE KEY UPDATE
+                            message_count = VALUES(message_count),
+                            response_time_sum = VALUES(response_time_sum),
+                            response_time_count = VALUES(response_time_count),
+                            sentiment_score_sum = VALUES(sentiment_score_sum),
+                            sentiment_count = VALUES(sentiment_count)
+                    """), params)
+                    
+                    # sketch สร้างจากคู่ค่าที่ไม่ซ้ำของวันนั้น
+                    sketches = {}
+                    rows = conn.execute(text(f"""
+                        SELECT DISTINCT message_type, sender_type, user_id, conversation_id
+                        FROM conversations 
+                        WHERE {DATE_RANGE_FILTER}
+                    """), params)
+                    for row in rows:
+                        user_sketch, conversation_sketch = sketches.setdefault(
+                            (row.message_type, row.sender_type), (HyperLogLog(), HyperLogLog())
+                        )
+                        user_sketch.add(row.user_id)
+                        conversation_sketch.add(row.conversation_id)
+                    
+                    for (message_type, sender_type), (user_sketch, conversation_sketch) in sketches.items():
+                        conn.execute(text("""
+                            UPDATE daily_metrics 
+                            SET user_sketch = :user_sketch,
+                                conversation_sketch = :conversation_sketch
+                            WHERE metric_date = :metric_date 
+                            AND message_type = :message_type 
+                            AND sender_type = :sender_type
+                        """), {
+                            "metric_date": day,
+                            "message_type": message_type,
+                            "sender_type": sender_type,
+                            "user_sketch": user_sketch.to_bytes(),
+                            "conversation_sketch": conversation_sketch.to_bytes()
+                        })
+                    
+                    conn.commit()
+                    rebuilt_days += 1
+                    day += timedelta(days=1)
+            finally:
+                conn.rollback()
+                self._release_metrics_lock(conn)
+        
+        return rebuilt_days
+    
     def cache_analytics_result(self, cache_key: str, data: Dict[str, Any], 
                              expires_hours: int = 1) -> bool:
         """เก็บผลการวิเคราะห์ในแคช"""
@@ -545,6 +1516,49 @@ class DatabaseManager:
             print(f"Error getting cached result: {str(e)}")
             return None
     
+    def cache_embeddings(self, embeddings: Dict[str, bytes], model: str, ttl_seconds: int) -> bool:
+        """เก็บ embedding (binary) ลงแคชตาม cache key"""
+        if not embeddings:
+            return True
+        
+        try:
+            expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+            
+            with self.engine.connect() as conn:
+                conn.execute(text("""
+                    INSERT INTO embedding_cache (cache_key, model, embedding_blob, expires_at)
+                    VALUES (:key, :model, :blob, :expires)
+                    ON DUPLICATE KEY UPDATE
+                    embedding_blob = VALUES(embedding_blob),
+                    expires_at = VALUES(expires_at)
+                """), [
+                    {"key": key, "model": model, "blob": blob, "expires": expires_at}
+                    for key, blob in embeddings.items()
+                ])
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error caching embeddings: {str(e)}")
+            return False
+    
+    def get_cached_embeddings(self, cache_keys: List[str]) -> Dict[str, bytes]:
+        """ดึง embedding ที่ยังไม่หมดอายุจากแคช คืนค่า dict ของ cache key -> binary"""
+        if not cache_keys:
+            return {}
+        
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execute(text("""
+                    SELECT cache_key, embedding_blob
+                    FROM embedding_cache
+                    WHERE cache_key IN :keys AND expires_at > CURRENT_TIMESTAMP
+                """).bindparams(bindparam("keys", expanding=True)), {"keys": list(cache_keys)})
+                
+                return {row.cache_key: row.embedding_blob for row in result}
+        except Exception as e:
+            print(f"Error getting cached embeddings: {str(e)}")
+            return {}
+    
     def cleanup_expired_cache(self):
         """ล้างแคชที่หมดอายุ"""
         try:
@@ -553,6 +1567,10 @@ class DatabaseManager:
                     DELETE FROM analytics_cache 
                     WHERE expires_at < CURRENT_TIMESTAMP
                 """))
+                conn.execute(text("""
+                    DELETE FROM embedding_cache 
+                    WHERE expires_at < CURRENT_TIMESTAMP
+                """))
                 conn.commit()
         except Exception as e:
             print(f"Error cleaning up cache: {str(e)}")
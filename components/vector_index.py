@@ -0,0 +1,558 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from utils.config import IVF_NLIST, IVF_NPROBE, IVF_MIN_TRAIN_SIZE, IVF_TRAIN_SAMPLE_SIZE
+
+try:
+    import fcntl
+except ImportError:  # Windows ไม่มี fcntl - ถือว่ามี process เดียวที่เขียน index
+    fcntl = None
+
+# รูปแบบไฟล์ของ index ที่บันทึกลงดิสก์ (ในโฟลเดอร์เดียวกัน)
+#   header.json   - dim, จำนวนแถว, id ล่าสุด และ metadata (เช่น watermark ของการ sync)
+#   <array>.bin   - ข้อมูลดิบของแต่ละ array (vectors, ids, ...) เปิดด้วย np.memmap
+#   index.lock    - lock ของ process ที่เป็นผู้เขียน (process อื่นเปิดแบบ copy-on-write)
+STORAGE_FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+LOCK_FILE = "index.lock"
+
+def _acquire_writer_lock(directory: str):
+    """ขอ lock ผู้เขียนของโฟลเดอร์ index คืนค่า file object ที่ถือ lock หรือ None ถ้ามี process อื่นถืออยู่"""
+    lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+    if fcntl is None:
+        return lock_file
+
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+class VectorMatrixIndex:
+    """
+    ดัชนี embedding แบบ exact search ในหน่วยความจำ
+    - เก็บ vector ที่ normalize แล้วใน matrix float32 ต่อเนื่อง (cosine similarity = dot product)
+    - ค้นหาด้วย matrix-vector product ครั้งเดียว แล้วเลือก top-k ด้วย argpartition
+    - บันทึกลงดิสก์แบบ memory-mapped ได้ (attach_storage/flush) และเปิดกลับด้วย open() โดยไม่ต้องอ่านทั้งไฟล์
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024):
+        self.dim = dim
+        self.size = 0
+        self.max_id = 0
+        self.vectors = np.empty((initial_capacity, dim or 0), dtype=np.float32)
+        self.ids = np.empty(initial_capacity, dtype=np.int64)
+        self._lock = threading.RLock()
+
+        # สถานะการบันทึกลงดิสก์
+        self.storage_dir: Optional[str] = None
+        self.writable = False
+        self.metadata: Dict[str, Any] = {}
+        self._mapped = False
+        self._lock_file = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """normalize แต่ละแถวให้ยาว 1 (แถวที่เป็นศูนย์คงเป็นศูนย์)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _ensure_capacity(self, required: int):
+        """ขยาย matrix แบบเท่าตัวเมื่อพื้นที่ไม่พอ"""
+        capacity = self.vectors.shape[0]
+        if required <= capacity:
+            return
+
+        new_capacity = max(required, capacity * 2)
+        if self._mapped and self.writable:
+            self._grow_files(new_capacity)
+            return
+
+        # index ที่เปิดแบบอ่านอย่างเดียวจะย้ายข้อมูลมาไว้ในหน่วยความจำเมื่อต้องขยาย
+        self._mapped = False
+        vectors = np.empty((new_capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.vectors = vectors
+        self.ids = ids
+
+    def add(self, ids: List[int], vectors) -> int:
+        """
+        เพิ่ม (หรือแทนที่) vector ตาม id
+        คืนค่าจำนวน vector ที่เพิ่มเข้าไปใหม่
+        """
+        if len(ids) == 0:
+            return 0
+
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = self.normalize(np.atleast_2d(vectors))
+
+        with self._lock:
+            if self.dim is None or self.dim == 0:
+                self.dim = vectors.shape[1]
+                self.vectors = np.empty((self.vectors.shape[0], self.dim), dtype=np.float32)
+            if self.storage_dir and self.writable and not self._mapped:
+                self._create_files()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"ขนาด vector ไม่ตรงกับ index ({vectors.shape[1]} != {self.dim})")
+
+            # id ใหม่ทั้งหมดมากกว่า id ล่าสุด (กรณีปกติ) ไม่ต้องตรวจซ้ำ
+            is_new = np.ones(len(ids), dtype=bool)
+            if self.size and ids.min() <= self.max_id:
+                existing_ids = self.ids[:self.size]
+                found = np.isin(ids, existing_ids)
+                if found.any():
+                    order = np.argsort(existing_ids, kind='stable')
+                    positions = order[np.searchsorted(existing_ids[order], ids[found])]
+                    self.vectors[positions] = vectors[found]
+                    self._rows_updated(positions)
+                    is_new = ~found
+
+            new_ids = ids[is_new]
+            new_vectors = vectors[is_new]
+            count = len(new_ids)
+            if count:
+                self._ensure_capacity(self.size + count)
+                self.vectors[self.size:self.size + count] = new_vectors
+                self.ids[self.size:self.size + count] = new_ids
+                self.size += count
+                self.max_id = max(self.max_id, int(new_ids.max()))
+                self._rows_updated(np.arange(self.size - count, self.size))
+
+            return count
+
+    def _rows_updated(self, positions: np.ndarray):
+        """hook สำหรับ subclass เมื่อแถวใน matrix ถูกเพิ่มหรือแทนที่"""
+        pass
+
+    # ---------- การบันทึกลงดิสก์ (memory-mapped) ----------
+
+    def _array_specs(self) -> Dict[str, Tuple[Any, Tuple[int, ...]]]:
+        """array ที่บันทึกลงดิสก์: ชื่อ -> (dtype, shape ต่อแถว)"""
+        return {
+            'vectors': (np.float32, (self.dim,)),
+            'ids': (np.int64, ()),
+        }
+
+    def _array_path(self, name: str) -> str:
+        return os.path.join(self.storage_dir, f"{name}.bin")
+
+    def _header(self) -> Dict[str, Any]:
+        """ข้อมูลใน header.json (subclass เพิ่มค่าของตัวเองได้)"""
+        return {
+            'format_version': STORAGE_FORMAT_VERSION,
+            'index_type': type(self).__name__,
+            'dim': self.dim,
+            'size': self.size,
+            'max_id': self.max_id,
+            'metadata': self.metadata,
+        }
+
+    def _restore_header(self, header: Dict[str, Any]):
+        """hook สำหรับ subclass เมื่อเปิด index จากดิสก์"""
+        pass
+
+    def _save_extra(self):
+        """hook สำหรับ subclass ที่มีข้อมูลนอกเหนือจาก array หลัก"""
+        pass
+
+    def attach_storage(self, directory: str) -> bool:
+        """
+        ผูก index กับโฟลเดอร์บนดิสก์ (เขียนทับข้อมูลเดิมในโฟลเดอร์)
+        หลังจากนี้ข้อมูลจะถูกเขียนลงไฟล์ memory-mapped โดยตรง และบันทึก header เมื่อเรียก flush()
+        คืนค่า False ถ้ามี process อื่นเป็นผู้เขียนโฟลเดอร์นี้อยู่ (index จะอยู่ในหน่วยความจำอย่างเดียว)
+        """
+        os.makedirs(directory, exist_ok=True)
+        lock_file = _acquire_writer_lock(directory)
+        if lock_file is None:
+            return False
+
+        with self._lock:
+            self.storage_dir = directory
+            self.writable = True
+            self._lock_file = lock_file
+
+            # ลบ header เดิมก่อน เพื่อไม่ให้เปิดไฟล์ที่เขียนไม่ครบได้
+            header_path = os.path.join(directory, HEADER_FILE)
+            if os.path.exists(header_path):
+                os.remove(header_path)
+
+            if self.dim:
+                self._create_files()
+        return True
+
+    def _create_files(self):
+        """สร้างไฟล์ของแต่ละ array จากข้อมูลในหน่วยความจำ แล้วใช้ไฟล์แทน"""
+        capacity = max(1, self.vectors.shape[0])
+        for name, (dtype, row_shape) in self._array_specs().items():
+            current = getattr(self, name)
+            mapped = np.memmap(self._array_path(name), dtype=dtype, mode='w+', shape=(capacity,) + row_shape)
+            mapped[:self.size] = current[:self.size]
+            setattr(self, name, mapped)
+        self._mapped = True
+
+    def _grow_files(self, new_capacity: int):
+        """ขยายไฟล์ (ส่วนที่เพิ่มเป็น sparse ไม่ต้องคัดลอกข้อมูลเดิม) แล้ว map ใหม่"""
+        for name, (dtype, row_shape) in self._array_specs().items():
+            getattr(self, name).flush()
+            setattr(self, name, None)
+
+            path = self._array_path(name)
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+            with open(path, 'r+b') as f:
+                f.truncate(new_capacity * row_bytes)
+            setattr(self, name, np.memmap(path, dtype=dtype, mode='r+', shape=(new_capacity,) + row_shape))
+
+    def flush(self, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        บันทึกข้อมูลลงดิสก์ แล้วเขียน header ใหม่แบบ atomic (header เขียนหลังข้อมูลเสมอ)
+        metadata ที่ส่งมาจะถูกเก็บใน header (ต้องแปลงเป็น JSON ได้)
+        คืนค่า True ถ้าบันทึกสำเร็จ
+        """
+        with self._lock:
+            if metadata:
+                self.metadata.update(metadata)
+            if not (self.storage_dir and self.writable and self._mapped):
+                return False
+
+            for name in self._array_specs():
+                getattr(self, name).flush()
+            self._save_extra()
+
+            header_path = os.path.join(self.storage_dir, HEADER_FILE)
+            tmp_path = header_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._header(), f)
+            os.replace(tmp_path, header_path)
+            return True
+
+    @classmethod
+    def open(cls, directory: str, **kwargs) -> Optional['VectorMatrixIndex']:
+        """
+        เปิด index ที่บันทึกไว้ในโฟลเดอร์ (O(1): map ไฟล์โดยไม่อ่านข้อมูลทั้งหมดเข้าหน่วยความจำ)
+        process แรกที่เปิดเป็นผู้เขียน process อื่นเปิดแบบ copy-on-write (แก้ไขได้แต่ไม่บันทึกลงไฟล์)
+        คืนค่า None ถ้ายังไม่มี index หรือรูปแบบไม่ตรงกับคลาสนี้
+        """
+        try:
+            with open(os.path.join(directory, HEADER_FILE), 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if header.get('format_version') != STORAGE_FORMAT_VERSION or header.get('index_type') != cls.__name__:
+            return None
+
+        index = cls(dim=header['dim'], initial_capacity=0, **kwargs)
+        index._lock_file = _acquire_writer_lock(directory)
+        index.storage_dir = directory
+        index.writable = index._lock_file is not None
+        mode = 'r+' if index.writable else 'c'
+
+        try:
+            for name, (dtype, row_shape) in index._array_specs().items():
+                path = index._array_path(name)
+                row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+                capacity = os.path.getsize(path) // row_bytes
+                if capacity < header['size']:
+                    raise ValueError(f"ไฟล์ {name} มีข้อมูลน้อยกว่าที่ header ระบุ")
+                setattr(index, name, np.memmap(path, dtype=dtype, mode=mode, shape=(capacity,) + row_shape))
+            index._restore_header(header)
+        except (OSError, ValueError) as e:
+            print(f"Error opening vector index: {str(e)}")
+            index.close()
+            return None
+
+        index.size = header['size']
+        index.max_id = header['max_id']
+        index.metadata = header.get('metadata') or {}
+        index._mapped = True
+        return index
+
+    def close(self):
+        """บันทึก (ถ้าเป็นผู้เขียน) แล้วปล่อย lock ของโฟลเดอร์"""
+        with self._lock:
+            self.flush()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            self.writable = False
+
+    def search(self, query, k: int = 10, min_score: Optional[float] = None) -> List[Tuple[int, float]]:
+        """ค้นหา k vector ที่ cosine similarity สูงสุด คืนค่ารายการ (id, score) เรียงจากมากไปน้อย"""
+        with self._lock:
+            if self.size == 0:
+                return []
+
+            query = self.normalize(np.asarray(query, dtype=np.float32).ravel())
+            scores = self.vectors[:self.size] @ query
+            ids = self.ids[:self.size]
+
+        return self.top_k(ids, scores, k, min_score)
+
+    @staticmethod
+    def top_k(ids: np.ndarray, scores: np.ndarray, k: int,
+              min_score: Optional[float] = None) -> List[Tuple[int, float]]:
+        """เลือก k คะแนนสูงสุดด้วย argpartition (O(n)) แล้วเรียงเฉพาะ k ตัวนั้น"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        results = [(int(ids[i]), float(scores[i])) for i in top]
+        if min_score is not None:
+            results = [(i, s) for i, s in results if s >= min_score]
+        return results
+
+class IVFIndex(VectorMatrixIndex):
+    """
+    ดัชนี embedding แบบประมาณ (Approximate Nearest Neighbour) แบบ IVF
+    - จัดกลุ่ม vector ด้วย k-means (coarse quantizer) แล้วค้นหาเฉพาะ nprobe กลุ่มที่ใกล้ query ที่สุด
+    - แต่ละกลุ่มมีรายการตำแหน่งของ vector ในกลุ่ม (inverted list) การค้นหาจึงอ่านเฉพาะกลุ่มที่เลือก
+    - nprobe มากขึ้น = recall สูงขึ้นแต่ช้าลง
+    - ก่อนมีข้อมูลถึง min_train_size จะค้นหาแบบ exact
+    - train ใหม่เมื่อจำนวน vector เพิ่มเป็นสองเท่าจากครั้งก่อน: ใน thread เบื้องหลัง (background_train=True)
+      โดยไม่ถือ lock ระหว่าง k-means หรือเรียก train() เองจากคำสั่งดูแลระบบ (background_train=False)
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024,
+                 nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 min_train_size: int = IVF_MIN_TRAIN_SIZE,
+                 train_sample_size: int = IVF_TRAIN_SAMPLE_SIZE,
+                 background_train: bool = True):
+        super().__init__(dim, initial_capacity)
+        self.max_nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.train_sample_size = train_sample_size
+        self.background_train = background_train
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.full(initial_capacity, -1, dtype=np.int32)
+        self.trained_size = 0
+
+        # inverted list ของแต่ละกลุ่ม (สร้างจาก assignments เมื่อใช้ครั้งแรก)
+        # แถวที่ย้ายกลุ่มยังค้างอยู่ในรายการเดิม (stale) และถูกกรองตอนค้นหา
+        self._lists: Optional[List[np.ndarray]] = None
+        self._list_sizes: Optional[np.ndarray] = None
+        self._listed_rows = 0  # แถว [0, _listed_rows) อยู่ใน inverted list แล้ว
+        self._stale = 0
+
+        # การ train ที่กำลังทำงาน และตำแหน่งที่ถูกแก้ระหว่างนั้น (ต้องจัดกลุ่มใหม่ตอนจบ)
+        self._train_thread: Optional[threading.Thread] = None
+        self._training = False
+        self._updated_during_training: List[np.ndarray] = []
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _array_specs(self) -> Dict[str, Tuple[Any, Tuple[int, ...]]]:
+        specs = super()._array_specs()
+        specs['assignments'] = (np.int32, ())
+        return specs
+
+    def _header(self) -> Dict[str, Any]:
+        header = super()._header()
+        header['trained_size'] = self.trained_size
+        header['has_centroids'] = self.is_trained
+        return header
+
+    def _restore_header(self, header: Dict[str, Any]):
+        self.trained_size = header.get('trained_size', 0)
+        if header.get('has_centroids'):
+            self.centroids = np.load(os.path.join(self.storage_dir, "centroids.npy"))
+
+    def _save_extra(self):
+        if not self.is_trained:
+            return
+        path = os.path.join(self.storage_dir, "centroids.npy")
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, self.centroids)
+        os.replace(path + ".tmp", path)
+
+    def _ensure_capacity(self, required: int):
+        super()._ensure_capacity(required)
+        if self.assignments.shape[0] < self.vectors.shape[0]:
+            assignments = np.full(self.vectors.shape[0], -1, dtype=np.int32)
+            assignments[:self.size] = self.assignments[:self.size]
+            self.assignments = assignments
+
+    def _assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None,
+                chunk_size: int = 65536) -> np.ndarray:
+        """หา centroid ที่ใกล้ที่สุดของแต่ละ vector (ทีละช่วงเพื่อจำกัดหน่วยความจำ)"""
+        centroids = self.centroids if centroids is None else centroids
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            block = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    # ---------- inverted lists (เรียกขณะถือ lock) ----------
+
+    def _rebuild_lists(self):
+        """สร้าง inverted list ใหม่จาก assignments (ไม่มี stale)"""
+        assignments = self.assignments[:self.size]
+        order = np.argsort(assignments, kind='stable').astype(np.int64)
+        sizes = np.bincount(assignments, minlength=len(self.centroids)).astype(np.int64)
+        self._lists = np.split(order, np.cumsum(sizes)[:-1])
+        self._list_sizes = sizes
+        self._listed_rows = self.size
+        self._stale = 0
+
+    def _ensure_lists(self):
+        if self._lists is None and self.is_trained:
+            self._rebuild_lists()
+
+    def _append_to_lists(self, positions: np.ndarray, assignments: np.ndarray):
+        """เพิ่มตำแหน่งเข้า inverted list ของกลุ่มใหม่ (ขยายรายการแบบเท่าตัว)"""
+        order = np.argsort(assignments, kind='stable')
+        groups, starts = np.unique(assignments[order], return_index=True)
+        for group, block in zip(groups, np.split(positions[order], starts[1:])):
+            current = self._lists[group]
+            size = int(self._list_sizes[group])
+            if size + len(block) > len(current):
+                grown = np.empty(max(2 * len(current), size + len(block)), dtype=np.int64)
+                grown[:size] = current[:size]
+                self._lists[group] = current = grown
+            current[size:size + len(block)] = block
+            self._list_sizes[group] = size + len(block)
+
+    def _rows_updated(self, positions: np.ndarray):
+        if self._training:
+            self._updated_during_training.append(np.asarray(positions, dtype=np.int64))
+
+        if self.is_trained:
+            self._ensure_lists()
+            positions = np.asarray(positions, dtype=np.int64)
+            previous = self.assignments[positions].copy()
+            previous[positions >= self._listed_rows] = -1  # แถวใหม่ยังไม่อยู่ในรายการใด
+            assignments = self._assign(self.vectors[positions])
+            self.assignments[positions] = assignments
+
+            moved = previous != assignments
+            self._stale += int(np.count_nonzero(previous[moved] >= 0))
+            self._append_to_lists(positions[moved], assignments[moved])
+            self._listed_rows = max(self._listed_rows, int(positions.max()) + 1)
+            if self._stale > max(1024, self.size // 4):
+                self._rebuild_lists()
+
+        if (self.size >= 2 * self.trained_size) if self.is_trained else (self.size >= self.min_train_size):
+            self._schedule_training()
+
+    def _schedule_training(self):
+        """เริ่ม train ใน thread เบื้องหลัง (ถ้ายังไม่มีที่กำลังทำงาน) add() จึงไม่ต้องรอ k-means"""
+        if not self.background_train or self._training:
+            return
+        if self._train_thread is not None and self._train_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.train()
+            except Exception as e:
+                print(f"Error training vector index: {str(e)}")
+
+        self._train_thread = threading.Thread(target=run, name="ivf-train", daemon=True)
+        self._train_thread.start()
+
+    def wait_for_training(self, timeout: Optional[float] = None):
+        """รอการ train เบื้องหลังที่กำลังทำงาน (ถ้ามี)"""
+        thread = self._train_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self):
+        self.wait_for_training()
+        super().close()
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        สร้าง centroid ด้วย spherical k-means จากตัวอย่างของ vector ทั้งหมด แล้วจัดกลุ่มใหม่ทั้งหมด
+        ถือ lock เฉพาะตอนสุ่มตัวอย่างและตอนสลับเป็นผลใหม่ ระหว่างนั้น add/search ทำงานกับ centroid เดิม
+        แถวที่ถูกเพิ่มหรือแก้ระหว่าง train ถูกจัดกลุ่มใหม่ตอนสลับ
+        """
+        with self._lock:
+            if self.size == 0 or self._training:
+                return
+            self._training = True
+            self._updated_during_training = []
+
+            snapshot_size = self.size
+            vectors = self.vectors
+            rng = np.random.default_rng(seed)
+            nlist = int(max(1, min(self.max_nlist, 4 * np.sqrt(snapshot_size))))
+            sample_size = min(snapshot_size, max(self.train_sample_size, nlist))
+            sample = vectors[np.sort(rng.choice(snapshot_size, size=sample_size, replace=False))]
+
+        try:
+            centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = self._assign(sample, centroids)
+                order = np.argsort(labels, kind='stable')
+                present, starts = np.unique(labels[order], return_index=True)
+                sums = np.zeros_like(centroids)
+                sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+                counts = np.bincount(labels, minlength=nlist)
+
+                # กลุ่มที่ว่างใช้ vector สุ่มแทน เพื่อไม่ให้ centroid หายไป
+                empty = counts == 0
+                if empty.any():
+                    sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+                centroids = self.normalize(sums)
+
+            assignments = self._assign(vectors[:snapshot_size], centroids)
+
+            with self._lock:
+                self.centroids = centroids
+                self.assignments[:snapshot_size] = assignments
+                redo = np.unique(np.concatenate(
+                    self._updated_during_training + [np.arange(snapshot_size, self.size, dtype=np.int64)]
+                ))
+                if len(redo):
+                    self.assignments[redo] = self._assign(self.vectors[redo])
+                self.trained_size = snapshot_size
+                self._rebuild_lists()
+        finally:
+            with self._lock:
+                self._training = False
+                self._updated_during_training = []
+
+    def search(self, query, k: int = 10, min_score: Optional[float] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """ค้นหาแบบประมาณใน nprobe กลุ่มที่ใกล้ที่สุด (exact ถ้ายังไม่ได้ train)"""
+        if not self.is_trained:
+            return super().search(query, k, min_score)
+
+        with self._lock:
+            self._ensure_lists()
+            query = self.normalize(np.asarray(query, dtype=np.float32).ravel())
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+            centroid_scores = self.centroids @ query
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+            positions = np.concatenate([self._lists[group][:self._list_sizes[group]] for group in probes])
+            if self._stale:
+                # ตัดแถวที่ย้ายไปกลุ่มอื่นแล้ว (และรายการซ้ำเมื่อแถวย้ายกลับกลุ่มเดิม)
+                positions = np.unique(positions[np.isin(self.assignments[positions], probes)])
+            scores = self.vectors[positions] @ query
+            ids = self.ids[positions]
+
+        return self.top_k(ids, scores, k, min_score)
+
+    def search_exact(self, query, k: int = 10, min_score: Optional[float] = None) -> List[Tuple[int, float]]:
+        """ค้นหาแบบ exact ทุก vector (ใช้เปรียบเทียบ recall)"""
+        return super().search(query, k, min_score)
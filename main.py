@@ -7,6 +7,7 @@ from streamlit_option_menu import option_menu
 from components.database import DatabaseManager
 from components.chat_analysis import ChatAnalyzer
 from components.chatbot import ChatBot
+from components.chat_context import ChatContextRetriever
 from utils.config import *
 
 # Page configuration
@@ -59,14 +60,30 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_db_manager() -> DatabaseManager:
+    """DatabaseManager ตัวเดียวที่ใช้ร่วมกันทุก session ใน process"""
+    return DatabaseManager()
+
+@st.cache_resource
+def get_chat_analyzer() -> ChatAnalyzer:
+    """ChatAnalyzer ที่ใช้ร่วมกันทุก session ใน process"""
+    return ChatAnalyzer(get_db_manager())
+
+@st.cache_resource
+def get_chatbot() -> ChatBot:
+    """ChatBot ที่ใช้ร่วมกันทุก session ใน process (เลือก context ตามคำถามด้วย ChatContextRetriever)"""
+    chat_analyzer = get_chat_analyzer()
+    return ChatBot(
+        embed=chat_analyzer.get_embedding,
+        retriever=ChatContextRetriever(get_db_manager(), chat_analyzer)
+    )
+
 def main():
-    # Initialize session state
-    if 'db_manager' not in st.session_state:
-        st.session_state.db_manager = DatabaseManager()
-    if 'chat_analyzer' not in st.session_state:
-        st.session_state.chat_analyzer = ChatAnalyzer(st.session_state.db_manager)
-    if 'chatbot' not in st.session_state:
-        st.session_state.chatbot = ChatBot()
+    # Initialize session state (อ้างอิง object ที่ใช้ร่วมกันทั้ง process)
+    st.session_state.db_manager = get_db_manager()
+    st.session_state.chat_analyzer = get_chat_analyzer()
+    st.session_state.chatbot = get_chatbot()
 
     # Header
     st.markdown("""
@@ -188,7 +205,9 @@ def show_dashboard():
             st.markdown('<div class="metric-card">', unsafe_allow_html=True)
             st.metric(
                 label="เวลาตอบกลับเฉลี่ย",
-                value=f"{analytics_data.get('avg_response_time', 0):.1f} นาที"
+                value=f"{analytics_data.get('avg_response_time', 0):.1f} นาที",
+                delta=f"{analytics_data.get('response_time_change', 0):.1f} นาที",
+                delta_color="inverse"
             )
             st.markdown('</div>', unsafe_allow_html=True)
         
@@ -316,24 +335,18 @@ def show_chatbot():
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Generate assistant response
+        # Generate assistant response (แสดงทีละส่วนระหว่างที่ AI กำลังสร้างคำตอบ)
         with st.chat_message("assistant"):
-            with st.spinner("กำลังคิด..."):
-                try:
-                    # Get response from chatbot
-                    response = st.session_state.chatbot.get_response(
-                        prompt, 
-                        context=st.session_state.db_manager.get_conversation_context()
-                    )
-                    st.markdown(response)
-                    
-                    # Add assistant response to chat history
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+            try:
+                response = st.write_stream(st.session_state.chatbot.stream_response(prompt))
                 
-                except Exception as e:
-                    error_msg = f"ขออภัย เกิดข้อผิดพลาด: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                # Add assistant response to chat history
+                st.session_state.messages.append({"role": "assistant", "content": response})
+            
+            except Exception as e:
+                error_msg = f"ขออภัย เกิดข้อผิดพลาด: {str(e)}"
+                st.error(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
 def show_settings():
     st.header("⚙️ Settings")
@@ -388,6 +401,16 @@ def show_settings():
             help="ใช้สำหรับการค้นหาและจัดกลุ่มข้อความที่คล้ายกัน"
         )
         
+        pipeline_skip_stages = st.multiselect(
+            "ข้ามขั้นตอนของ pipeline ประมวลผลข้อความ",
+            options=list(PIPELINE_SKIPPABLE_STAGES),
+            default=[
+                stage for stage in current_settings.get('pipeline_skip_stages') or []
+                if stage in PIPELINE_SKIPPABLE_STAGES
+            ],
+            help="normalize = ปรับรูปข้อความ, score = sentiment, embed = embedding (ข้ามเมื่อปิด Embedding ด้วย)"
+        )
+        
         auto_response = st.checkbox(
             "เปิดใช้งานการตอบกลับอัตโนมัติ",
             value=current_settings.get('auto_response', False),
@@ -408,6 +431,7 @@ def show_settings():
             try:
                 st.session_state.db_manager.update_settings({
                     'embedding_enabled': embedding_enabled,
+                    'pipeline_skip_stages': pipeline_skip_stages,
                     'auto_response': auto_response,
                     'response_threshold': response_threshold
                 })
@@ -415,6 +439,57 @@ def show_settings():
             except Exception as e:
                 st.error(f"เกิดข้อผิดพลาด: {str(e)}")
     
+    # AI Service Status
+    st.subheader("AI Service Status")
+    cache_stats = st.session_state.chat_analyzer.embedding_cache.stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Embedding Cache Hit Rate", f"{cache_stats['hit_rate']:.1%}")
+    with col2:
+        st.metric("Cache Hits (หน่วยความจำ / ฐานข้อมูล)", f"{cache_stats['memory_hits']:,} / {cache_stats['persistent_hits']:,}")
+    with col3:
+        st.metric("Cache Misses", f"{cache_stats['misses']:,}")
+    st.caption(f"แคชในหน่วยความจำ {cache_stats['size']:,} / {cache_stats['max_size']:,} รายการ")
+    response_cache_stats = st.session_state.chatbot.response_cache.stats()
+    st.caption(
+        f"คำตอบ Chatbot จากแคช {response_cache_stats['hit_rate']:.1%} "
+        f"(ตรงกัน {response_cache_stats['exact_hits']:,}, คล้ายกัน {response_cache_stats['semantic_hits']:,}, "
+        f"ไม่พบ {response_cache_stats['misses']:,})"
+    )
+    for mode, prompt_stats in st.session_state.chatbot.prompt_stats().items():
+        st.caption(
+            f"Prompt ({mode}): เฉลี่ย {prompt_stats['prompt_tokens']:,.0f} tokens "
+            f"(context {prompt_stats['context_tokens']:,.0f}), เลือก context {prompt_stats['retrieval_ms']:,.0f} ms, "
+            f"สร้างคำตอบ {prompt_stats['generation_ms']:,.0f} ms จาก {prompt_stats['requests']:,} คำถาม"
+        )
+    
+    breaker_labels = {'closed': "🟢 ปกติ", 'half_open': "🟡 กำลังทดสอบ", 'open': "🔴 ปิดการเรียกชั่วคราว"}
+    breaker_stats = st.session_state.chat_analyzer.model_client.breaker_stats()
+    for col, (name, breaker) in zip(st.columns(len(breaker_stats)), breaker_stats.items()):
+        with col:
+            st.metric(f"{name.title()} Model", breaker_labels.get(breaker['state'], breaker['state']))
+            details = (
+                f"error {breaker['error_rate']:.0%}, p95 {breaker['p95_ms']:,.0f} / {breaker['p95_threshold_ms']:,.0f} ms "
+                f"จาก {breaker['window_requests']} request ล่าสุด, ปฏิเสธทันที {breaker['rejected']:,} ครั้ง"
+            )
+            if breaker['state'] == 'open':
+                details = f"{breaker['reason']} - ลองใหม่ใน {breaker['retry_in_seconds']:.0f} วินาที, {details}"
+            st.caption(details)
+    
+    model_stats = st.session_state.chat_analyzer.model_client.stats()
+    if model_stats:
+        st.dataframe(
+            pd.DataFrame.from_dict(model_stats, orient='index').round(1),
+            use_container_width=True
+        )
+        coalescing_stats = st.session_state.chat_analyzer.model_client.single_flight.stats()
+        st.caption(
+            f"request ที่ซ้ำกันขณะทำงานพร้อมกันได้ผลร่วมกัน {coalescing_stats['coalesced']:,} ครั้ง "
+            f"({coalescing_stats['coalesced_rate']:.1%}), กำลังทำงาน {coalescing_stats['in_flight']:,} request"
+        )
+    else:
+        st.caption("ยังไม่มีการเรียก model server")
+    
     # Database Status
     st.subheader("Database Status")
     try:
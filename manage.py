@@ -0,0 +1,576 @@
+"""
+คำสั่งสำหรับดูแลระบบ LINE OA Analytics จาก command line
+
+ตัวอย่าง:
+    python manage.py explain-date-filters --days 30
+    python manage.py backfill-metrics --start 2024-01-01 --end 2024-03-31
+    python manage.py compact-daily-metrics
+    python manage.py bench-insert --rows 2000
+    python manage.py migrate-embeddings
+    python manage.py bench-similarity --vectors 1000000
+    python manage.py sync-vector-index --train
+    python manage.py bench-chat-context --generate
+    python manage.py bench-keywords --messages 1000000
+    python manage.py bench-tokenizer --messages 1000000
+    python manage.py bench-scoring --messages 1000000
+    python manage.py rescore-sentiment
+    python manage.py process-backlog --processes 4
+    python manage.py process-pipeline --limit 1000
+"""
+import argparse
+import time
+import uuid
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import text
+from components.database import DatabaseManager, LOCAL_TZ
+from components.vector_index import IVFIndex
+from components.chat_analysis import ChatAnalyzer, ResultWriter
+from components.backlog_worker import BacklogWorker
+from utils.keyword_matcher import KeywordMatcher
+from utils.thai_tokenizer import ThaiTokenizer, get_thai_tokenizer, load_dictionary
+from components.chat_context import ChatContextRetriever, estimate_tokens
+from components.chatbot import ChatBot
+from utils.config import (
+    CHAT_CONTEXT_TOKEN_BUDGET, SCORING_CHUNK_SIZE, BACKLOG_BATCH_SIZE, BACKLOG_LEASE_SECONDS,
+    BACKLOG_IDLE_SECONDS, BACKLOG_SCORING_PROCESSES, BATCH_PROCESSING_LIMIT
+)
+
+def explain_date_filters(args):
+    """แสดง EXPLAIN ของเงื่อนไขช่วงวันที่แบบเดิมเทียบกับแบบใหม่"""
+    db_manager = DatabaseManager()
+    end_date = datetime.now(LOCAL_TZ)
+    start_date = end_date - timedelta(days=args.days)
+
+    report = db_manager.explain_date_filters(start_date, end_date)
+
+    print("=== ก่อน: DATE(timestamp) BETWEEN ... ===")
+    print(report['before'].to_string(index=False))
+    print("\n=== หลัง: timestamp >= :start_ts AND timestamp < :end_ts ===")
+    print(report['after'].to_string(index=False))
+
+    print(f"\nก่อน full scan: {report['before_full_scan']}")
+    print(f"หลัง full scan: {report['after_full_scan']}")
+
+    # คืนค่า exit code ไม่เป็นศูนย์ถ้า query แบบใหม่ยัง scan ทั้งตาราง
+    return 1 if report['after_full_scan'] else 0
+
+def backfill_metrics(args):
+    """สร้างตาราง rollup daily_metrics ใหม่จากประวัติการสนทนา"""
+    db_manager = DatabaseManager()
+    start_date = date.fromisoformat(args.start) if args.start else None
+    end_date = date.fromisoformat(args.end) if args.end else None
+
+    rebuilt_days = db_manager.rebuild_daily_metrics(start_date, end_date)
+    print(f"✅ สร้าง daily_metrics ใหม่ {rebuilt_days} วัน")
+    return 0
+
+def compact_daily_metrics(args):
+    """merge user/conversation ที่รออยู่ใน daily_sketch_queue เข้า sketch ของ daily_metrics"""
+    db_manager = DatabaseManager()
+    compacted = db_manager.compact_daily_sketches()
+    print(f"✅ merge เข้า sketch แล้ว {compacted:,} รายการ")
+    return 0
+
+def bench_insert(args):
+    """เปรียบเทียบเวลา insert ทีละแถวกับ insert_conversations_bulk (ลบข้อมูลทดสอบทิ้งหลังจบ)"""
+    db_manager = DatabaseManager()
+    run_id = uuid.uuid4().hex[:8]
+
+    def make_rows(label):
+        return [
+            {
+                'conversation_id': f"bench-{run_id}-{label}-{i // 10}",
+                'user_id': f"bench-user-{i % 50}",
+                'message': f"ข้อความทดสอบ {i}",
+                'message_type': 'text',
+                'sender_type': 'customer' if i % 2 == 0 else 'admin',
+                'response_time': 60 if i % 2 else None,
+                'metadata': {'benchmark': run_id}
+            }
+            for i in range(args.rows)
+        ]
+
+    try:
+        started = time.perf_counter()
+        for row in make_rows("single"):
+            db_manager.insert_conversation(row)
+        single_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        db_manager.insert_conversations_bulk(make_rows("bulk"), batch_size=args.batch_size)
+        bulk_seconds = time.perf_counter() - started
+
+        print(f"insert_conversation:        {args.rows} แถว {single_seconds:.2f}s ({args.rows / single_seconds:.0f} แถว/วินาที)")
+        print(f"insert_conversations_bulk:  {args.rows} แถว {bulk_seconds:.2f}s ({args.rows / bulk_seconds:.0f} แถว/วินาที)")
+        print(f"เร็วขึ้น {single_seconds / bulk_seconds:.1f} เท่า")
+    finally:
+        with db_manager.engine.connect() as conn:
+            conn.execute(text("""
+                DELETE FROM conversations WHERE conversation_id LIKE :prefix
+            """), {"prefix": f"bench-{run_id}-%"})
+            conn.commit()
+        today = datetime.now(LOCAL_TZ)
+        db_manager.rebuild_daily_metrics(today, today)
+
+    return 0
+
+def migrate_embeddings(args):
+    """แปลง embedding ที่เก็บเป็น JSON เป็น binary"""
+    db_manager = DatabaseManager()
+    migrated = db_manager.migrate_json_embeddings(batch_size=args.batch_size)
+    for table, counts in migrated.items():
+        print(f"✅ {table}: แปลง {counts['migrated']} แถว, แปลงไม่ได้ {counts['failed']} แถว (เก็บ JSON เดิมไว้)")
+    return 0
+
+def bench_similarity(args):
+    """
+    วัด recall และ latency ของการค้นหาแบบ IVF เทียบกับ exact search บนข้อมูลสุ่ม (ไม่ใช้ฐานข้อมูล)
+    ข้อมูลสุ่มเป็นกลุ่ม ๆ (mixture) ใกล้เคียง embedding จริงที่มีหัวข้อซ้ำกัน
+    """
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+
+    def sample(count):
+        noise = rng.standard_normal((count, args.dim), dtype=np.float32)
+        return centers[rng.integers(0, args.clusters, count)] + args.noise * noise
+
+    # train หลังเพิ่มข้อมูลครบ เพื่อให้ benchmark ไม่รวมการ train ซ้ำระหว่างทาง
+    index = IVFIndex(dim=args.dim, initial_capacity=args.vectors, min_train_size=args.vectors + 1)
+
+    # เพิ่มทีละช่วงเพื่อไม่ให้ใช้หน่วยความจำซ้ำซ้อน
+    chunk = 100000
+    started = time.perf_counter()
+    for offset in range(0, args.vectors, chunk):
+        count = min(chunk, args.vectors - offset)
+        index.add(np.arange(offset + 1, offset + count + 1), sample(count))
+    print(f"เพิ่ม {args.vectors} vectors ({args.dim} มิติ) ใช้เวลา {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    index.train()
+    print(f"train IVF ({len(index.centroids)} กลุ่ม) ใช้เวลา {time.perf_counter() - started:.1f}s")
+
+    queries = sample(args.queries)
+    exact_results = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        exact_results.append({i for i, _ in index.search_exact(query, k=args.k)})
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"exact      top-{args.k}: recall 1.000, p50 {np.percentile(latencies, 50):7.2f} ms, "
+          f"p95 {np.percentile(latencies, 95):7.2f} ms")
+
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        recalls = []
+        latencies = []
+        for query, exact in zip(queries, exact_results):
+            started = time.perf_counter()
+            approx = {i for i, _ in index.search(query, k=args.k, nprobe=nprobe)}
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len(exact & approx) / max(1, len(exact)))
+        print(f"ivf nprobe={nprobe:<3} top-{args.k}: recall {np.mean(recalls):.3f}, "
+              f"p50 {np.percentile(latencies, 50):7.2f} ms, p95 {np.percentile(latencies, 95):7.2f} ms")
+
+    return 0
+
+def sync_vector_index(args):
+    """สร้างหรืออัปเดต vector index บนดิสก์ให้ตรงกับฐานข้อมูล (ใช้ก่อน deploy เพื่อให้ app เริ่มได้ทันที)"""
+    analyzer = ChatAnalyzer(DatabaseManager())
+    index = analyzer.vector_index
+    if not index.writable:
+        print("⚠️ มี process อื่นกำลังใช้ vector index อยู่ ข้อมูลจะไม่ถูกบันทึกลงดิสก์")
+
+    started = time.perf_counter()
+    added = analyzer.sync_vector_index()
+    if args.train:
+        # train ใหม่ทั้งหมดนอก request path แทนการรอให้ add() สั่ง train เบื้องหลัง
+        index.wait_for_training()
+        index.train()
+        print(f"train IVF ({len(index.centroids)} กลุ่ม) จาก {index.trained_size} vectors")
+    index.close()
+    print(f"✅ เพิ่ม {added} vectors (ทั้งหมด {len(index)}) ใช้เวลา {time.perf_counter() - started:.1f}s")
+    return 0 if index.storage_dir else 1
+
+def bench_chat_context(args):
+    """
+    เปรียบเทียบขนาด prompt ของ Chatbot ระหว่าง context แบบเดิม (ข้อความล่าสุดทั้งหมด)
+    กับ context ที่เลือกตามคำถาม (fact sheet หรือ retrieval) ใช้คำถามแนะนำของ Admin เป็นชุดทดสอบ
+    --generate เรียก model จริงเพื่อวัดเวลาสร้างคำตอบด้วย
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+    retriever = ChatContextRetriever(db_manager, analyzer, token_budget=args.budget)
+    legacy_bot = ChatBot()
+    retrieval_bot = ChatBot(retriever=retriever)
+    questions = legacy_bot.get_help_suggestions('admin')
+
+    started = time.perf_counter()
+    recent = db_manager.get_conversation_context()
+    legacy_text = legacy_bot._prepare_context(recent)
+    legacy_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    retriever.snapshot()
+    print(f"snapshot สถิติรวม + ข้อความล่าสุด: {(time.perf_counter() - started) * 1000:.0f} ms")
+    print(f"{'':<10}{'tokens':>8}{'ms':>8}  คำถาม")
+
+    for question in questions:
+        started = time.perf_counter()
+        mode, _, build_context = retrieval_bot._context_source(question, None)
+        context_text = build_context()
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        print(f"{'เดิม':<10}{estimate_tokens(legacy_text):>8}{legacy_ms:>8.0f}  {question}")
+        print(f"{mode:<10}{estimate_tokens(context_text):>8}{retrieval_ms:>8.0f}")
+
+    if args.generate:
+        for question in questions:
+            legacy_bot.get_response(question, context=recent)
+            retrieval_bot.get_response(question)
+
+        print()
+        for bot in (legacy_bot, retrieval_bot):
+            for name, stats in bot.prompt_stats().items():
+                print(f"{name}: prompt เฉลี่ย {stats['prompt_tokens']:.0f} tokens, "
+                      f"สร้างคำตอบเฉลี่ย {stats['generation_ms']:.0f} ms ({stats['requests']} คำถาม)")
+
+    return 0
+
+def bench_keywords(args):
+    """
+    วัดความเร็วการนับคำสำคัญ (sentiment + หัวข้อ) ของข้อความลูกค้าจริง
+    เทียบการวนลูป keyword in text ทีละชุดแบบเดิมกับ KeywordMatcher ที่สแกนครั้งเดียว (แบบ substring)
+    และแบบเทียบทั้งคำหลังตัดคำที่ ChatAnalyzer ใช้
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+
+    with db_manager.engine.connect() as conn:
+        sample = [row.message or '' for row in conn.execute(text("""
+            SELECT message FROM conversations
+            WHERE sender_type = 'customer'
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {"limit": args.sample})]
+    if not sample:
+        print("ไม่มีข้อความลูกค้าในฐานข้อมูล")
+        return 1
+    messages = [sample[i % len(sample)] for i in range(args.messages)]
+
+    def legacy_counts(message):
+        text_lower = message.lower()
+        counts = {
+            'positive': sum(1 for word in analyzer.positive_keywords if word in text_lower),
+            'negative': sum(1 for word in analyzer.negative_keywords if word in text_lower),
+        }
+        for topic, keywords in analyzer.topic_keywords.items():
+            counts[topic] = sum(1 for keyword in keywords if keyword in text_lower)
+        return {name: count for name, count in counts.items() if count}
+
+    substring_matcher = KeywordMatcher(analyzer.keyword_matcher.categories)
+
+    def substring_counts(message):
+        return substring_matcher.count(message.lower())
+
+    mismatches = sum(1 for message in sample if legacy_counts(message) != substring_counts(message))
+    print(f"ผลไม่ตรงกัน {mismatches}/{len(sample)} ข้อความ")
+
+    timings = {}
+    for name, scan in (("วนลูปคำสำคัญ (เดิม)", legacy_counts), ("KeywordMatcher", substring_counts),
+                       ("ตัดคำ + KeywordMatcher", analyzer.keyword_counts)):
+        started = time.perf_counter()
+        for message in messages:
+            scan(message)
+        timings[name] = time.perf_counter() - started
+        per_million = timings[name] / len(messages) * 1_000_000
+        print(f"{name:<22} {len(messages) / timings[name]:>10,.0f} ข้อความ/วินาที  {per_million:7.1f}s ต่อ 1 ล้านข้อความ")
+
+    legacy_seconds, matcher_seconds, _ = timings.values()
+    print(f"เร็วขึ้น {legacy_seconds / matcher_seconds:.1f} เท่า")
+    return 1 if mismatches else 0
+
+def bench_tokenizer(args):
+    """
+    วัดความเร็วตัวตัดคำภาษาไทยกับข้อความลูกค้าจริง (ไม่มีแคช / มีแคชผลตัดคำ)
+    และนับข้อความที่ผลนับคำสำคัญเปลี่ยนไปเมื่อเทียบทั้งคำแทน substring
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+
+    with db_manager.engine.connect() as conn:
+        sample = [row.message or '' for row in conn.execute(text("""
+            SELECT message FROM conversations
+            WHERE sender_type = 'customer'
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {"limit": args.sample})]
+    if not sample:
+        print("ไม่มีข้อความลูกค้าในฐานข้อมูล")
+        return 1
+    messages = [sample[i % len(sample)] for i in range(args.messages)]
+
+    started = time.perf_counter()
+    words = load_dictionary()
+    uncached = ThaiTokenizer(words, cache_size=0)
+    print(f"โหลดพจนานุกรม {len(uncached):,} คำ {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    shared = get_thai_tokenizer()
+    for name, tokenizer in (("ไม่มีแคช", uncached), ("มีแคช", shared)):
+        started = time.perf_counter()
+        for message in messages:
+            tokenizer.tokenize(message)
+        seconds = time.perf_counter() - started
+        per_million = seconds / len(messages) * 1_000_000
+        print(f"ตัดคำ ({name:<8}) {len(messages) / seconds:>10,.0f} ข้อความ/วินาที  {per_million:7.1f}s ต่อ 1 ล้านข้อความ")
+    cache = shared.cache_info()
+    print(f"แคชผลตัดคำ: hit {cache.hits:,} miss {cache.misses:,} ({cache.currsize:,}/{cache.maxsize:,} รายการ)")
+
+    substring_matcher = KeywordMatcher(analyzer.keyword_matcher.categories)
+    changed = sum(
+        1 for message in sample
+        if substring_matcher.count(message.lower()) != analyzer.keyword_counts(message)
+    )
+    print(f"ผลนับคำสำคัญเปลี่ยน (substring -> ทั้งคำ) {changed}/{len(sample)} ข้อความ")
+    for message in sample[:args.show]:
+        print(f"  {message[:60]!r} -> {' | '.join(shared.tokenize(message))}")
+    return 0
+
+def bench_scoring(args):
+    """
+    วัดความเร็วการให้คะแนน sentiment + หัวข้อ 3 อันดับของข้อความลูกค้าจริง
+    เทียบการเรียก analyze_sentiment_simple/classify_topic ทีละข้อความกับ score_messages แบบ batch
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+
+    with db_manager.engine.connect() as conn:
+        sample = [row.message or '' for row in conn.execute(text("""
+            SELECT message FROM conversations
+            WHERE sender_type = 'customer'
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {"limit": args.sample})]
+    if not sample:
+        print("ไม่มีข้อความลูกค้าในฐานข้อมูล")
+        return 1
+    messages = [sample[i % len(sample)] for i in range(args.messages)]
+
+    def score_row(message):
+        counts = analyzer.keyword_counts(message)
+        sentiment = analyzer.analyze_sentiment_simple(message, counts)
+        topics = [topic['topic'] for topic in analyzer.classify_topic(message, counts)]
+        return (sentiment['sentiment'], sentiment['score'], *(topics + [None] * 3)[:3])
+
+    scored = analyzer.score_messages(sample)
+    mismatches = sum(
+        1 for message, row in zip(sample, scored.itertuples(index=False))
+        if score_row(message) != tuple(row)
+    )
+    print(f"ผลไม่ตรงกัน {mismatches}/{len(sample)} ข้อความ")
+
+    started = time.perf_counter()
+    for message in messages:
+        score_row(message)
+    row_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    analyzer.score_messages(messages, chunk_size=args.chunk_size)
+    batch_seconds = time.perf_counter() - started
+
+    for name, seconds in (("ทีละข้อความ", row_seconds), ("score_messages", batch_seconds)):
+        per_million = seconds / len(messages) * 1_000_000
+        print(f"{name:<16} {len(messages) / seconds:>10,.0f} ข้อความ/วินาที  {per_million:7.1f}s ต่อ 1 ล้านข้อความ")
+    print(f"เร็วขึ้น {row_seconds / batch_seconds:.1f} เท่า")
+    return 1 if mismatches else 0
+
+def rescore_sentiment(args):
+    """
+    คำนวณ sentiment ของข้อความลูกค้าที่ประมวลผลแล้วใหม่ทั้งหมด (เช่น หลังแก้คำสำคัญ)
+    อ่านทีละ chunk ตาม id ให้คะแนนด้วย score_messages และเขียนกลับเฉพาะแถวที่ผลเปลี่ยน
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+
+    last_id = 0
+    scanned = 0
+    started = time.perf_counter()
+    with ResultWriter(db_manager) as writer:
+        while True:
+            with db_manager.engine.connect() as conn:
+                rows = conn.execute(text("""
+                    SELECT id, message, sentiment, sentiment_score FROM conversations
+                    WHERE sender_type = 'customer' AND sentiment IS NOT NULL AND id > :last_id
+                    ORDER BY id
+                    LIMIT :limit
+                """), {"last_id": last_id, "limit": args.chunk_size}).fetchall()
+            if not rows:
+                break
+
+            scored = analyzer.score_messages([row.message for row in rows])
+            for row, sentiment, score in zip(rows, scored['sentiment'], scored['sentiment_score']):
+                if row.sentiment != sentiment or row.sentiment_score is None or abs(float(row.sentiment_score) - score) > 1e-9:
+                    writer.add_sentiment(row.id, sentiment, float(score))
+
+            last_id = rows[-1].id
+            scanned += len(rows)
+            print(f"ตรวจแล้ว {scanned:,} ข้อความ (id ถึง {last_id}) เขียนแล้ว {writer.written_count:,}")
+
+    elapsed = time.perf_counter() - started
+    print(f"เสร็จใน {elapsed:.1f}s: ตรวจ {scanned:,} ข้อความ อัปเดต {writer.written_count:,} ข้อความ")
+    return 0
+
+def process_backlog(args):
+    """
+    ประมวลผลข้อความลูกค้าที่ค้างอยู่นอก Streamlit (รันหลาย worker บนหลายเครื่องพร้อมกันได้)
+    หยุดด้วย Ctrl+C - ข้อความที่จองไว้แต่ยังไม่ได้เขียนผลจะถูกปล่อยให้ worker อื่น
+    """
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+
+    with BacklogWorker(db_manager, analyzer, batch_size=args.batch_size, lease_seconds=args.lease_seconds,
+                       processes=args.processes) as worker:
+        print(f"⏳ worker {worker.worker_id} เริ่มทำงาน (batch {args.batch_size}, {args.processes} process)")
+        try:
+            worker.run(once=args.once, idle_seconds=args.idle_seconds, max_batches=args.max_batches)
+        except KeyboardInterrupt:
+            print("⏹️ หยุด worker")
+
+        stats = worker.stats()
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in stats['stage_seconds'].items())
+        print(f"ประมวลผล {stats['written']:,}/{stats['claimed']:,} ข้อความ ใน {stats['batches']} รอบ "
+              f"(embedding {stats['embedded']:,}) {stats['messages_per_second']:,.0f} ข้อความ/วินาที")
+        print(f"เวลาแต่ละขั้นตอน: {stages}")
+    return 0
+
+def process_pipeline(args):
+    """ประมวลผลข้อความค้างหนึ่งรอบผ่าน MessagePipeline แล้วแสดงตัวนับของแต่ละขั้นตอน"""
+    db_manager = DatabaseManager()
+    analyzer = ChatAnalyzer(db_manager)
+    analyzer.batch_process_unprocessed_messages(limit=args.limit)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE OA Analytics management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    explain_parser = subparsers.add_parser(
+        "explain-date-filters",
+        help="ตรวจว่า query ช่วงวันที่ใช้ index บน timestamp"
+    )
+    explain_parser.add_argument("--days", type=int, default=30)
+    explain_parser.set_defaults(func=explain_date_filters)
+
+    backfill_parser = subparsers.add_parser(
+        "backfill-metrics",
+        help="สร้างตาราง daily_metrics ใหม่จากข้อมูลย้อนหลัง"
+    )
+    backfill_parser.add_argument("--start", help="วันที่เริ่มต้น (YYYY-MM-DD) ค่าเริ่มต้นคือข้อความแรก")
+    backfill_parser.add_argument("--end", help="วันที่สิ้นสุด (YYYY-MM-DD) ค่าเริ่มต้นคือข้อความล่าสุด")
+    backfill_parser.set_defaults(func=backfill_metrics)
+
+    compact_parser = subparsers.add_parser(
+        "compact-daily-metrics",
+        help="merge user/conversation ที่เพิ่ง insert เข้า sketch ของ daily_metrics"
+    )
+    compact_parser.set_defaults(func=compact_daily_metrics)
+
+    bench_insert_parser = subparsers.add_parser(
+        "bench-insert",
+        help="วัดความเร็ว insert ทีละแถวเทียบกับแบบ bulk"
+    )
+    bench_insert_parser.add_argument("--rows", type=int, default=1000)
+    bench_insert_parser.add_argument("--batch-size", type=int, default=500)
+    bench_insert_parser.set_defaults(func=bench_insert)
+
+    migrate_embeddings_parser = subparsers.add_parser(
+        "migrate-embeddings",
+        help="แปลง embedding แบบ JSON เดิมเป็น binary (embedding_blob)"
+    )
+    migrate_embeddings_parser.add_argument("--batch-size", type=int, default=500)
+    migrate_embeddings_parser.set_defaults(func=migrate_embeddings)
+
+    bench_similarity_parser = subparsers.add_parser(
+        "bench-similarity",
+        help="วัดความเร็วการค้นหา embedding ที่คล้ายกัน"
+    )
+    bench_similarity_parser.add_argument("--vectors", type=int, default=100000)
+    bench_similarity_parser.add_argument("--dim", type=int, default=768)
+    bench_similarity_parser.add_argument("--queries", type=int, default=50)
+    bench_similarity_parser.add_argument("--k", type=int, default=10)
+    bench_similarity_parser.add_argument("--nprobe", default="1,4,16,64", help="ค่า nprobe ที่ต้องการทดสอบ คั่นด้วย ,")
+    bench_similarity_parser.add_argument("--clusters", type=int, default=2000)
+    bench_similarity_parser.add_argument("--noise", type=float, default=1.0)
+    bench_similarity_parser.set_defaults(func=bench_similarity)
+
+    sync_index_parser = subparsers.add_parser(
+        "sync-vector-index",
+        help="ดึง embedding ใหม่จากฐานข้อมูลเข้า vector index บนดิสก์"
+    )
+    sync_index_parser.add_argument("--train", action="store_true", help="train centroid ของ IVF ใหม่หลัง sync")
+    sync_index_parser.set_defaults(func=sync_vector_index)
+
+    bench_chat_context_parser = subparsers.add_parser(
+        "bench-chat-context",
+        help="วัดขนาด prompt และเวลาตอบของ Chatbot ก่อน/หลังเลือก context ตามคำถาม"
+    )
+    bench_chat_context_parser.add_argument("--budget", type=int, default=CHAT_CONTEXT_TOKEN_BUDGET)
+    bench_chat_context_parser.add_argument("--generate", action="store_true", help="เรียก model เพื่อวัดเวลาสร้างคำตอบ")
+    bench_chat_context_parser.set_defaults(func=bench_chat_context)
+
+    bench_keywords_parser = subparsers.add_parser(
+        "bench-keywords",
+        help="วัดความเร็วการนับคำสำคัญ sentiment/หัวข้อ ต่อ 1 ล้านข้อความ"
+    )
+    bench_keywords_parser.add_argument("--messages", type=int, default=1000000)
+    bench_keywords_parser.add_argument("--sample", type=int, default=10000, help="จำนวนข้อความจริงที่ดึงมาวนใช้")
+    bench_keywords_parser.set_defaults(func=bench_keywords)
+
+    bench_tokenizer_parser = subparsers.add_parser(
+        "bench-tokenizer",
+        help="วัดความเร็วตัวตัดคำภาษาไทยต่อ 1 ล้านข้อความ"
+    )
+    bench_tokenizer_parser.add_argument("--messages", type=int, default=1000000)
+    bench_tokenizer_parser.add_argument("--sample", type=int, default=10000, help="จำนวนข้อความจริงที่ดึงมาวนใช้")
+    bench_tokenizer_parser.add_argument("--show", type=int, default=5, help="จำนวนตัวอย่างผลตัดคำที่แสดง")
+    bench_tokenizer_parser.set_defaults(func=bench_tokenizer)
+
+    bench_scoring_parser = subparsers.add_parser(
+        "bench-scoring",
+        help="วัดความเร็วการให้คะแนน sentiment/หัวข้อแบบ batch เทียบกับทีละข้อความ"
+    )
+    bench_scoring_parser.add_argument("--messages", type=int, default=1000000)
+    bench_scoring_parser.add_argument("--sample", type=int, default=10000, help="จำนวนข้อความจริงที่ดึงมาวนใช้")
+    bench_scoring_parser.add_argument("--chunk-size", type=int, default=SCORING_CHUNK_SIZE)
+    bench_scoring_parser.set_defaults(func=bench_scoring)
+
+    rescore_parser = subparsers.add_parser(
+        "rescore-sentiment",
+        help="คำนวณ sentiment ของข้อความที่ประมวลผลแล้วใหม่ด้วยคำสำคัญปัจจุบัน"
+    )
+    rescore_parser.add_argument("--chunk-size", type=int, default=SCORING_CHUNK_SIZE)
+    rescore_parser.set_defaults(func=rescore_sentiment)
+
+    backlog_parser = subparsers.add_parser(
+        "process-backlog",
+        help="ประมวลผลข้อความค้าง (sentiment + embedding) แบบ worker ที่รันหลายตัวพร้อมกันได้"
+    )
+    backlog_parser.add_argument("--batch-size", type=int, default=BACKLOG_BATCH_SIZE)
+    backlog_parser.add_argument("--lease-seconds", type=int, default=BACKLOG_LEASE_SECONDS)
+    backlog_parser.add_argument("--processes", type=int, default=BACKLOG_SCORING_PROCESSES,
+                                help="จำนวน process ที่ให้คะแนน (0 = ใน process หลัก)")
+    backlog_parser.add_argument("--idle-seconds", type=float, default=BACKLOG_IDLE_SECONDS)
+    backlog_parser.add_argument("--max-batches", type=int, help="หยุดหลังประมวลผลครบจำนวนรอบนี้")
+    backlog_parser.add_argument("--once", action="store_true", help="หยุดเมื่อไม่มีข้อความค้าง")
+    backlog_parser.set_defaults(func=process_backlog)
+
+    pipeline_parser = subparsers.add_parser(
+        "process-pipeline",
+        help="ประมวลผลข้อความค้างหนึ่งรอบผ่าน pipeline แบบ stream พร้อมสถิติแต่ละขั้นตอน"
+    )
+    pipeline_parser.add_argument("--limit", type=int, default=BATCH_PROCESSING_LIMIT)
+    pipeline_parser.set_defaults(func=process_pipeline)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+# circuit breaker สำหรับ model server
+# - closed: เรียกได้ตามปกติ เก็บผล (สำเร็จ/ล้มเหลว และ latency) ของ request ล่าสุดไว้ในหน้าต่างขนาดคงที่
+# - open: เมื่อ error rate หรือ p95 latency ในหน้าต่างเกินเกณฑ์ ปฏิเสธทุก request ทันที (ไม่ต้องรอ timeout)
+# - half_open: หลังเปิดครบเวลาที่กำหนด ปล่อย request ทดสอบ (probe) จำนวนจำกัด
+#   probe สำเร็จและไม่ช้าเกินเกณฑ์ -> closed, ล้มเหลว -> open อีกรอบ
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+import numpy as np
+import requests
+from utils.config import (
+    MODEL_BREAKER_WINDOW, MODEL_BREAKER_MIN_REQUESTS, MODEL_BREAKER_ERROR_RATE,
+    MODEL_BREAKER_OPEN_SECONDS, MODEL_BREAKER_HALF_OPEN_PROBES
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ถูกปฏิเสธเพราะ circuit breaker เปิดอยู่ (model server ล่มหรือช้าเกินไป)"""
+
+class CircuitBreaker:
+    """circuit breaker ของบริการหนึ่ง (thread-safe)"""
+
+    def __init__(self, name: str, p95_threshold_ms: float,
+                 error_rate_threshold: float = MODEL_BREAKER_ERROR_RATE,
+                 window: int = MODEL_BREAKER_WINDOW, min_requests: int = MODEL_BREAKER_MIN_REQUESTS,
+                 open_seconds: float = MODEL_BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = MODEL_BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.p95_threshold_ms = p95_threshold_ms
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        # (สำเร็จหรือไม่, latency ms) ของ request ล่าสุดขณะ closed
+        self._outcomes: deque = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._reason: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.trips = 0
+        self.rejected = 0
+
+    def _refresh_state(self, now: float):
+        """open -> half_open เมื่อครบเวลา (เรียกขณะถือ lock)"""
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+
+    def available(self) -> bool:
+        """
+        เรียกได้หรือไม่ (ไม่จอง slot ของ probe) ใช้ให้ผู้เรียกเลือกทางสำรองโดยไม่ต้องลอง
+        ผลเป็น False นับเป็นการปฏิเสธหนึ่งครั้ง
+        """
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == OPEN:
+                self.rejected += 1
+                return False
+            return True
+
+    def allow(self) -> bool:
+        """
+        ขออนุญาตเรียก 1 request ถ้าได้รับอนุญาตต้องเรียก record() เมื่อจบ
+        ขณะ half_open อนุญาตเฉพาะ probe ที่ยังไม่เกินจำนวนที่กำหนด
+        """
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool, latency_ms: float):
+        """บันทึกผลของ request ที่ได้รับอนุญาตแล้ว"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if success and latency_ms <= self.p95_threshold_ms:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    self._reason = None
+                else:
+                    self._trip(time.monotonic(), "probe ล้มเหลว" if not success else "probe ช้าเกินเกณฑ์")
+                return
+
+            if self._state == OPEN:
+                # request ที่เริ่มก่อน breaker เปิด ไม่มีผลต่อสถานะ
+                return
+
+            self._outcomes.append((success, latency_ms))
+            if len(self._outcomes) < self.min_requests:
+                return
+
+            error_rate = 1 - sum(ok for ok, _ in self._outcomes) / len(self._outcomes)
+            p95_ms = float(np.percentile([ms for _, ms in self._outcomes], 95))
+            if error_rate >= self.error_rate_threshold:
+                self._trip(time.monotonic(), f"error rate {error_rate:.0%}")
+            elif p95_ms > self.p95_threshold_ms:
+                self._trip(time.monotonic(), f"p95 latency {p95_ms:,.0f} ms")
+
+    def _trip(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._reason = reason
+        self.trips += 1
+        print(f"⚠️ Circuit breaker '{self.name}' เปิด: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        """สถานะปัจจุบันและสถิติในหน้าต่างล่าสุด"""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            outcomes = list(self._outcomes)
+            return {
+                'state': self._state,
+                'reason': self._reason,
+                'retry_in_seconds': max(0.0, self.open_seconds - (now - self._opened_at)) if self._state == OPEN else 0.0,
+                'window_requests': len(outcomes),
+                'error_rate': 1 - sum(ok for ok, _ in outcomes) / len(outcomes) if outcomes else 0.0,
+                'p95_ms': float(np.percentile([ms for _, ms in outcomes], 95)) if outcomes else 0.0,
+                'p95_threshold_ms': self.p95_threshold_ms,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
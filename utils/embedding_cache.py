@@ -0,0 +1,131 @@
+# แคช embedding แบบสองชั้น
+#   ชั้นที่ 1 - LRU ในหน่วยความจำของ process (จำกัดจำนวนรายการ)
+#   ชั้นที่ 2 - ตาราง embedding_cache ใน TiDB (ใช้ร่วมกันทุก process และคงอยู่หลัง restart)
+# key คือ SHA-256 ของชื่อ model และข้อความที่ normalize แล้ว
+# ข้อความเดียวกันจาก model เดียวกันจึงเรียก embedding API เพียงครั้งเดียวภายในช่วง TTL
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from utils.config import EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_SIZE
+from utils.vector_codec import encode_vector, decode_vector
+
+def normalize_text(text: str) -> str:
+    """normalize ข้อความก่อนสร้าง key (Unicode NFC และยุบช่องว่างที่ซ้ำกัน)"""
+    text = unicodedata.normalize('NFC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+def make_cache_key(model: str, text: str) -> str:
+    """สร้าง key ของแคชจาก model และข้อความ"""
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """แคช embedding แบบ LRU ในหน่วยความจำ + ตารางในฐานข้อมูล พร้อมตัวนับ hit/miss"""
+
+    def __init__(self, db_manager=None, max_size: int = EMBEDDING_CACHE_SIZE,
+                 ttl: int = EMBEDDING_CACHE_TTL):
+        self.db_manager = db_manager
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, np.ndarray]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """ดึง embedding จากแคช (หน่วยความจำก่อน แล้วจึงฐานข้อมูล) คืนค่า None ถ้าไม่พบหรือหมดอายุ"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """ดึง embedding หลาย key พร้อมกัน (ชั้นฐานข้อมูลใช้ query เดียว) คืนค่าเฉพาะ key ที่พบ"""
+        found: Dict[str, np.ndarray] = {}
+        missing = []
+        now = time.monotonic()
+
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, vector = entry
+                    if expires_at > now:
+                        self._entries.move_to_end(key)
+                        found[key] = vector
+                        continue
+                    del self._entries[key]
+                missing.append(key)
+            self.memory_hits += len(found)
+
+        persistent = self._get_persistent(missing)
+        for key, vector in persistent.items():
+            self._put_memory(key, vector)
+        found.update(persistent)
+
+        with self._lock:
+            self.persistent_hits += len(persistent)
+            self.misses += len(missing) - len(persistent)
+        return found
+
+    def put(self, key: str, model: str, embedding: List[float]):
+        """เก็บ embedding ลงแคชทั้งสองชั้น"""
+        self.put_many({key: embedding}, model)
+
+    def put_many(self, embeddings: Dict[str, List[float]], model: str):
+        """เก็บ embedding หลายรายการลงแคชทั้งสองชั้น (ชั้นฐานข้อมูลเขียนครั้งเดียว)"""
+        if not embeddings:
+            return
+
+        blobs = {}
+        for key, embedding in embeddings.items():
+            vector = np.asarray(embedding, dtype=np.float32)
+            self._put_memory(key, vector)
+            blobs[key] = encode_vector(vector)
+
+        if self.db_manager is not None:
+            self.db_manager.cache_embeddings(blobs, model, self.ttl)
+
+    def _put_memory(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_persistent(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self.db_manager is None or not keys:
+            return {}
+
+        vectors = {}
+        for key, blob in self.db_manager.get_cached_embeddings(keys).items():
+            try:
+                vector = decode_vector(blob)
+            except ValueError:
+                continue
+            if vector is not None:
+                vectors[key] = vector
+        return vectors
+
+    def clear(self):
+        """ล้างแคชในหน่วยความจำ (ไม่ลบข้อมูลในฐานข้อมูล)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """สถิติการใช้งานแคช"""
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            hits = self.memory_hits + self.persistent_hits
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'memory_hits': self.memory_hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+            }
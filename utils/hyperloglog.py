@@ -0,0 +1,83 @@
+# HyperLogLog sketch สำหรับนับจำนวนค่าไม่ซ้ำแบบประมาณ
+# ใช้ใน daily_metrics เพื่อรวม (merge) จำนวนลูกค้า/การสนทนาไม่ซ้ำข้ามหลายวันได้
+# โดยไม่ต้องย้อนกลับไป scan ตาราง conversations
+
+import hashlib
+import math
+from typing import Iterable, Optional
+import numpy as np
+from utils.config import HLL_PRECISION
+
+class HyperLogLog:
+    """HyperLogLog sketch ขนาด 2^precision bytes (precision 11 = 2 KB, error ~2.3%)"""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.num_registers = 1 << precision
+
+        if registers is not None and len(registers) != self.num_registers:
+            raise ValueError(f"HyperLogLog registers ต้องมีขนาด {self.num_registers} bytes")
+
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.num_registers)
+
+    def add(self, value: str):
+        """เพิ่มค่าลงใน sketch"""
+        hashed = int.from_bytes(hashlib.sha1(str(value).encode('utf-8')).digest()[:8], 'big')
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # ตำแหน่งของ bit 1 แรก (นับจากซ้าย) ในส่วนที่เหลือ
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]):
+        """เพิ่มหลายค่าลงใน sketch"""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """รวม sketch อื่นเข้ามา (ผลลัพธ์เท่ากับ sketch ของ union)"""
+        if other.precision != self.precision:
+            raise ValueError("ไม่สามารถรวม HyperLogLog ที่ precision ต่างกันได้")
+
+        merged = np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers, dtype=np.uint8)
+        )
+        self.registers = bytearray(merged.tobytes())
+        return self
+
+    def count(self) -> int:
+        """ประมาณจำนวนค่าไม่ซ้ำ"""
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+
+        # ช่วงค่าน้อยใช้ linear counting ซึ่งแม่นยำกว่า
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        """แปลงเป็น bytes สำหรับเก็บในฐานข้อมูล"""
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes], precision: int = HLL_PRECISION) -> 'HyperLogLog':
+        """สร้าง sketch จาก bytes ที่เก็บไว้ (None หรือค่าว่าง = sketch ว่าง)"""
+        if not data:
+            return cls(precision)
+        return cls(precision, bytes(data))
+
+    @classmethod
+    def union_count(cls, sketches: Iterable[Optional[bytes]], precision: int = HLL_PRECISION) -> int:
+        """นับจำนวนค่าไม่ซ้ำของ union ของหลาย sketch ที่เก็บเป็น bytes"""
+        merged = np.zeros(1 << precision, dtype=np.uint8)
+        for data in sketches:
+            if data:
+                np.maximum(merged, np.frombuffer(bytes(data), dtype=np.uint8), out=merged)
+        return cls(precision, merged.tobytes()).count()
@@ -0,0 +1,139 @@
+# ค้นหาคำสำคัญหลายชุดในข้อความด้วยการสแกนครั้งเดียว
+# - คำสำคัญทุกชุดถูกรวมเป็น regex รูปแบบ trie (คำที่มี prefix ร่วมกันใช้กิ่งเดียวกัน) คอมไพล์ครั้งเดียว
+# - ที่แต่ละตำแหน่งของข้อความ regex คืนคำสำคัญที่ยาวที่สุดที่เริ่มตรงนั้น
+#   คำสำคัญอื่นที่เริ่มตำแหน่งเดียวกันต้องเป็น prefix ของคำนั้น จึงเปิดดูจากตารางที่คำนวณไว้ได้ทันที
+# - ผลเท่ากับ sum(1 for keyword in keywords if keyword in text) ของแต่ละชุด (นับคำที่พบ ไม่นับจำนวนครั้ง)
+# - ถ้าส่ง tokenizer มา จะเทียบทั้งคำแทน substring: ข้อความและคำสำคัญถูกตัดคำแล้วต่อด้วยช่องว่าง
+#   (" ไม่ ดี ") คำสำคัญจึงพบเฉพาะเมื่อตรงกับลำดับคำในข้อความพอดี เช่น 'รับ' ไม่ถูกนับใน 'ครับ'
+# - count_matrix นับข้อความจำนวนมากพร้อมกัน: ต่อข้อความทั้ง batch ด้วยตัวคั่นแล้วสแกนด้วย regex ครั้งเดียว
+#   จากนั้นแปลงผลเป็นจำนวนต่อหมวดด้วย numpy (ไม่มีลูป Python ต่อข้อความหรือต่อคำสำคัญ)
+
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+import numpy as np
+
+# ตัวคั่นข้อความใน count_matrix (ไม่มีในคำสำคัญ จึงไม่มีคำใดถูกจับคร่อมสองข้อความ)
+_SEPARATOR = '\x00'
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """สร้าง regex จาก trie ของคำ (greedy จึงได้คำที่ยาวที่สุดก่อน)"""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if '' in node else body
+
+    return build(trie)
+
+class KeywordMatcher:
+    """ตัวค้นหาคำสำคัญของหลายหมวด (เช่น positive/negative/หัวข้อ) ที่คอมไพล์ไว้ล่วงหน้า"""
+
+    def __init__(self, categories: Dict[str, Iterable[str]],
+                 tokenizer: Optional[Callable[[str], List[str]]] = None):
+        self.categories: Dict[str, List[str]] = {name: list(keywords) for name, keywords in categories.items()}
+        self.tokenizer = tokenizer
+
+        # คำสำคัญ (รูปที่ใช้สแกน) -> หมวดที่มีคำนี้ (ซ้ำได้ถ้าหมวดเดียวกันมีคำซ้ำ เพื่อให้นับเท่ากับวนลูปเดิม)
+        self._keyword_categories: Dict[str, List[str]] = {}
+        # รูปที่ใช้สแกน -> คำสำคัญตามที่กำหนด
+        self._keywords: Dict[str, str] = {}
+        for name, keywords in self.categories.items():
+            for keyword in keywords:
+                key = self.prepare(keyword) if keyword else ''
+                if key.strip():
+                    self._keyword_categories.setdefault(key, []).append(name)
+                    self._keywords.setdefault(key, keyword)
+
+        keywords = sorted(self._keyword_categories)
+        # คำที่ยาวที่สุด ณ ตำแหน่งหนึ่ง -> ทุกคำสำคัญที่เป็น prefix ของคำนั้น (รวมตัวเอง)
+        self._prefixes: Dict[str, tuple] = {
+            keyword: tuple(other for other in keywords if keyword.startswith(other))
+            for keyword in keywords
+        }
+        # ตรวจตัวอักษรแรกด้วย character class ก่อน ตำแหน่งที่ไม่มีคำสำคัญเริ่มจึงไม่ต้องเข้า trie
+        first_chars = re.escape(''.join(sorted({keyword[0] for keyword in keywords})))
+        self._pattern = re.compile(f"(?=[{first_chars}])(?=({_trie_pattern(keywords)}))") if keywords else None
+        # แบบ batch: ตัวคั่นถูกจับเป็นสตริงว่าง ใช้นับว่าคำสำคัญที่ตามมาอยู่ในข้อความลำดับที่เท่าไร
+        self._batch_pattern = (
+            re.compile(f"(?=[{first_chars}])(?=({_trie_pattern(keywords)}))|{_SEPARATOR}") if keywords else None
+        )
+
+        # ตารางสำหรับ count_matrix: รหัสคำสำคัญ, prefix ของแต่ละคำแบบ CSR และ (คำสำคัญ x หมวด)
+        self._keyword_ids = {keyword: i for i, keyword in enumerate(keywords)}
+        prefix_ids = [[self._keyword_ids[other] for other in self._prefixes[keyword]] for keyword in keywords]
+        self._prefix_lengths = np.array([len(ids) for ids in prefix_ids], dtype=np.int64)
+        self._prefix_starts = np.cumsum(self._prefix_lengths) - self._prefix_lengths
+        self._prefix_ids = np.array([i for ids in prefix_ids for i in ids], dtype=np.int64)
+        column = {name: i for i, name in enumerate(self.categories)}
+        self._keyword_matrix = np.zeros((len(keywords), len(column)), dtype=np.float32)
+        for keyword, names in self._keyword_categories.items():
+            for name in names:
+                self._keyword_matrix[self._keyword_ids[keyword], column[name]] += 1
+
+    def prepare(self, text: str) -> str:
+        """ข้อความในรูปที่ใช้สแกน (ไม่มี tokenizer = ข้อความเดิม, มี tokenizer = คำที่ตัดแล้วคั่นด้วยช่องว่าง)"""
+        if self.tokenizer is None:
+            return text
+        return f" {' '.join(self.tokenizer(text))} "
+
+    def _find_keys(self, text: str) -> Set[str]:
+        if self._pattern is None or not text:
+            return set()
+
+        found: Set[str] = set()
+        for longest in set(self._pattern.findall(self.prepare(text))):
+            found.update(self._prefixes[longest])
+        return found
+
+    def find(self, text: str) -> Set[str]:
+        """คำสำคัญทั้งหมดที่ปรากฏในข้อความ (substring ตรงตัว หรือลำดับคำตรงกันถ้ามี tokenizer)"""
+        return {self._keywords[key] for key in self._find_keys(text)}
+
+    def count(self, text: str) -> Dict[str, int]:
+        """จำนวนคำสำคัญที่พบของแต่ละหมวด (หมวดที่ไม่พบเลยไม่อยู่ในผล)"""
+        counts: Dict[str, int] = {}
+        for keyword in self._find_keys(text):
+            for name in self._keyword_categories[keyword]:
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def count_matrix(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        จำนวนคำสำคัญของแต่ละหมวดสำหรับข้อความจำนวนมาก (ข้อความต้อง lower มาแล้วเหมือน count())
+        คืนค่า array ขนาด (จำนวนข้อความ, จำนวนหมวด) เรียงหมวดตาม self.categories
+        ผลเท่ากับ count() ทีละข้อความ ใช้หน่วยความจำราว จำนวนข้อความ x จำนวนคำสำคัญ ไบต์ ผู้เรียกควรแบ่ง chunk
+        """
+        texts = [self.prepare(text or '') for text in texts]
+        counts = np.zeros((len(texts), len(self.categories)), dtype=np.int32)
+        if self._batch_pattern is None or not texts:
+            return counts
+
+        joined = _SEPARATOR.join(texts)
+        if joined.count(_SEPARATOR) != len(texts) - 1:
+            joined = _SEPARATOR.join(text.replace(_SEPARATOR, '') for text in texts)
+
+        # สตริงว่าง = ตัวคั่น (-1), อย่างอื่น = คำสำคัญที่ยาวที่สุด ณ ตำแหน่งนั้น
+        codes = np.array([self._keyword_ids.get(hit, -1) for hit in self._batch_pattern.findall(joined)],
+                         dtype=np.int64)
+        rows = np.cumsum(codes < 0)
+        is_keyword = codes >= 0
+        rows, longest = rows[is_keyword], codes[is_keyword]
+
+        # ขยายคำที่ยาวที่สุดเป็นทุกคำสำคัญที่เป็น prefix ของมัน
+        lengths = self._prefix_lengths[longest]
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        keyword_ids = self._prefix_ids[np.repeat(self._prefix_starts[longest], lengths) + offsets]
+
+        # นับคำที่พบ ไม่นับจำนวนครั้ง: ตาราง (ข้อความ x คำสำคัญ) แบบมี/ไม่มี แล้วคูณกับตารางหมวด
+        present = np.zeros((len(texts), len(self._keyword_ids)), dtype=np.float32)
+        present[np.repeat(rows, lengths), keyword_ids] = 1
+        counts[:] = present @ self._keyword_matrix
+        return counts
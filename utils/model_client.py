@@ -0,0 +1,271 @@
+# HTTP client กลางสำหรับเรียก model server (Ollama) ใช้ร่วมกันระหว่าง ChatBot และ ChatAnalyzer
+# - requests.Session เดียวต่อ process พร้อม connection pool แบบ keep-alive (ไม่ต้อง handshake ใหม่ทุก request)
+# - ลองใหม่แบบ backoff เมื่อเชื่อมต่อไม่ได้หรือ server ตอบ 429/502/503/504 (ไม่ลองใหม่เมื่ออ่านผลหมดเวลา)
+# - timeout ตาม endpoint และเก็บสถิติ latency ของแต่ละ endpoint
+# - AsyncModelClient สำหรับเรียกจาก asyncio โดยย้ายงานไปทำใน thread pool แยกตาม model
+# - circuit breaker แยก embedding/chat: เมื่อ server ล่มหรือช้า ปฏิเสธทันทีแทนการรอ timeout (CircuitOpenError)
+# - slot(model) จำกัดจำนวน HTTP request พร้อมกันต่อ model ทั้ง process (รวมทุกทางที่เรียก ไม่ว่า sync หรือ async)
+# - post_shared รวม request ที่เหมือนกันซึ่งกำลังทำงานพร้อมกันให้เรียก server ครั้งเดียว (single-flight)
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.config import (
+    EMBEDDING_API_TIMEOUT, CHAT_API_TIMEOUT, MODEL_HTTP_POOL_SIZE, MODEL_HTTP_RETRIES,
+    MODEL_HTTP_BACKOFF, MODEL_LATENCY_SAMPLES, MODEL_CONCURRENCY_LIMITS, DEFAULT_MODEL_CONCURRENCY,
+    MODEL_BREAKER_P95_MS, ASYNC_MODEL_WORKERS
+)
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.single_flight import SingleFlight, request_key
+
+# timeout เริ่มต้นของแต่ละ endpoint (วินาที)
+ENDPOINT_TIMEOUTS = {
+    'embedding': EMBEDDING_API_TIMEOUT,
+    'embedding_batch': EMBEDDING_API_TIMEOUT,
+    'chat': CHAT_API_TIMEOUT,
+    'chat_stream': CHAT_API_TIMEOUT,  # เวลารอระหว่าง token (latency ที่วัดได้คือเวลาถึง response แรก)
+}
+
+# circuit breaker ที่แต่ละ endpoint ใช้ (endpoint ของ model เดียวกันล่มพร้อมกัน)
+ENDPOINT_BREAKERS = {
+    'embedding': 'embedding',
+    'embedding_batch': 'embedding',
+    'chat': 'chat',
+    'chat_stream': 'chat',
+}
+
+class ModelClient:
+    """client สำหรับเรียก model server ผ่าน session ที่ใช้ connection ซ้ำได้"""
+
+    def __init__(self, pool_size: int = MODEL_HTTP_POOL_SIZE, retries: int = MODEL_HTTP_RETRIES,
+                 backoff: float = MODEL_HTTP_BACKOFF):
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.single_flight = SingleFlight()
+        self.breakers = {name: CircuitBreaker(name, p95_ms) for name, p95_ms in MODEL_BREAKER_P95_MS.items()}
+        self._latencies: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._fan_out_pools: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    def post(self, endpoint: str, url: str, payload: Dict[str, Any],
+             timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        ส่ง POST แบบ JSON ไปยัง model server
+        endpoint คือชื่อที่ใช้เลือก timeout เริ่มต้นและเก็บสถิติ ('embedding', 'embedding_batch', 'chat', 'chat_stream')
+        raise CircuitOpenError ทันทีถ้า circuit breaker ของ endpoint เปิดอยู่
+        """
+        if timeout is None:
+            timeout = ENDPOINT_TIMEOUTS.get(endpoint, CHAT_API_TIMEOUT)
+
+        breaker = self.breakers.get(ENDPOINT_BREAKERS.get(endpoint))
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} model ไม่พร้อมใช้งานชั่วคราว (circuit breaker เปิดอยู่)")
+
+        started = time.perf_counter()
+        failed = True
+        server_error = True
+        try:
+            response = self.session.post(url, json=payload, timeout=timeout, **kwargs)
+            failed = response.status_code >= 400
+            server_error = response.status_code == 429 or response.status_code >= 500
+            return response
+        finally:
+            seconds = time.perf_counter() - started
+            self._record(endpoint, seconds, failed)
+            if breaker is not None:
+                breaker.record(not server_error, seconds * 1000)
+
+    def slot(self, model: str) -> threading.BoundedSemaphore:
+        """
+        semaphore ของ model ที่ใช้ร่วมกันทั้ง process (ขนาดตาม MODEL_CONCURRENCY_LIMITS)
+        ถือไว้เฉพาะช่วงที่ส่ง HTTP request จริง ห้ามถือซ้อนกันใน thread เดียว
+        """
+        with self._lock:
+            semaphore = self._slots.get(model)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(MODEL_CONCURRENCY_LIMITS.get(model, DEFAULT_MODEL_CONCURRENCY))
+                self._slots[model] = semaphore
+            return semaphore
+
+    def fan_out(self, model: str, func: Callable[[Any], Any], items: Sequence[Any]) -> List[Any]:
+        """
+        เรียก func กับแต่ละ item พร้อมกันใน thread pool ของ model ที่ใช้ร่วมกันทั้ง process (ผลเรียงตามลำดับเดิม)
+        ผู้เรียกหลายรายพร้อมกันจึงไม่สร้าง pool ซ้อนเพิ่ม ส่วน func ต้องถือ slot(model) ระหว่างส่ง request เอง
+        """
+        with self._lock:
+            pool = self._fan_out_pools.get(model)
+            if pool is None:
+                pool = ThreadPoolExecutor(
+                    max_workers=MODEL_CONCURRENCY_LIMITS.get(model, DEFAULT_MODEL_CONCURRENCY),
+                    thread_name_prefix=f"fan-out-{model}"
+                )
+                self._fan_out_pools[model] = pool
+        return list(pool.map(func, items))
+
+    def available(self, endpoint: str) -> bool:
+        """endpoint เรียกได้หรือไม่ (False เมื่อ circuit breaker เปิดอยู่) ใช้เลือกทางสำรองก่อนเรียก"""
+        breaker = self.breakers.get(ENDPOINT_BREAKERS.get(endpoint))
+        return breaker is None or breaker.available()
+
+    def breaker_stats(self) -> Dict[str, Dict[str, Any]]:
+        """สถานะ circuit breaker ของแต่ละบริการ"""
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+
+    def post_shared(self, endpoint: str, url: str, payload: Dict[str, Any],
+                    timeout: Optional[float] = None) -> requests.Response:
+        """
+        post แบบ single-flight: request ที่ url และ payload (model, prompt, options) เหมือนกัน
+        และทำงานพร้อมกันจะเรียก server ครั้งเดียว แล้วได้ response เดียวกัน (ใช้กับ request ที่ไม่ใช่ stream)
+        """
+        return self.single_flight.do(
+            request_key(endpoint, url, payload),
+            self.post, endpoint, url, payload, timeout
+        )
+
+    def _record(self, endpoint: str, seconds: float, failed: bool):
+        with self._lock:
+            samples = self._latencies.setdefault(endpoint, deque(maxlen=MODEL_LATENCY_SAMPLES))
+            samples.append(seconds)
+            counters = self._counters.setdefault(endpoint, {'requests': 0, 'errors': 0})
+            counters['requests'] += 1
+            if failed:
+                counters['errors'] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """สถิติของแต่ละ endpoint: จำนวน request, error และ latency (ms) จากผลวัดล่าสุด"""
+        with self._lock:
+            snapshot = {
+                endpoint: (dict(self._counters[endpoint]), np.array(samples) * 1000)
+                for endpoint, samples in self._latencies.items()
+            }
+
+        stats = {}
+        for endpoint, (counters, latencies) in snapshot.items():
+            stats[endpoint] = {
+                **counters,
+                'avg_ms': float(latencies.mean()),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'max_ms': float(latencies.max()),
+            }
+        return stats
+
+_client: Optional[ModelClient] = None
+_client_lock = threading.Lock()
+
+def get_model_client() -> ModelClient:
+    """คืนค่า ModelClient ที่ใช้ร่วมกันทั้ง process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ModelClient()
+    return _client
+
+class AsyncModelClient:
+    """
+    เรียกงานของ model แบบ asyncio โดยไม่ block event loop
+    - งานแต่ละ model ทำใน thread pool ของตัวเอง งาน embedding ที่ค้างจำนวนมากจึงไม่แย่ง thread ของ chat
+    - pool ไม่ได้จำกัดจำนวน request เอง: งานที่เรียก model ถือ ModelClient.slot ระหว่างส่ง request
+      (slot เดียวกับทางที่เรียกแบบ sync) จึงไม่ต้องถือ slot ซ้อนที่นี่
+    """
+
+    def __init__(self, workers: int = ASYNC_MODEL_WORKERS):
+        self.workers = workers
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self, model: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._executors.get(model)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix=f"model-{model}"
+                )
+                self._executors[model] = executor
+            return executor
+
+    async def run(self, model: str, func: Callable, *args, **kwargs) -> Any:
+        """เรียก func(*args, **kwargs) ใน thread pool ของ model แล้วรอผล"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(model), lambda: func(*args, **kwargs))
+
+    async def iterate(self, model: str, func: Callable[..., Iterator], *args, **kwargs) -> AsyncIterator:
+        """
+        วน generator func(*args, **kwargs) ใน thread pool ของ model แล้วส่งแต่ละค่าออกมาแบบ async
+        ถ้าผู้เรียกหยุดกลางทาง generator จะถูกปิด (ปิด HTTP stream ด้วย)
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        stopped = threading.Event()
+
+        def publish(item, error=None):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                # event loop ปิดไปแล้ว
+                stopped.set()
+
+        def produce():
+            generator = func(*args, **kwargs)
+            try:
+                for item in generator:
+                    if stopped.is_set():
+                        break
+                    publish(item)
+            except Exception as e:
+                publish(finished, e)
+                return
+            finally:
+                generator.close()
+            publish(finished)
+
+        future = loop.run_in_executor(self._executor(model), produce)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is finished:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+        finally:
+            stopped.set()
+            if future.done():
+                future.result()
+
+_async_client: Optional[AsyncModelClient] = None
+
+def get_async_model_client() -> AsyncModelClient:
+    """คืนค่า AsyncModelClient ที่ใช้ร่วมกันทั้ง process"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = AsyncModelClient()
+    return _async_client
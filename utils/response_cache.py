@@ -0,0 +1,122 @@
+# แคชคำตอบของ chatbot ตามความหมายของคำถาม
+# - คำถามที่ embedding คล้ายกันเกิน threshold และถามบน context เดียวกัน (fingerprint ตรงกัน) ใช้คำตอบเดิม
+# - fingerprint มาจาก context ที่ส่งให้ model เมื่อมีการสนทนาใหม่ context เปลี่ยน คำตอบเดิมจึงไม่ถูกใช้อีก
+# - คำถามที่ข้อความตรงกัน (หลัง normalize) ไม่ต้องสร้าง embedding
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from utils.config import ANALYTICS_CACHE_TTL, RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_SIZE
+from utils.embedding_cache import normalize_text
+
+def context_fingerprint(*parts: str) -> str:
+    """สร้าง fingerprint ของ context (model, system prompt, ข้อมูลการสนทนา ฯลฯ)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+class SemanticResponseCache:
+    """แคชคำตอบแบบ LRU จับคู่ด้วย cosine similarity ของคำถามภายใน fingerprint เดียวกัน"""
+
+    def __init__(self, embed: Optional[Callable[[str], Optional[List[float]]]] = None,
+                 threshold: float = RESPONSE_CACHE_SIMILARITY, ttl: int = ANALYTICS_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_SIZE):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (fingerprint, คำถามที่ normalize แล้ว) -> (หมดอายุ, vector ของคำถาม, คำตอบ)
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[float, Optional[np.ndarray], str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _question_vector(self, question: str) -> Optional[np.ndarray]:
+        if self.embed is None:
+            return None
+
+        embedding = self.embed(question)
+        if not embedding:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def lookup(self, question: str, fingerprint: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        หาคำตอบที่แคชไว้ คืนค่า (คำตอบ หรือ None, vector ของคำถาม)
+        vector ที่ได้ส่งต่อให้ store() ได้เลยโดยไม่ต้องสร้าง embedding ซ้ำ
+        """
+        key = (fingerprint, normalize_text(question))
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[2], entry[1]
+
+        vector = self._question_vector(question)
+        if vector is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        with self._lock:
+            best_key = None
+            best_score = self.threshold
+            for entry_key, (_, entry_vector, _) in self._entries.items():
+                if entry_key[0] != fingerprint or entry_vector is None or len(entry_vector) != len(vector):
+                    continue
+                score = float(entry_vector @ vector)
+                if score >= best_score:
+                    best_key, best_score = entry_key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None, vector
+
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return self._entries[best_key][2], vector
+
+    def store(self, question: str, fingerprint: str, response: str,
+              vector: Optional[np.ndarray] = None):
+        """เก็บคำตอบของคำถามภายใต้ fingerprint ของ context"""
+        key = (fingerprint, normalize_text(question))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _evict_expired(self, now: float):
+        expired = [key for key, (expires_at, _, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def invalidate(self):
+        """ล้างคำตอบที่แคชไว้ทั้งหมด"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """สถิติการใช้งานแคช"""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,164 @@
+# รวม request ที่เหมือนกันและกำลังทำงานอยู่พร้อมกันให้เรียก upstream เพียงครั้งเดียว (single-flight)
+# - request แรกของ key เป็นผู้เรียกจริง (leader) request อื่นที่มาระหว่างนั้นรอผลเดียวกัน
+# - ไม่ใช่แคช: เมื่อ request ของ leader จบ key จะถูกลบทันที request ถัดไปเรียกใหม่
+# - ผลลัพธ์แบบ stream ถูกส่งต่อให้ทุกผู้รอทีละส่วนทันทีที่ leader ได้รับ
+
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+def request_key(*parts: Any) -> str:
+    """สร้าง key จากส่วนประกอบของ request (เช่น endpoint, url, payload ที่มีชื่อ model และ prompt)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True, ensure_ascii=False, default=str)
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+class _Call:
+    """request ที่กำลังทำงาน (ผลแบบค่าเดียว)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class _StreamCall:
+    """request ที่กำลังทำงาน (ผลแบบ stream)"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+class SingleFlight:
+    """ตัวรวม request ที่ซ้ำกันภายใน process (thread-safe)"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamCall] = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        เรียก func(*args, **kwargs) ถ้ายังไม่มี request ของ key นี้ทำงานอยู่
+        ถ้ามีอยู่แล้ว รอและคืนค่าผลเดียวกัน (exception ของ leader ถูก raise ให้ทุกคน)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key: str, func: Callable[..., Iterator], *args, **kwargs) -> Iterator:
+        """
+        วน generator func(*args, **kwargs) โดยมีเพียง leader ที่เรียก func จริง
+        ผู้รอได้ทุกส่วนตั้งแต่ต้น (รวมส่วนที่ leader ได้ไปก่อนแล้ว) และส่วนใหม่ทันทีที่มาถึง
+        ถ้าผู้เรียกของ leader หยุดกลางทางขณะที่ยังมีผู้รอ leader จะอ่านต่อจนจบเพื่อผู้รอ
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall()
+                self._streams[key] = call
+                self.leaders += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if leader:
+            return self._lead_stream(key, call, func(*args, **kwargs))
+        return self._follow_stream(call)
+
+    def _lead_stream(self, key: str, call: _StreamCall, generator: Iterator) -> Iterator:
+        def publish(chunk):
+            with call.condition:
+                call.chunks.append(chunk)
+                call.condition.notify_all()
+
+        try:
+            for chunk in generator:
+                publish(chunk)
+                try:
+                    yield chunk
+                except GeneratorExit:
+                    with self._lock:
+                        has_followers = call.followers > 0
+                        if not has_followers:
+                            # ไม่มีผู้รอ: ปิดทันที request ใหม่ของ key นี้จะเป็น leader ใหม่
+                            del self._streams[key]
+                    if has_followers:
+                        for chunk in generator:
+                            publish(chunk)
+                    raise
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            if hasattr(generator, 'close'):
+                generator.close()
+            with self._lock:
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            with call.condition:
+                call.finished = True
+                call.condition.notify_all()
+
+    def _follow_stream(self, call: _StreamCall) -> Iterator:
+        index = 0
+        while True:
+            with call.condition:
+                while index >= len(call.chunks) and not call.finished:
+                    call.condition.wait()
+                chunks = call.chunks[index:]
+                finished = call.finished
+            index += len(chunks)
+            yield from chunks
+
+            if finished and index >= len(call.chunks):
+                if call.error is not None:
+                    raise call.error
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """จำนวน request ที่เรียก upstream จริง และจำนวนที่ได้ผลร่วมกับ request อื่น"""
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                'in_flight': len(self._calls) + len(self._streams),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesced_rate': self.coalesced / total if total else 0.0,
+            }
@@ -0,0 +1,135 @@
+# ตัดคำภาษาไทยแบบ maximal matching ด้วยพจนานุกรมในตัว (ไม่ต้องติดตั้ง library เพิ่ม)
+# - พจนานุกรม (thai_words.txt) ถูกคอมไพล์เป็นตาราง prefix ครั้งแรกที่ใช้ และใช้ร่วมกันทั้ง process
+# - แต่ละช่วงอักษรไทยเลือกการตัดที่มีอักษรนอกพจนานุกรมน้อยที่สุด แล้วจึงจำนวนคำน้อยที่สุด
+# - ไม่ตัดกลางพยางค์: คำไม่เริ่มที่สระบน/ล่าง สระหลัง วรรณยุกต์ หรือถัดจากสระหน้า (เ แ โ ใ ไ)
+# - อักษรละติน/ตัวเลขเป็นคำละหนึ่ง token (ตัวเล็ก) ช่องว่าง เครื่องหมาย และ emoji ถูกข้าม
+# - ผลตัดคำของแต่ละช่วงอักษรไทยถูกแคชไว้ เพราะข้อความแชทซ้ำกันมาก
+
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.config import THAI_SEGMENT_CACHE_SIZE
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thai_words.txt')
+
+_RUN_PATTERN = re.compile(r'[ก-๛]+|[a-z0-9]+')
+# สระบน/ล่าง สระหลัง วรรณยุกต์ และเครื่องหมายที่ต้องตามพยัญชนะ (เริ่มคำไม่ได้)
+_NON_INITIAL = frozenset('ะัาำิีึืฺุู'
+                         'ๅ็่้๊๋์ํ๎')
+# สระหน้า (ต้องมีพยัญชนะตามเสมอ คำจึงจบหลังสระหน้าไม่ได้)
+_LEADING_VOWELS = frozenset('เแโใไ')
+
+def load_dictionary(path: str = DICTIONARY_PATH) -> List[str]:
+    """อ่านคำจากไฟล์พจนานุกรม (หนึ่งคำต่อบรรทัด บรรทัดที่ขึ้นต้นด้วย # เป็นหมายเหตุ)"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+class ThaiTokenizer:
+    """ตัวตัดคำจากพจนานุกรมที่คอมไพล์แล้ว (thread-safe)"""
+
+    def __init__(self, words: Iterable[str], cache_size: int = THAI_SEGMENT_CACHE_SIZE):
+        # prefix ของทุกคำ -> เป็นคำในพจนานุกรมหรือไม่ (trie แบบแบน: เดินด้วยการ slice แทน node)
+        self._prefixes: Dict[str, bool] = {}
+        for word in words:
+            for end in range(1, len(word)):
+                self._prefixes.setdefault(word[:end], False)
+            self._prefixes[word] = True
+        self._max_length = max((len(prefix) for prefix in self._prefixes), default=0)
+        self._segment = lru_cache(maxsize=cache_size)(self._segment_run)
+
+    def __len__(self) -> int:
+        return sum(self._prefixes.values())
+
+    def tokenize(self, text: str) -> List[str]:
+        """ตัดข้อความเป็นรายการคำ (อักษรละตินเป็นตัวเล็ก ไม่มีช่องว่างและเครื่องหมาย)"""
+        tokens: List[str] = []
+        for run in _RUN_PATTERN.findall(text.lower()):
+            if 'ก' <= run[0] <= '๛':
+                tokens.extend(self._segment(run))
+            else:
+                tokens.append(run)
+        return tokens
+
+    def _segment_run(self, run: str) -> Tuple[str, ...]:
+        """ตัดช่วงอักษรไทยหนึ่งช่วง (dynamic programming บนตำแหน่งที่ตัดได้)"""
+        n = len(run)
+        boundary = [True] + [
+            char not in _NON_INITIAL and previous not in _LEADING_VOWELS
+            for previous, char in zip(run, run[1:])
+        ] + [True]
+
+        # cost = อักษรนอกพจนานุกรม * (n + 1) + จำนวนคำ (เทียบอักษรนอกพจนานุกรมก่อน แล้วจึงจำนวนคำ)
+        # back = ตำแหน่งเริ่มของคำสุดท้าย (ติดลบ = ส่วนที่ไม่รู้จัก เริ่มที่ -back - 1)
+        unknown_weight = n + 1
+        infinity = unknown_weight * unknown_weight
+        cost = [infinity] * (n + 1)
+        back = [0] * (n + 1)
+        cost[0] = 0
+        prefixes = self._prefixes
+        max_length = self._max_length
+
+        for start in range(n):
+            current = cost[start]
+            if current == infinity:
+                continue
+            word_cost = current + 1
+
+            for end in range(start + 1, (start + max_length if start + max_length < n else n) + 1):
+                is_word = prefixes.get(run[start:end])
+                if is_word is None:
+                    break
+                if is_word and boundary[end] and word_cost < cost[end]:
+                    cost[end] = word_cost
+                    back[end] = start
+
+            # ข้ามไปจุดตัดถัดไปเป็นส่วนที่ไม่รู้จัก
+            end = start + 1
+            while not boundary[end]:
+                end += 1
+            unknown_cost = word_cost + unknown_weight * (end - start)
+            if unknown_cost < cost[end]:
+                cost[end] = unknown_cost
+                back[end] = -start - 1
+
+        # ย้อนจากท้าย รวมส่วนที่ไม่รู้จักที่ติดกันเป็นคำเดียว
+        tokens: List[str] = []
+        end = n
+        unknown_end = None
+        while end > 0:
+            start = back[end]
+            if start >= 0:
+                if unknown_end is not None:
+                    tokens.append(run[end:unknown_end])
+                    unknown_end = None
+                tokens.append(run[start:end])
+            else:
+                start = -start - 1
+                if unknown_end is None:
+                    unknown_end = end
+            end = start
+        if unknown_end is not None:
+            tokens.append(run[:unknown_end])
+        tokens.reverse()
+        return tuple(tokens)
+
+    def cache_info(self):
+        """สถิติแคชผลตัดคำ (hits, misses, maxsize, currsize)"""
+        return self._segment.cache_info()
+
+_shared_tokenizer: Optional[ThaiTokenizer] = None
+_shared_lock = threading.Lock()
+
+def get_thai_tokenizer() -> ThaiTokenizer:
+    """ตัวตัดคำที่ใช้ร่วมกันทั้ง process (โหลดพจนานุกรมครั้งแรกที่เรียก)"""
+    global _shared_tokenizer
+    if _shared_tokenizer is None:
+        with _shared_lock:
+            if _shared_tokenizer is None:
+                _shared_tokenizer = ThaiTokenizer(load_dictionary())
+    return _shared_tokenizer
+
+def tokenize(text: str) -> List[str]:
+    """ตัดคำด้วยตัวตัดคำที่ใช้ร่วมกัน"""
+    return get_thai_tokenizer().tokenize(text)
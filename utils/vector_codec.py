@@ -0,0 +1,68 @@
+# แปลง embedding vector เป็น binary สำหรับเก็บในคอลัมน์ BLOB
+# รูปแบบ: 1 byte บอกชนิดข้อมูล ตามด้วยข้อมูล vector
+#   float32 - 4 bytes ต่อค่า (ค่าเริ่มต้น)
+#   float16 - 2 bytes ต่อค่า
+#   int8    - scale แบบ float32 4 bytes แล้วตามด้วย 1 byte ต่อค่า (quantized)
+
+import json
+from typing import Any, List, Optional, Union
+import numpy as np
+from utils.config import EMBEDDING_STORAGE_DTYPE
+
+FORMAT_FLOAT32 = 1
+FORMAT_FLOAT16 = 2
+FORMAT_INT8 = 3
+
+FORMAT_CODES = {
+    'float32': FORMAT_FLOAT32,
+    'float16': FORMAT_FLOAT16,
+    'int8': FORMAT_INT8,
+}
+
+def encode_vector(vector: Union[List[float], np.ndarray], dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    """แปลง vector เป็น bytes ตามชนิดข้อมูลที่กำหนด"""
+    if dtype not in FORMAT_CODES:
+        raise ValueError(f"ไม่รองรับชนิดข้อมูล embedding: {dtype}")
+
+    values = np.asarray(vector, dtype=np.float32)
+    code = FORMAT_CODES[dtype]
+
+    if code == FORMAT_FLOAT32:
+        payload = values.tobytes()
+    elif code == FORMAT_FLOAT16:
+        payload = values.astype(np.float16).tobytes()
+    else:
+        max_abs = float(np.max(np.abs(values))) if values.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        quantized = np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+        payload = np.float32(scale).tobytes() + quantized.tobytes()
+
+    return bytes([code]) + payload
+
+def decode_vector(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """แปลง bytes กลับเป็น np.ndarray ชนิด float32 (อ่านตรงจาก buffer ด้วย np.frombuffer)"""
+    if not data:
+        return None
+
+    data = bytes(data)
+    code = data[0]
+
+    if code == FORMAT_FLOAT32:
+        return np.frombuffer(data, dtype=np.float32, offset=1)
+    if code == FORMAT_FLOAT16:
+        return np.frombuffer(data, dtype=np.float16, offset=1).astype(np.float32)
+    if code == FORMAT_INT8:
+        scale = np.frombuffer(data, dtype=np.float32, count=1, offset=1)[0]
+        return np.frombuffer(data, dtype=np.int8, offset=5).astype(np.float32) * scale
+
+    raise ValueError(f"ไม่รู้จักรูปแบบ embedding (code {code})")
+
+def json_to_blob(json_vector: Any, dtype: str = EMBEDDING_STORAGE_DTYPE) -> Optional[bytes]:
+    """แปลง embedding ที่เก็บเป็น JSON แบบเดิมเป็น binary (ใช้ตอน migrate)"""
+    if json_vector is None:
+        return None
+
+    values = json.loads(json_vector) if isinstance(json_vector, (str, bytes)) else json_vector
+    if not values:
+        return None
+    return encode_vector(values, dtype)